@@ -1,18 +1,32 @@
 #!/usr/bin/env python3
 import argparse
 import configparser
+import csv
 import datetime
+import gzip
+import hashlib
+import heapq
 import itertools
 import json
+import math
+import random
+import shlex
+import subprocess
 import sys
+import threading
+from array import array
+from bisect import bisect_left
 from collections import Counter, defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from copy import deepcopy
-from os.path import isfile
-from time import sleep
-from typing import Union, Any, ClassVar, Optional, Dict, List, Tuple
+from os import listdir
+from os.path import isfile, join
+from time import sleep, monotonic, perf_counter, time_ns
+from typing import Union, Any, ClassVar, Optional, Dict, List, Tuple, Iterable, Iterator, Callable
 from abc import ABC, abstractmethod
 
 import redis
+from redis.crc import key_slot
 
 
 class Inventory(ABC):
@@ -27,7 +41,8 @@ class Inventory(ABC):
 
         :rtype: Dict[str, str]
         :param ip_addr: 127.0.0.1 for example
-        :return: prepared dict like {ip: ip, dc: dc, fqdn: fqdn}
+        :return: prepared dict like {ip: ip, dc: dc, fqdn: fqdn}, optional region and rack keys are failure domains of host
+         and capacity key is capacity weight of host
         """
         pass
 
@@ -48,6 +63,1147 @@ class MyInventory(Inventory):
         return {"ip": "127.0.0.1", "dc": "DC1", "fqdn": "fqdn"}
 
 
+class SnapshotInventory(Inventory):
+    """
+    inventory answers saved in nodes snapshot, replays snapshot without inventory api
+    """
+
+    def __init__(self, answers: Dict[str, Dict[str, Any]]):
+        """
+        initial func
+
+        :param answers: dict like {ip: {ip: ip, dc: dc, fqdn: fqdn}}
+        """
+        self.answers: Dict[str, Dict[str, Any]] = answers
+
+    def get_ip_info(self, ip_addr: str) -> Dict[str, str]:
+        """
+        return saved inventory answer
+
+        :rtype: dict
+        :param ip_addr: 127.0.0.1 for example
+        :return: prepared dict like {ip: ip, dc: dc, fqdn: fqdn}
+        """
+        return self.answers[ip_addr]
+
+
+class PlanCost:
+    """
+    cost function for search planner, override methods for own weights
+    """
+
+    # replica deficit opened by plan step is fixed by one replicate, so it is charged like replicate, not like problem
+    TRANSIENT_CHECKS: ClassVar[Tuple[str, ...]] = ('desired_replica_count', 'without_slaves')
+
+    def __init__(self, failover: float = 1.0, replicate: float = 10.0, skew: float = 2.0, problem: float = 100.0):
+        """
+        initial func
+
+        :param failover: cost of one CLUSTER FAILOVER step
+        :param replicate: cost of one CLUSTER REPLICATE step (full sync)
+        :param skew: cost of one master that must be moved for skew within allowed skew, more than failover cost so fix of skew
+         is always cheaper than residual skew
+        :param problem: cost of one residual problem from check_* methods
+        """
+        self.failover: float = failover
+        self.replicate: float = replicate
+        self.skew: float = skew
+        self.problem: float = problem
+
+    def step(self, step: Tuple[str, ...]) -> float:
+        """
+        return cost of one plan step
+
+        :param step: tuple like ('CLUSTER FAILOVER', slavenodeid) or ('CLUSTER REPLICATE', slavenodeid, masternodeid)
+        :return: step cost
+        """
+        if step[0] == 'CLUSTER REPLICATE':
+            return self.replicate
+        return self.failover
+
+    def transient(self, problems: Counter, initial: Counter) -> int:
+        """
+        return number of problems of TRANSIENT_CHECKS that plan opened over problems before plan
+
+        :param problems: Counter like {'check_name': problems_count}
+        :param initial: problems of nodes before plan
+        :return: problems count
+        """
+        return sum(map(lambda check: max(0, problems[check] - initial[check]), self.TRANSIENT_CHECKS))
+
+    def residual(self, problems: Counter, skews: Dict[str, int], initial: Counter = None) -> float:
+        """
+        return estimated cost of nodes state that still has problems, used as heuristic
+
+        :param problems: Counter like {'check_name': problems_count}
+        :param skews: dict like {'group': masters_count_to_move}
+        :param initial: problems of nodes before plan, problems opened by plan in TRANSIENT_CHECKS are charged like replicate
+        :return: residual cost
+        """
+        transient = self.transient(problems, initial) if initial is not None else 0
+        return self.problem * (sum(problems.values()) - transient) + self.replicate * transient + self.skew * sum(skews.values())
+
+
+class PlanSimulator:
+    """
+    discrete-event simulator of plan execution, override duration method for own step duration model
+    """
+
+    def __init__(self, timeout: int = 90, failover_time: float = 10.0, sync_time: float = 300.0, host_syncs: int = 1,
+                 datacenter_syncs: int = 2):
+        """
+        initial func
+
+        :param timeout: timeout between operations of serial execution
+        :param failover_time: seconds for failover convergence after replica catch-up
+        :param sync_time: seconds of full sync if plan step doesn't have estimation
+        :param host_syncs: maximum concurrent full syncs per server in parallel execution
+        :param datacenter_syncs: maximum concurrent full syncs per datacenter in parallel execution
+        """
+        self.timeout: int = timeout
+        self.failover_time: float = failover_time
+        self.sync_time: float = sync_time
+        self.host_syncs: int = host_syncs
+        self.datacenter_syncs: int = datacenter_syncs
+
+    def duration(self, step: Dict[str, Any]) -> float:
+        """
+        return seconds from step start till cluster converged
+
+        :param step: step of RedisClusterTool.get_simulation_steps
+        :return: step duration
+        """
+        if step['sync']:
+            return step['sync_time'] if step['sync_time'] else self.sync_time
+        return self.failover_time + step['catch_up']
+
+    @staticmethod
+    def get_dependencies(steps: List[Dict[str, Any]]) -> List[List[int]]:
+        """
+        return indexes of previous steps that share nodes with every step
+
+        :param steps: steps of RedisClusterTool.get_simulation_steps
+        :return: list like [[], [0], [0, 1]]
+        """
+        return [[index for index in range(step_index) if steps[index]['nodes'] & step['nodes']]
+                for step_index, step in enumerate(steps)]
+
+    def run(self, steps: List[Dict[str, Any]], strategy: str = 'parallel') -> Dict[str, Any]:
+        """
+        simulate execution of steps
+
+        serial: every step starts after previous step converged and not earlier than timeout after previous start
+        parallel: every step starts when steps with the same nodes converged and full sync limits per server and datacenter allow
+
+        :param steps: steps of RedisClusterTool.get_simulation_steps
+        :param strategy: serial or parallel
+        :return: dict like {'strategy': 'parallel', 'timeline': [(start, end), ...], 'duration': 600.0, 'critical_path': [0, 2], 'peak_syncs': 2}
+        """
+        starts: List[float] = [0.0] * len(steps)
+        ends: List[float] = [0.0] * len(steps)
+        # step that delayed start of every step, for critical path
+        causes: List[Optional[int]] = [None] * len(steps)
+
+        if strategy == 'serial':
+            for index, step in enumerate(steps):
+                if index:
+                    starts[index] = max(ends[index - 1], starts[index - 1] + self.timeout)
+                    causes[index] = index - 1
+                ends[index] = starts[index] + self.duration(step)
+        elif strategy == 'parallel':
+            dependencies = self.get_dependencies(steps)
+            pending: List[int] = list(range(len(steps)))
+            finished: set = set()
+            running: List[Tuple[float, int]] = []
+            host_syncs: Counter = Counter()
+            datacenter_syncs: Counter = Counter()
+            now, last_finished = 0.0, None
+            while pending:
+                for index in list(pending):
+                    step = steps[index]
+                    if not all(map(lambda dependency: dependency in finished, dependencies[index])):
+                        continue
+                    if step['sync'] and (any(map(lambda host: host_syncs[host] >= self.host_syncs, step['hosts'])) or
+                                         any(map(lambda dc: datacenter_syncs[dc] >= self.datacenter_syncs, step['datacenters']))):
+                        continue
+                    starts[index], ends[index] = now, now + self.duration(step)
+                    latest_dependency = max(dependencies[index], key=lambda dependency: ends[dependency], default=None)
+                    causes[index] = latest_dependency if latest_dependency is not None and ends[latest_dependency] == now else last_finished
+                    if step['sync']:
+                        host_syncs.update(step['hosts'])
+                        datacenter_syncs.update(step['datacenters'])
+                    heapq.heappush(running, (ends[index], index))
+                    pending.remove(index)
+                if not running:
+                    if pending:
+                        raise Exception(f"Can't simulate plan, step {pending[0]} can't be started with sync limits "
+                                        f"{self.host_syncs} per server and {self.datacenter_syncs} per datacenter")
+                    break
+                now, last_finished = heapq.heappop(running)
+                finished.add(last_finished)
+                if steps[last_finished]['sync']:
+                    host_syncs.subtract(steps[last_finished]['hosts'])
+                    datacenter_syncs.subtract(steps[last_finished]['datacenters'])
+        else:
+            raise Exception(f"Unknown simulation strategy {strategy}")
+
+        # critical path goes back from the last converged step over delaying steps
+        critical_path: List[int] = []
+        index = max(range(len(steps)), key=lambda step_index: ends[step_index], default=None)
+        while index is not None:
+            critical_path.insert(0, index)
+            index = causes[index]
+
+        # peak of concurrent full syncs, sync ends before another starts at the same time
+        sync_events = sorted([(starts[index], 1) for index, step in enumerate(steps) if step['sync']] +
+                             [(ends[index], -1) for index, step in enumerate(steps) if step['sync']])
+        peak_syncs = max(itertools.accumulate(map(lambda event: event[1], sync_events)), default=0)
+
+        return {'strategy': strategy, 'timeline': list(zip(starts, ends)), 'duration': max(ends, default=0.0),
+                'critical_path': critical_path, 'peak_syncs': peak_syncs}
+
+
+class HealthGate:
+    """
+    health gates that are checked before every plan step, override check method for own gates
+    """
+
+    def __init__(self, max_latency: Optional[float] = 100.0, max_ops: Optional[int] = None, min_backoff: float = 5.0,
+                 max_backoff: float = 300.0, max_wait: float = 3600.0):
+        """
+        initial func
+
+        :param max_latency: maximum PING latency of node in milliseconds, None to skip check
+        :param max_ops: maximum instantaneous_ops_per_sec of node, None to skip check
+        :param min_backoff: first pause in seconds when cluster is not healthy
+        :param max_backoff: maximum pause in seconds, pause is doubled while cluster is not healthy
+        :param max_wait: maximum seconds to wait for healthy cluster before step
+        """
+        self.max_latency: Optional[float] = max_latency
+        self.max_ops: Optional[int] = max_ops
+        self.min_backoff: float = min_backoff
+        self.max_backoff: float = max_backoff
+        self.max_wait: float = max_wait
+
+    def check(self, node: Dict[str, Any], info: Dict[str, Any], cluster_info: Dict[str, Any], latency: float) -> List[str]:
+        """
+        return health problems of node
+
+        :param node: node dict
+        :param info: INFO answer of node
+        :param cluster_info: CLUSTER INFO answer of node
+        :param latency: PING latency in milliseconds
+        :return: list of problems descriptions, empty if node is healthy
+        """
+        problems = []
+        if cluster_info.get('cluster_state') != 'ok':
+            problems.append(f"cluster_state:{cluster_info.get('cluster_state')}")
+        if info.get('master_sync_in_progress'):
+            problems.append('master_sync_in_progress')
+        if info.get('rdb_bgsave_in_progress'):
+            problems.append('rdb_bgsave_in_progress')
+        if info.get('aof_rewrite_in_progress'):
+            problems.append('aof_rewrite_in_progress')
+        if self.max_latency is not None and latency > self.max_latency:
+            problems.append(f'latency {round(latency, 2)}ms > {self.max_latency}ms')
+        if self.max_ops is not None and int(info.get('instantaneous_ops_per_sec', 0)) > self.max_ops:
+            problems.append(f"instantaneous_ops_per_sec {info.get('instantaneous_ops_per_sec')} > {self.max_ops}")
+        return problems
+
+    def backoff(self, attempt: int) -> float:
+        """
+        return pause before next health check
+
+        :param attempt: number of failed health checks in a row, from 0
+        :return: seconds
+        """
+        return min(self.max_backoff, self.min_backoff * 2 ** attempt)
+
+
+class WriteProbe:
+    """
+    background writer of sentinel key in slot of shard, that measures write unavailability, redirects and latency of shard
+    while it's failed over
+    """
+
+    KEY_PREFIX: ClassVar[str] = 'redisclustertool:probe'
+    # sentinel keys by slot
+    SLOT_KEYS: ClassVar[Dict[int, str]] = dict()
+
+    def __init__(self, host: str, port: int, slot: int, passwd: str = None, interval: float = 0.01, timeout: float = 1.0):
+        """
+        initial func
+
+        :param host: host of shard master
+        :param port: port of shard master
+        :param slot: slot of shard for sentinel key
+        :param passwd: redis password
+        :param interval: seconds between probes
+        :param timeout: socket timeout in seconds of every probe
+        """
+        self.host: str = host
+        self.port: int = port
+        self.key: str = self.get_slot_key(slot)
+        self.passwd: str = passwd
+        self.interval: float = interval
+        self.timeout: float = timeout
+        self.latencies: List[float] = list()
+        self.windows: List[float] = list()
+        self.redirects: int = 0
+        self.errors: int = 0
+        self.started: Optional[datetime.datetime] = None
+        self.stopped: threading.Event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def get_slot_key(cls, slot: int) -> str:
+        """
+        return sentinel key with hash tag of slot
+
+        :param slot: slot number
+        :return: key like 'redisclustertool:probe:{123}'
+        """
+        if slot not in cls.SLOT_KEYS:
+            for tag in itertools.count():
+                if key_slot(str(tag).encode('utf-8')) == slot:
+                    cls.SLOT_KEYS[slot] = f'{cls.KEY_PREFIX}:{{{tag}}}'
+                    break
+        return cls.SLOT_KEYS[slot]
+
+    def start(self) -> None:
+        """
+        start probes in background thread
+
+        :return: None
+        """
+        self.started = datetime.datetime.now()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        """
+        write and read sentinel key until stop, MOVED redirects are followed to new master of slot
+
+        :return: None
+        """
+        connection = redis.Redis(host=self.host, port=self.port, password=self.passwd, socket_timeout=self.timeout)
+        # start of first failed probe after successful one
+        outage_start: Optional[float] = None
+        while not self.stopped.is_set():
+            start = perf_counter()
+            try:
+                value = str(time_ns())
+                connection.set(self.key, value, ex=60)
+                if connection.get(self.key) != value.encode('utf-8'):
+                    raise redis.exceptions.ResponseError('sentinel value mismatch')
+            except redis.exceptions.RedisError as e:
+                if str(e).startswith('MOVED'):
+                    self.redirects += 1
+                    host, port = str(e).split()[-1].rsplit(':', 1)
+                    connection = redis.Redis(host=host, port=int(port), password=self.passwd, socket_timeout=self.timeout)
+                else:
+                    self.errors += 1
+                if outage_start is None:
+                    outage_start = start
+            else:
+                end = perf_counter()
+                self.latencies.append((end - start) * 1000)
+                # write is unavailable from the first failed probe till the end of successful one
+                self.windows.append(end - (outage_start if outage_start is not None else start))
+                outage_start = None
+            self.stopped.wait(self.interval)
+        if outage_start is not None:
+            self.windows.append(perf_counter() - outage_start)
+
+    def stop(self) -> Dict[str, Any]:
+        """
+        stop probes and return measurements
+
+        :return: dict like {'started': 'iso date', 'unavailable': seconds, 'redirects': 1, 'errors': 0, 'probes': 100,
+         'p50': ms, 'p99': ms, 'max': ms}
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        latencies = sorted(self.latencies)
+
+        def percentile(percent: float) -> Optional[float]:
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))], 2) if latencies else None
+
+        return {'started': self.started.isoformat(timespec='milliseconds') if self.started else None,
+                'unavailable': round(max(self.windows), 3) if self.windows else None, 'redirects': self.redirects,
+                'errors': self.errors, 'probes': len(latencies) + self.errors + self.redirects,
+                'p50': percentile(50), 'p99': percentile(99), 'max': round(latencies[-1], 2) if latencies else None}
+
+
+class RetryPolicy:
+    """
+    retry policy of cluster commands: jittered exponential backoff with total deadline
+    """
+    # errors that can't be fixed by retry, checked before retryable errors (AuthenticationError is ConnectionError)
+    FATAL_ERRORS: ClassVar[Tuple[type, ...]] = (redis.exceptions.AuthenticationError, redis.exceptions.NoPermissionError)
+    RETRYABLE_ERRORS: ClassVar[Tuple[type, ...]] = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError,
+                                                    redis.exceptions.TryAgainError, redis.exceptions.ClusterDownError,
+                                                    redis.exceptions.MasterDownError)
+    # error replies of redis that are temporary
+    RETRYABLE_REPLIES: ClassVar[Tuple[str, ...]] = ('LOADING', 'TRYAGAIN', 'CLUSTERDOWN', 'MASTERDOWN', 'BUSY')
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 120.0, deadline: float = 600.0):
+        """
+        initial func
+
+        :param base_delay: delay before first retry in seconds, doubled for every next retry
+        :param max_delay: maximum delay between retries in seconds
+        :param deadline: maximum seconds for command with all retries
+        """
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.deadline: float = deadline
+
+    def is_retryable(self, error: Exception) -> bool:
+        """
+        return True if command can be retried after error
+
+        :param error: exception of command
+        :return: bool
+        """
+        if isinstance(error, self.FATAL_ERRORS):
+            return False
+        if isinstance(error, self.RETRYABLE_ERRORS):
+            return True
+        return isinstance(error, redis.exceptions.ResponseError) and str(error).startswith(self.RETRYABLE_REPLIES)
+
+    def delay(self, attempt: int) -> float:
+        """
+        return delay before retry with full jitter
+
+        :param attempt: number of retry, from 0
+        :return: seconds
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class MasterCounter(Counter):
+    """
+    masters count (or weight) per group with skew percentage after one master move without recount of nodes,
+    percentages are proportional to capacity of groups
+    """
+
+    def __init__(self, counts: Dict[str, int], capacities: Dict[str, float] = None):
+        """
+        initial func
+
+        :param counts: dict like {'group': masters_count_or_weight}, groups without masters must be defined with zero
+        :param capacities: dict like {'group': capacity}, equal capacities if not defined
+        """
+        super().__init__(counts)
+        self.total: int = sum(counts.values())
+        self.histogram: Counter = Counter(self.values())
+        # percentage factor of group is average capacity / group capacity, None if capacities are equal
+        self.factors: Optional[Dict[str, float]] = None
+        if capacities and len(set(map(lambda group: capacities.get(group, 1), counts))) > 1:
+            average = sum(map(lambda group: capacities.get(group, 1), counts)) / len(counts)
+            self.factors = {group: average / capacities.get(group, 1) for group in counts}
+
+    def percent(self, count: int, total: int = None, group: str = None) -> float:
+        """
+        return masters percentage of group with count masters, rounded like check_group_master_distribution
+
+        :param count: masters count of group
+        :param total: all masters count, self.total if not defined
+        :param group: group for capacity factor
+        :return: percent
+        """
+        if total is None:
+            total = self.total
+        factor = self.factors[group] if self.factors and group is not None else 1
+        return round((100 / total) * count * factor, 2) if total != 0 else 0
+
+    def skew(self, positive: bool = False, decrement: str = None, increment: str = None, weight: int = 1) -> float:
+        """
+        return max-min masters percentage difference, optionally after master move between groups
+
+        :param positive: skip groups without masters for min value
+        :param decrement: group that lose master
+        :param increment: group that get master
+        :param weight: weight of moved master
+        :return: skew percent
+        """
+        if decrement is not None and decrement == increment:
+            decrement = increment = None
+        decremented = self[decrement] if decrement is not None else None
+        incremented = self[increment] if increment is not None else None
+        total = self.total - (weight if decrement is not None else 0) + (weight if increment is not None else 0)
+        if self.factors:
+            # percentages depend on group capacity, so groups are compared one by one
+            percents = []
+            for group, count in self.items():
+                count += (weight if group == increment else 0) - (weight if group == decrement else 0)
+                if not positive or count > 0:
+                    percents.append(self.percent(count, total, group=group))
+            return round(max(percents) - min(percents), 2) if percents else 0
+        maximum, minimum = None, None
+        for count in itertools.chain(self.histogram, (decremented - weight if decremented is not None else -1,
+                                                      incremented + weight if incremented is not None else -1)):
+            if count < 0 or (positive and count == 0):
+                continue
+            groups_with_count = self.histogram[count] - (decremented == count) + (decremented == count + weight) \
+                - (incremented == count) + (incremented == count - weight)
+            if groups_with_count <= 0:
+                continue
+            maximum = count if maximum is None else max(maximum, count)
+            minimum = count if minimum is None else min(minimum, count)
+        if maximum is None:
+            return 0
+        return round(self.percent(maximum, total) - self.percent(minimum, total), 2)
+
+    def excess(self, skew: float, decrement: str = None, increment: str = None, weight: int = 1, unit: float = 1) -> int:
+        """
+        return number of masters to move for max-min masters percentage difference within skew, optionally after master move
+        between groups. Groups are compared with band of skew width around equal percentage, so every move of master out of
+        overloaded or into underloaded group decreases result even when max-min difference is the same
+
+        :param skew: max-min percentage difference
+        :param decrement: group that lose master
+        :param increment: group that get master
+        :param weight: weight of moved master
+        :param unit: weight of one master for result, average master weight for weighted counters
+        :return: masters count
+        """
+        if self.skew(decrement=decrement, increment=increment, weight=weight) <= skew:
+            return 0
+        if decrement is not None and decrement == increment:
+            decrement = increment = None
+        total = self.total - (weight if decrement is not None else 0) + (weight if increment is not None else 0)
+        # percent of every group is equal when masters are proportional to capacity
+        average = 100 / len(self)
+        excess = 0
+        for group, count in self.items():
+            count += (weight if group == increment else 0) - (weight if group == decrement else 0)
+            distance = abs(self.percent(count, total, group=group) - average) - skew / 2
+            if distance > 0:
+                excess += math.ceil(round(distance / self.percent(unit, total, group=group), 6))
+        return excess
+
+    def move(self, decrement: str = None, increment: str = None, weight: int = 1) -> None:
+        """
+        apply master move between groups
+
+        :param decrement: group that lose master
+        :param increment: group that get master
+        :param weight: weight of moved master
+        :return: None
+        """
+        for group, change in ((decrement, -weight), (increment, weight)):
+            if group is None:
+                continue
+            self.histogram[self[group]] -= 1
+            self[group] += change
+            self.histogram[self[group]] += 1
+            self.total += change
+        self.histogram = +self.histogram
+
+
+class MasterDistribution:
+    """
+    master counters per group and per host in group for delta scoring of failovers
+    """
+
+    def __init__(self, nodes_groups: Dict[str, List[Dict[str, Any]]], weight: Callable[[Dict[str, Any]], int] = None,
+                 groups_capacity: Dict[str, float] = None, hosts_capacity: Dict[str, float] = None):
+        """
+        initial func
+
+        :param nodes_groups: dict like {'group1': [node1, node2]} from get_nodes_groups
+        :param weight: function that return weight of master node, every master weight is 1 if not defined
+        :param groups_capacity: dict like {'group1': capacity}, equal capacities if not defined
+        :param hosts_capacity: dict like {'host1': capacity}, equal capacities if not defined
+        """
+        self.nodes: Dict[str, Dict[str, Any]] = dict()
+        self.node_group: Dict[str, str] = dict()
+        self.weights: Dict[str, int] = dict()
+        groups_count: Dict[str, int] = dict()
+        hosts_count: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for group, groupnodes in nodes_groups.items():
+            groups_count[group] = 0
+            for node in groupnodes:
+                self.nodes[node['node_id']] = node
+                self.node_group[node['node_id']] = group
+                hosts_count[group].setdefault(node['host'], 0)
+                if 'master' in node['flags']:
+                    self.weights[node['node_id']] = weight(node) if weight else 1
+                    groups_count[group] += self.weights[node['node_id']]
+                    hosts_count[group][node['host']] += self.weights[node['node_id']]
+        self.groups: MasterCounter = MasterCounter(groups_count, capacities=groups_capacity)
+        self.hosts: Dict[str, MasterCounter] = {group: MasterCounter(counts, capacities=hosts_capacity)
+                                                for group, counts in hosts_count.items()}
+
+    def failover_skew(self, slavenodeid: str, masternodeid: str = None, positive: bool = True) -> float:
+        """
+        return skew between groups after failover of slavenodeid
+
+        :param slavenodeid: id of slave node
+        :param masternodeid: id of master node, master of slavenodeid if not defined
+        :param positive: skip groups without masters for min value
+        :return: skew percent
+        """
+        if masternodeid is None:
+            masternodeid = self.nodes[slavenodeid]['master_id']
+        return self.groups.skew(positive=positive, decrement=self.node_group[masternodeid], increment=self.node_group[slavenodeid],
+                                weight=self.weights[masternodeid])
+
+    def failover_in_group_skew(self, group: str, slavenodeid: str, masternodeid: str = None) -> float:
+        """
+        return skew between hosts of group after failover of slavenodeid
+
+        :param group: group for skew
+        :param slavenodeid: id of slave node
+        :param masternodeid: id of master node, master of slavenodeid if not defined
+        :return: skew percent
+        """
+        if masternodeid is None:
+            masternodeid = self.nodes[slavenodeid]['master_id']
+        decrement = self.nodes[masternodeid]['host'] if self.node_group[masternodeid] == group else None
+        increment = self.nodes[slavenodeid]['host'] if self.node_group[slavenodeid] == group else None
+        return self.hosts[group].skew(decrement=decrement, increment=increment, weight=self.weights[masternodeid])
+
+    def failover_excess(self, slavenodeid: str, skew: float, masternodeid: str = None) -> int:
+        """
+        return number of masters to move between groups for skew after failover of slavenodeid
+
+        :param slavenodeid: id of slave node
+        :param skew: max-min percentage difference
+        :param masternodeid: id of master node, master of slavenodeid if not defined
+        :return: masters count
+        """
+        if masternodeid is None:
+            masternodeid = self.nodes[slavenodeid]['master_id']
+        return self.groups.excess(skew, decrement=self.node_group[masternodeid], increment=self.node_group[slavenodeid],
+                                  weight=self.weights[masternodeid], unit=self.unit())
+
+    def failover_in_group_excess(self, group: str, slavenodeid: str, skew: float, masternodeid: str = None) -> int:
+        """
+        return number of masters to move between hosts of group for skew after failover of slavenodeid
+
+        :param group: group for skew
+        :param slavenodeid: id of slave node
+        :param skew: max-min percentage difference
+        :param masternodeid: id of master node, master of slavenodeid if not defined
+        :return: masters count
+        """
+        if masternodeid is None:
+            masternodeid = self.nodes[slavenodeid]['master_id']
+        decrement = self.nodes[masternodeid]['host'] if self.node_group[masternodeid] == group else None
+        increment = self.nodes[slavenodeid]['host'] if self.node_group[slavenodeid] == group else None
+        return self.hosts[group].excess(skew, decrement=decrement, increment=increment, weight=self.weights[masternodeid],
+                                        unit=self.unit())
+
+    def unit(self) -> float:
+        """
+        return average master weight
+
+        :return: weight
+        """
+        return self.groups.total / len(self.weights) if self.weights else 1
+
+    def failover(self, slavenodeid: str, masternodeid: str) -> None:
+        """
+        apply failover of slavenodeid to counters
+
+        :param slavenodeid: id of slave node
+        :param masternodeid: id of master node
+        :return: None
+        """
+        master_group, slave_group = self.node_group[masternodeid], self.node_group[slavenodeid]
+        # slots and dataset of shard move with master role
+        weight = self.weights.pop(masternodeid)
+        self.weights[slavenodeid] = weight
+        self.groups.move(decrement=master_group, increment=slave_group, weight=weight)
+        if master_group == slave_group:
+            self.hosts[master_group].move(decrement=self.nodes[masternodeid]['host'], increment=self.nodes[slavenodeid]['host'],
+                                          weight=weight)
+        else:
+            self.hosts[master_group].move(decrement=self.nodes[masternodeid]['host'], weight=weight)
+            self.hosts[slave_group].move(increment=self.nodes[slavenodeid]['host'], weight=weight)
+
+
+class FailureDomains:
+    """
+    failure domains tree (region -> datacenter -> rack -> host) of nodes with per level counters of masters and shard members,
+    levels without attribute in all nodes are skipped. Tool checks only region and rack levels by the tree
+    (FAILURE_DOMAIN_CHECK_LEVELS), datacenter and host levels are kept for domain paths and checked by groups
+    """
+
+    LEVELS: ClassVar[Tuple[str, ...]] = ('region', 'datacenter', 'rack', 'host')
+
+    def __init__(self, nodes: List[Dict[str, Any]], weight: Callable[[Dict[str, Any]], int] = None):
+        """
+        initial func
+
+        :param nodes: nodes list
+        :param weight: function that return weight of master node, every master weight is 1 if not defined
+        """
+        self.levels: List[str] = [level for level in self.LEVELS if nodes and all(map(lambda node: node.get(level) is not None, nodes))]
+        # domain of lower level includes upper levels, so racks with the same name in different datacenters differ
+        self.domains: Dict[str, Dict[str, str]] = {level: dict() for level in self.levels}
+        self.masters: Dict[str, Counter] = {level: Counter() for level in self.levels}
+        self.shards: Dict[str, Dict[str, Counter]] = {level: defaultdict(Counter) for level in self.levels}
+        self.shard_of: Dict[str, str] = dict()
+        for node in nodes:
+            is_master = 'master' in node['flags']
+            self.shard_of[node['node_id']] = node['node_id'] if is_master else node['master_id']
+            path = []
+            for level in self.levels:
+                path.append(str(node[level]))
+                domain = '/'.join(path)
+                self.domains[level][node['node_id']] = domain
+                self.masters[level][domain] += (weight(node) if weight else 1) if is_master else 0
+                self.shards[level][self.shard_of[node['node_id']]][domain] += 1
+
+    def conflicts(self, nodeid: str, masternodeid: str, levels: Iterable[str] = LEVELS) -> int:
+        """
+        return number of shard members that share failure domain with node on levels, node itself isn't counted
+
+        :param nodeid: node id
+        :param masternodeid: master id of shard
+        :param levels: levels for check, missing levels are skipped
+        :return: conflicts count
+        """
+        conflicts = 0
+        for level in filter(lambda level: level in self.domains, levels):
+            conflicts += self.shards[level][masternodeid][self.domains[level][nodeid]] - (self.shard_of[nodeid] == masternodeid)
+        return conflicts
+
+    def replicate(self, nodeid: str, masternodeid: str) -> None:
+        """
+        apply replicate of slave node to new master to shard counters
+
+        :param nodeid: slave node id
+        :param masternodeid: new master id
+        :return: None
+        """
+        for level in self.levels:
+            domain = self.domains[level][nodeid]
+            self.shards[level][self.shard_of[nodeid]][domain] -= 1
+            self.shards[level][masternodeid][domain] += 1
+        self.shard_of[nodeid] = masternodeid
+
+    def spread_problems(self, level: str) -> List[str]:
+        """
+        return master ids of shards that share failure domain of level while they can be spread to more domains
+
+        :param level: failure domain level
+        :return: list of master ids
+        """
+        if level not in self.domains:
+            return []
+        domains_count = len(self.masters[level])
+        return [masternodeid for masternodeid, counter in self.shards[level].items()
+                if len(+counter) < min(sum(counter.values()), domains_count)]
+
+    def masters_percentage(self, level: str) -> Dict[str, float]:
+        """
+        return masters percentage of every domain of level
+
+        :param level: failure domain level
+        :return: dict like {'region1/DC1': 50.0}
+        """
+        counter = MasterCounter(self.masters.get(level, dict()))
+        return {domain: counter.percent(count) for domain, count in counter.items()}
+
+
+class ShardProblems:
+    """
+    problems of every shard (master and its slaves) for delta scoring of failovers and replicates without recheck of nodes,
+    totals are the same as count_problems of get_problems result
+    """
+
+    def __init__(self, nodes: List[Dict[str, Any]], node_group: Dict[str, str], replicas: int, spread: bool = True,
+                 domains: FailureDomains = None, levels: Iterable[str] = ()):
+        """
+        initial func
+
+        :param nodes: nodes list
+        :param node_group: dict like {nodeid: group} of nodes reduced to maxport, other nodes are not counted as shard members
+        :param replicas: desired number of replicas
+        :param spread: slaves of one master in one group are problem, result of check_distribution_possibility
+        :param domains: failure domains tree of nodes reduced to maxport
+        :param levels: failure domains levels for check
+        """
+        self.node_group: Dict[str, str] = node_group
+        self.replicas: int = replicas
+        self.spread: bool = spread
+        self.order: List[str] = [node['node_id'] for node in nodes]
+        self.master_of: Dict[str, Optional[str]] = {node['node_id']: node['master_id'] for node in nodes}
+        self.masters: set = {node['node_id'] for node in nodes if 'master' in node['flags']}
+        self.slaves: Dict[str, List[str]] = {masternodeid: [] for masternodeid in self.masters}
+        # ids of all nodes that replicate master, nodes above maxport included
+        self.followers: Dict[str, List[str]] = defaultdict(list)
+        # fingerprint is xor of (nodeid, master_id) pairs hashes, so it is changed by steps without pass over nodes
+        self.hash: int = 0
+        for node in nodes:
+            if 'slave' in node['flags'] and node['node_id'] in node_group:
+                self.slaves.setdefault(node['master_id'], []).append(node['node_id'])
+            self.followers[node['master_id']].append(node['node_id'])
+            self.hash ^= hash((node['node_id'], node['master_id']))
+        self.domains: Dict[str, Dict[str, str]] = dict()
+        self.domains_count: Dict[str, int] = dict()
+        if domains is not None:
+            for level in filter(lambda level: level in domains.domains, levels):
+                self.domains[level] = domains.domains[level]
+                self.domains_count[level] = len(domains.masters[level])
+        self.counters: Dict[str, Counter] = {masternodeid: self.shard(masternodeid, slavenodeids)
+                                             for masternodeid, slavenodeids in self.slaves.items()}
+        self.total: Counter = sum(self.counters.values(), Counter())
+
+    def shard(self, masternodeid: str, slavenodeids: List[str], master: bool = None) -> Counter:
+        """
+        return problems of one shard
+
+        :param masternodeid: master id of shard
+        :param slavenodeids: ids of shard slaves reduced to maxport
+        :param master: master node is master, current role if not defined
+        :return: Counter like {'masterslave_in_group': 1}
+        """
+        if master is None:
+            master = masternodeid in self.masters
+        problems: Counter = Counter()
+        slave_groups = list(map(lambda nodeid: self.node_group[nodeid], slavenodeids))
+        if master:
+            if len(slavenodeids) < self.replicas:
+                problems['desired_replica_count'] += 1
+            if not slavenodeids:
+                problems['without_slaves'] += 1
+            master_group = self.node_group.get(masternodeid)
+            if master_group in slave_groups and len(slave_groups) - slave_groups.count(master_group) < self.replicas:
+                problems['masterslave_in_group'] += 1
+        groups = Counter(slave_groups)
+        if self.spread and len(groups) < self.replicas:
+            problems['slavesofmaster_in_group'] += sum(map(lambda count: count > 1, groups.values()))
+        members = slavenodeids + [masternodeid] if master and masternodeid in self.node_group else slavenodeids
+        for level, domain in self.domains.items():
+            shard_domains = len(set(map(lambda nodeid: domain[nodeid], members)))
+            if shard_domains < min(len(members), self.domains_count[level]):
+                problems['failure_domains'] += 1
+        return problems
+
+    def conflicts(self, nodeid: str, masternodeid: str) -> int:
+        """
+        return number of shard members that share failure domain with node on checked levels like FailureDomains.conflicts
+
+        :param nodeid: node id
+        :param masternodeid: master id of shard
+        :return: conflicts count
+        """
+        members = self.slaves.get(masternodeid, []) + ([masternodeid] if masternodeid in self.node_group else [])
+        return sum(map(lambda domain: sum(map(lambda member: member != nodeid and domain[member] == domain[nodeid], members)),
+                       self.domains.values()))
+
+    def fingerprint(self, changes: Dict[str, str] = None) -> int:
+        """
+        return nodes fingerprint like hash of (nodeid, master_id) pairs, optionally after changes
+
+        :param changes: dict like {nodeid: new_master_id}
+        :return: fingerprint
+        """
+        fingerprint = self.hash
+        for nodeid, masternodeid in (changes or dict()).items():
+            fingerprint ^= hash((nodeid, self.master_of[nodeid])) ^ hash((nodeid, masternodeid))
+        return fingerprint
+
+    def failover(self, slavenodeid: str) -> Tuple[Counter, int]:
+        """
+        return problems and fingerprint of nodes after failover of slavenodeid, current counters are kept
+
+        :param slavenodeid: id of slave node
+        :return: problems Counter and nodes fingerprint
+        """
+        masternodeid = self.master_of[slavenodeid]
+        # old master and other slaves become slaves of new master
+        changes = {nodeid: slavenodeid for nodeid in self.followers[masternodeid]}
+        changes.update({slavenodeid: self.master_of[masternodeid], masternodeid: slavenodeid})
+        slavenodeids = [nodeid for nodeid in self.slaves.get(masternodeid, []) if nodeid != slavenodeid]
+        if masternodeid in self.node_group:
+            slavenodeids.append(masternodeid)
+        problems = self.total - self.counters.get(masternodeid, Counter()) + self.shard(slavenodeid, slavenodeids, master=True)
+        return problems, self.fingerprint(changes)
+
+    def replicate(self, slavenodeid: str, masternodeid: str) -> Tuple[Counter, int]:
+        """
+        return problems and fingerprint of nodes after replicate of slavenodeid to masternodeid, current counters are kept
+
+        :param slavenodeid: id of slave node
+        :param masternodeid: id of new master node
+        :return: problems Counter and nodes fingerprint
+        """
+        oldmasternodeid = self.master_of[slavenodeid]
+        problems = self.total - self.counters.get(oldmasternodeid, Counter()) - self.counters.get(masternodeid, Counter())
+        problems += self.shard(oldmasternodeid, [nodeid for nodeid in self.slaves.get(oldmasternodeid, []) if nodeid != slavenodeid])
+        problems += self.shard(masternodeid, self.slaves.get(masternodeid, []) + [slavenodeid])
+        return problems, self.fingerprint({slavenodeid: masternodeid})
+
+
+class NodeRecord:
+    """
+    compact node record with interned ids, flags bitmask and packed slots ranges, that behaves like node dict of redis-py,
+    flags are read as comma separated string and slots as ranges like [['0', '5460'], ['10923', '10923']],
+    slots attribute is flat array of ranges like array('H', [0, 5460, 10923, 10923]).
+    Nodes lists of tool are lists of records, nodes dicts are packed by pack_nodes where they come to tool
+    """
+
+    __slots__ = ('node_id', 'host', 'port', 'mask', 'master_id', 'slots', 'migrations', 'epoch', 'last_ping_sent', 'last_pong_rcvd',
+                 'extra')
+
+    # flag bits, unknown flags get next bits on first use
+    FLAGS: ClassVar[List[str]] = ['myself', 'master', 'slave', 'fail?', 'fail', 'handshake', 'noaddr', 'nofailover', 'noflags']
+    MASTER: ClassVar[int] = 1 << 1
+    SLAVE: ClassVar[int] = 1 << 2
+    # link state isn't flag of redis, it's kept in the highest bit
+    CONNECTED: ClassVar[int] = 1 << 31
+    # flags string by mask
+    FLAGS_STRINGS: ClassVar[Dict[int, str]] = dict()
+    COUNTERS: ClassVar[Tuple[str, ...]] = ('epoch', 'last_ping_sent', 'last_pong_rcvd')
+    # fields that are read as attributes as is
+    ATTRIBUTES: ClassVar[frozenset] = frozenset(('node_id', 'host', 'port', 'master_id'))
+
+    def __init__(self, node: Dict[str, Any]):
+        """
+        initial func
+
+        :param node: node dict of redis-py or json form of --save-nodes, other keys than fields of record are kept as is
+        """
+        self.node_id: str = sys.intern(node['node_id'])
+        self.host: str = sys.intern(node['host'])
+        self.port: int = int(node['port'])
+        self.mask: int = self.CONNECTED if node.get('connected') else 0
+        self['flags'] = node.get('flags', ())
+        self.master_id: str = sys.intern(node.get('master_id') or '-')
+        self['slots'] = node.get('slots') or ()
+        self['migrations'] = node.get('migrations')
+        for counter in self.COUNTERS:
+            setattr(self, counter, int(node.get(counter) or 0))
+        self.extra: Optional[Dict[str, Any]] = None
+        for key, value in node.items():
+            if key not in self.__slots__ and key not in ('flags', 'connected'):
+                self[key] = value
+
+    def __repr__(self):
+        return f'NodeRecord({self.to_dict()!r})'
+
+    @classmethod
+    def get_flags_mask(cls, flags: Union[str, Iterable[str]]) -> int:
+        """
+        return bitmask of flags
+
+        :param flags: string like 'myself,master' or iterable like ('master',)
+        :return: bitmask
+        """
+        if isinstance(flags, str):
+            flags = flags.split(',') if flags else ()
+        mask = 0
+        for flag in flags:
+            if flag not in cls.FLAGS:
+                cls.FLAGS.append(flag)
+            mask |= 1 << cls.FLAGS.index(flag)
+        return mask
+
+    @classmethod
+    def get_flags_string(cls, mask: int) -> str:
+        """
+        return interned comma separated flags string of bitmask
+
+        :param mask: bitmask, connected bit is ignored
+        :return: string like 'myself,master'
+        """
+        mask &= ~cls.CONNECTED
+        if mask not in cls.FLAGS_STRINGS:
+            cls.FLAGS_STRINGS[mask] = sys.intern(','.join(flag for bit, flag in enumerate(cls.FLAGS) if mask & (1 << bit)))
+        return cls.FLAGS_STRINGS[mask]
+
+    @staticmethod
+    def pack_slots(slots: Iterable[Any]) -> array:
+        """
+        return flat array of slots ranges
+
+        :param slots: list like [['0', '5460'], ['10923']] of redis-py or flat array
+        :return: array like array('H', [0, 5460, 10923, 10923])
+        """
+        if isinstance(slots, array):
+            return array('H', slots)
+        packed = array('H')
+        for slots_range in slots:
+            packed.append(int(slots_range[0]))
+            packed.append(int(slots_range[-1]))
+        return packed
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.ATTRIBUTES:
+            return getattr(self, key)
+        if key == 'flags':
+            flags = self.FLAGS_STRINGS.get(self.mask & ~self.CONNECTED)
+            return flags if flags is not None else self.get_flags_string(self.mask)
+        if key == 'connected':
+            return bool(self.mask & self.CONNECTED)
+        if key == 'slots':
+            return [[str(self.slots[index]), str(self.slots[index + 1])] for index in range(0, len(self.slots), 2)]
+        if key == 'migrations':
+            return list(self.migrations or ())
+        if key in self.COUNTERS:
+            return str(getattr(self, key))
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == 'flags':
+            self.mask = (self.mask & self.CONNECTED) | self.get_flags_mask(value)
+        elif key == 'connected':
+            self.mask = self.mask | self.CONNECTED if value else self.mask & ~self.CONNECTED
+        elif key == 'slots':
+            self.slots = self.pack_slots(value)
+        elif key == 'migrations':
+            # empty migrations aren't stored
+            self.migrations = tuple(value) if value else None
+        elif key in self.COUNTERS or key == 'port':
+            setattr(self, key, int(value))
+        elif key in ('node_id', 'host', 'master_id'):
+            setattr(self, key, sys.intern(value))
+        else:
+            if self.extra is None:
+                self.extra = dict()
+            self.extra[key] = sys.intern(value) if isinstance(value, str) else value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> 'NodeRecord':
+        record = object.__new__(NodeRecord)
+        for field in self.__slots__:
+            setattr(record, field, getattr(self, field))
+        record.slots = array('H', self.slots)
+        # info dict is shared, so INFO fields requested later reach copies, swap_shard_info replaces it instead of change
+        record.extra = {key: value if key == 'info' else deepcopy(value, memo) for key, value in self.extra.items()} \
+            if self.extra is not None else None
+        return record
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        return value of key like dict.get
+
+        :param key: node field
+        :param default: value if field isn't defined
+        :return: value
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        """
+        return value of key and set it to default if not defined like dict.setdefault
+
+        :param key: node field
+        :param default: value if field isn't defined
+        :return: value
+        """
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def keys(self) -> List[str]:
+        """
+        return fields of record in order of redis-py node dict
+
+        :return: list of fields
+        """
+        return ['node_id', 'host', 'port', 'flags', 'master_id', *self.COUNTERS, 'slots', 'migrations', 'connected', *(self.extra or ())]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        return node dict in json form of --save-nodes
+
+        :return: dict like redis-py node dict with slots ranges as strings
+        """
+        return {key: self[key] for key in self.keys()}
+
+
+class SlotMap:
+    """
+    16384 bits maps of slots served by nodes, slots served by several nodes and slots in migrating or importing state,
+    maps are integers, so every slots range costs one bit operation
+    """
+
+    SLOTS: ClassVar[int] = 16384
+    FULL: ClassVar[int] = (1 << 16384) - 1
+
+    def __init__(self, nodes: List[Dict[str, Any]]):
+        """
+        initial func
+
+        :param nodes: nodes list, migrations of nodes are like [{'slot': '100', 'node_id': nodeid, 'state': 'migrating'}]
+        """
+        self.served: int = 0
+        self.overlapped: int = 0
+        self.migrating: int = 0
+        self.importing: int = 0
+        for node in nodes:
+            for slots_range in RedisClusterTool.get_slots_ranges(node):
+                start, end = slots_range[0], slots_range[-1]
+                slots = ((1 << (end - start + 1)) - 1) << start
+                self.overlapped |= self.served & slots
+                self.served |= slots
+            for migration in node.get('migrations') or ():
+                if migration['state'] == 'migrating':
+                    self.migrating |= 1 << int(migration['slot'])
+                else:
+                    self.importing |= 1 << int(migration['slot'])
+
+    @staticmethod
+    def get_ranges(slots: int) -> List[List[int]]:
+        """
+        return slots ranges of map
+
+        :param slots: slots map
+        :return: list like [[0, 5460], [10923, 10923]]
+        """
+        ranges = []
+        while slots:
+            start = (slots & -slots).bit_length() - 1
+            run = slots >> start
+            # number of trailing ones
+            length = (~run & (run + 1)).bit_length() - 1
+            ranges.append([start, start + length - 1])
+            slots &= ~(((1 << length) - 1) << start)
+        return ranges
+
+    @classmethod
+    def format_ranges(cls, slots: int) -> str:
+        """
+        return slots map like CLUSTER NODES slots
+
+        :param slots: slots map
+        :return: string like '0-5460 10923'
+        """
+        return ' '.join(map(lambda slots_range: f'{slots_range[0]}-{slots_range[1]}' if slots_range[0] != slots_range[1]
+                            else str(slots_range[0]), cls.get_ranges(slots)))
+
+    def problems(self) -> List[str]:
+        """
+        return slots coverage problems: not served slots, slots served by several nodes and open slots
+
+        :return: list of problems descriptions, empty if all slots are served by one node
+        """
+        problems = []
+        for slots, description in ((~self.served & self.FULL, "aren't served by any node"),
+                                   (self.overlapped, 'are served by several nodes'),
+                                   (self.migrating, 'are in migrating state'),
+                                   (self.importing, 'are in importing state')):
+            if slots:
+                problems.append(f'{bin(slots).count("1")} slots {description}: {self.format_ranges(slots)}')
+        return problems
+
+
 class RedisClusterTool:
     """
     simple class for redis cluster tooling
@@ -56,11 +1212,47 @@ class RedisClusterTool:
     MAXPORT: ClassVar[int] = 65535
     SKEW: ClassVar[int] = 5
     REPLICAS: ClassVar[int] = 2
+    # master weight for balancing: INFO field or None for weights calculated from nodes
+    BALANCE_MODES: ClassVar[Dict[str, Optional[str]]] = {'count': None, 'slots': None, 'memory': 'used_memory',
+                                                          'ops': 'instantaneous_ops_per_sec'}
+    # INFO replication fields for ranking failover candidates
+    REPLICATION_FIELDS: ClassVar[Tuple[str, ...]] = ('master_link_status', 'master_repl_offset', 'slave_repl_offset')
+    # bytes per second for replica to catch up with master before failover
+    REPLICATION_RATE: ClassVar[int] = 50 * 1024 * 1024
+    # replica with bigger replication lag is not a failover candidate
+    FAILOVER_MAX_LAG: ClassVar[int] = 10 * REPLICATION_RATE
+    # INFO fields for full sync cost: dataset size of new master and memory of receiving host
+    SYNC_FIELDS: ClassVar[Tuple[str, ...]] = ('used_memory', 'total_system_memory')
+    # bytes per second of full sync by link type between master and replica
+    SYNC_RATES: ClassVar[Dict[str, int]] = {'host': 1024 * 1024 * 1024, 'datacenter': 100 * 1024 * 1024,
+                                            'cross_datacenter': 25 * 1024 * 1024}
+    # INFO section of merged fields, fields are requested only from their sections
+    INFO_SECTIONS: ClassVar[Dict[str, str]] = {'master_link_status': 'replication', 'master_repl_offset': 'replication',
+                                               'slave_repl_offset': 'replication', 'used_memory': 'memory',
+                                               'total_system_memory': 'memory', 'instantaneous_ops_per_sec': 'stats'}
+    # version of plan file format for --plan-out and --plan-in
+    PLAN_VERSION: ClassVar[int] = 1
+    # command fields that are saved to plan file besides command itself
+    PLAN_FIELDS: ClassVar[Tuple[str, ...]] = ('msg', 'node_id', 'pre', 'post', 'catch_up', 'sync_bytes', 'sync_time')
+    # failure domain levels that are checked by tree for shards spread, datacenter and host levels stay in groups checks
+    # (check_group_master_distribution, check_slavesofmaster_in_group and others) that also count masters skew
+    FAILURE_DOMAIN_CHECK_LEVELS: ClassVar[Tuple[str, ...]] = ('region', 'rack')
+    # shard fields of desired state file, hosts and datacenters can be string or list
+    DESIRED_STATE_FIELDS: ClassVar[Tuple[str, ...]] = ('slot', 'master_host', 'master_datacenter', 'replicas', 'replica_hosts',
+                                                       'replica_datacenters', 'distinct_groups')
+    # format and version of nodes snapshot for --save-nodes and --load-nodes
+    SNAPSHOT_FORMAT: ClassVar[str] = 'redisclustertool-snapshot'
+    SNAPSHOT_VERSION: ClassVar[int] = 1
+    # columns of batch analytics table, group_skew is defined only for datacenters
+    METRICS_FIELDS: ClassVar[Tuple[str, ...]] = ('snapshot', 'created', 'cluster', 'nodes', 'masters', 'slaves', 'replicas', 'skew',
+                                                 'group_skew', 'replica_deficit', 'without_slaves', 'misplaced', 'failure_domains',
+                                                 'failed_nodes', 'slots_problems', 'error')
 
     def __repr__(self):
         return f'RedisClusterTool connected to {self.host}:{self.port}'
 
-    def __init__(self, host: str, port: int, passwd: str, skipconnection: bool = False, onlyconnected: bool = False):
+    def __init__(self, host: str, port: int, passwd: str, skipconnection: bool = False, onlyconnected: bool = False,
+                 balance_by: str = 'count'):
         """
         initial func
 
@@ -68,32 +1260,58 @@ class RedisClusterTool:
         :param port: port for connect to redis cluster
         :param skipconnection: don't connect to redis server
         :param onlyconnected: not use disconnected node
+        :param balance_by: master weight for balancing: count, slots, memory (used_memory) or ops (instantaneous_ops_per_sec)
         """
+        if balance_by not in self.BALANCE_MODES:
+            raise ValueError(f"Unknown balance mode {balance_by}, use one of {', '.join(self.BALANCE_MODES)}")
         self.host: str = host
         self.port: int = port
+        self.passwd: str = passwd
+        self.skipconnection: bool = skipconnection
+        self.balance_by: str = balance_by
+        self.retry_policy: RetryPolicy = RetryPolicy()
+        # capacity weights of hosts (ip or hostname) and groups from capacity config
+        self.capacities: Dict[str, Dict[str, float]] = {'hosts': dict(), 'groups': dict()}
+        # maximum replicas spread by groups sizes and masters count
+        self.spread_cache: Dict[Tuple[Tuple[int, ...], int], int] = dict()
+        # verify slots coverage before and after executed steps
+        self.slots_check: bool = False
+        # inventory answers by ip for nodes snapshot
+        self.inventory_answers: Dict[str, Dict[str, Any]] = dict()
+        # topology history that gets nodes after every execution
+        self.history: Optional['TopologyHistory'] = None
+        # measure write unavailability of shards during failovers, seconds between probes and json file for report
+        self.write_probe: bool = False
+        self.probe_interval: float = 0.01
+        self.probe_report: Optional[str] = None
+        self.execution_report: List[Dict[str, Any]] = list()
+        # current nodes with INFO replication fields, they are requested when the first failover is planned
+        # current nodes list that INFO fields are requested for, fields are requested on first use
+        self.info_nodes: Dict[str, List[Dict[str, Any]]] = dict()
         if not skipconnection:
             self.rc: redis.RedisCluster = redis.RedisCluster(host=self.host, port=self.port, password=passwd)
             self.currentnodes = self.get_current_nodes(onlyconnected=onlyconnected)
         self.plans = list()
 
-    def levelout_masters(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> List[Dict[str, Any]]:
+    def levelout_masters(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, **skew_params: int) -> List[Dict[str, Any]]:
         """
         Levelout masters before rebalancing
         :param nodes: nodes list
         :param maxport: reduce ports to maximum value
+        :param skew_params: skew (and groupskew for datacenter) for weighted levelout
         :return: planned nodes
         """
         if nodes is None:
             nodes = deepcopy(self.currentnodes)
+        if self.balance_by != 'count':
+            return self.levelout_masters_weighted(nodes=nodes, maxport=maxport, **skew_params)
 
         # determine how much masters per group should be
         group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
         groups = sorted(group_nodes.keys())
         masters = self.get_masters(nodes=nodes, maxport=maxport)
-        floor, remainder = len(masters) // len(groups), len(masters) % len(groups)
-        desired_groups_len = OrderedDict(map(lambda group: (group, floor), groups))
-        for index in range(remainder):
-            desired_groups_len[groups[index]] += 1
+        groups_capacity = self.get_groups_capacity(nodes_groups=group_nodes)
+        desired_groups_len = self.split_by_weights(len(masters), OrderedDict(map(lambda group: (group, groups_capacity[group]), groups)))
         desired_nodes_skew = dict()
         for group, number in desired_groups_len.items():   # there can't be more masters than nodes
             if number > len(group_nodes[group]):
@@ -111,22 +1329,21 @@ class RedisClusterTool:
                         if skew == 0:
                             break
 
-        # rebalance masters
+        # rebalance masters, master counts are kept in counters instead of nodes recount
+        distribution = self.get_master_distribution(nodes=nodes, maxport=maxport)
         for group in groups:
             group_masters = self.get_masters(nodes=group_nodes[group], maxport=maxport)
-            master_skew = desired_groups_len[group] - len(group_masters)
+            master_skew = desired_groups_len[group] - distribution.groups[group]
 
             if master_skew > 0:  # need to get more masters (too low number of masters)
                 for _ in range(0, master_skew):
                     success = False
                     neighbor_nodes_groups: Dict[str, List[Dict[str, Any]]] = dict(filter(lambda kv: kv[0] != group, group_nodes.items()))
-                    for neighbor_group, neighbor_nodes in neighbor_nodes_groups.items():
-                        neighbor_group_masters = self.get_masters(nodes=neighbor_nodes, maxport=maxport)
-                        if len(neighbor_group_masters) > desired_groups_len[neighbor_group]:
+                    for neighbor_group in neighbor_nodes_groups.keys():
+                        if distribution.groups[neighbor_group] > desired_groups_len[neighbor_group]:
                             for slave_node in self.get_slaves(nodes=group_nodes[group], maxport=maxport):
-                                if self.get_node_group(nodes=nodes,
-                                                       node=self.get_masters(nodes=nodes, slavenodeid=slave_node['node_id'], maxport=maxport),
-                                                       maxport=maxport) == neighbor_group:  # orphaned nodes can't exist
+                                if distribution.node_group.get(slave_node['master_id']) == neighbor_group:  # orphaned nodes can't exist
+                                    distribution.failover(slavenodeid=slave_node['node_id'], masternodeid=slave_node['master_id'])
                                     nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=slave_node['node_id'])
                                     group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
                                     success = True
@@ -137,10 +1354,11 @@ class RedisClusterTool:
                         continue  # continue if we find appropriate node for failover
                     # if we here - we were failed to find
                     for neighbor_group, neighbor_nodes in neighbor_nodes_groups.items():
-                        neighbor_group_masters = self.get_masters(nodes=neighbor_nodes, maxport=maxport)
-                        if len(neighbor_group_masters) > desired_groups_len[neighbor_group]:
+                        if distribution.groups[neighbor_group] > desired_groups_len[neighbor_group]:
+                            neighbor_group_masters = self.get_masters(nodes=neighbor_nodes, maxport=maxport)
                             group_slaves = self.get_slaves(nodes=group_nodes[group], maxport=maxport)
                             if group_slaves:
+                                distribution.failover(slavenodeid=group_slaves[0]['node_id'], masternodeid=neighbor_group_masters[-1]['node_id'])
                                 nodes = self.plan_clusternode_replicate(nodes=nodes, masternodeid=neighbor_group_masters[-1]['node_id'], slavenodeid=group_slaves[0]['node_id'])
                                 nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=group_slaves[0]['node_id'])
                                 group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
@@ -149,14 +1367,11 @@ class RedisClusterTool:
                 for _ in range(master_skew, 0):
                     success = False
                     neighbor_nodes_groups: Dict[str, List[Dict[str, Any]]] = dict(filter(lambda kv: kv[0] != group, group_nodes.items()))
-                    for neighbor_group, neighbor_nodes in neighbor_nodes_groups.items():
-                        neighbor_group_masters = self.get_masters(nodes=neighbor_nodes, maxport=maxport)
-                        if len(neighbor_group_masters) < desired_groups_len[neighbor_group]:
+                    for neighbor_group in neighbor_nodes_groups.keys():
+                        if distribution.groups[neighbor_group] < desired_groups_len[neighbor_group]:
                             for slave_node in self.get_slaves(nodes=group_nodes[neighbor_group], maxport=maxport):
-                                if self.get_node_group(nodes=nodes,
-                                                       node=self.get_masters(nodes=nodes, slavenodeid=slave_node[
-                                                           'node_id'], maxport=maxport),
-                                                       maxport=maxport) == group:
+                                if distribution.node_group.get(slave_node['master_id']) == group:
+                                    distribution.failover(slavenodeid=slave_node['node_id'], masternodeid=slave_node['master_id'])
                                     nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=slave_node['node_id'])
                                     group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
                                     group_masters = self.get_masters(nodes=group_nodes[group], maxport=maxport)
@@ -168,10 +1383,10 @@ class RedisClusterTool:
                         continue  # continue if we find appropriate node for failover
                     # if we here - we were failed to find, will replicate nodes
                     for neighbor_group, neighbor_nodes in neighbor_nodes_groups.items():
-                        neighbor_group_masters = self.get_masters(nodes=neighbor_nodes, maxport=maxport)
-                        if len(neighbor_group_masters) < desired_groups_len[neighbor_group]:
+                        if distribution.groups[neighbor_group] < desired_groups_len[neighbor_group]:
                             neighbor_group_slaves = self.get_slaves(nodes=neighbor_nodes, maxport=maxport)
                             if neighbor_group_slaves:
+                                distribution.failover(slavenodeid=neighbor_group_slaves[0]['node_id'], masternodeid=group_masters[-1]['node_id'])
                                 nodes = self.plan_clusternode_replicate(nodes=nodes, masternodeid=group_masters[-1]['node_id'], slavenodeid=neighbor_group_slaves[0]['node_id'])
                                 nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=neighbor_group_slaves[0]['node_id'])
                                 group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
@@ -182,6 +1397,24 @@ class RedisClusterTool:
 
         return nodes
 
+    def levelout_masters_weighted(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, **skew_params: int) -> List[Dict[str, Any]]:
+        """
+        Levelout masters weight (slots, memory, ops) with failovers while weighted skew decreases
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param skew_params: skew (and groupskew for datacenter) for cluster_rebalance_iterate
+        :return: planned nodes
+        """
+        if nodes is None:
+            nodes = deepcopy(self.currentnodes)
+        for _ in range(len(nodes)):
+            rebalance_iteration = self.cluster_rebalance_iterate(nodes=nodes, maxport=maxport, **skew_params)
+            if not rebalance_iteration:
+                break
+            nodes = rebalance_iteration
+        return nodes
+
     def levelout_slaves(self, nodes: List[Dict[str, Any]] = None, replicas: int = REPLICAS, maxport: int = MAXPORT) -> List[Dict[str, Any]]:
         """
         Levelout slaves before rebalancing
@@ -218,6 +1451,8 @@ class RedisClusterTool:
             workset_nodes.pop(index)
 
         # step 2 - connect non-fine leveled nodes between each other using groups
+        domains = self.get_failure_domains(nodes=nodes, maxport=maxport)
+        headroom = self.get_hosts_headroom(nodes=nodes)
         workset_masters = self.get_masters(nodes=workset_nodes, maxport=maxport)
         for master in workset_masters:
             workset_slaves = self.get_slaves(nodes=workset_nodes, maxport=maxport)
@@ -254,6 +1489,8 @@ class RedisClusterTool:
                                                                             slavenodeid=neighbor_master_slaves[0]['node_id'])
                                     nodes = self.plan_clusternode_replicate(nodes=nodes, masternodeid=neighbor_master['node_id'],
                                                                             slavenodeid=slave_for_change['node_id'])
+                                    domains.replicate(nodeid=neighbor_master_slaves[0]['node_id'], masternodeid=master['node_id'])
+                                    domains.replicate(nodeid=slave_for_change['node_id'], masternodeid=neighbor_master['node_id'])
                                     workset_nodes[self.get_node_index(nodes=workset_nodes, nodeid=slave_for_change['node_id'])] = neighbor_master_slaves[0]
                                     workset_slaves = self.get_slaves(nodes=workset_nodes, maxport=maxport)
                                     workset_slaves_groups = self.get_nodes_groups(nodes=workset_slaves, maxport=maxport)
@@ -288,73 +1525,767 @@ class RedisClusterTool:
             if len(workset_slaves_groups_wo_mg) < replicas:
                 raise Exception(f"Can't find required {replicas} groups for master {self.get_node_group(nodes=nodes, nodeid=master['node_id'], maxport=maxport)} {master['node_id']} {master['host']}:{master['port']}")
 
-            for group in tuple(workset_slaves_groups_wo_mg.keys())[:replicas]:
-                workset_slaves = self.get_slaves(nodes=workset_nodes, maxport=maxport)
-                workset_slaves_groups = self.get_nodes_groups(nodes=workset_slaves, maxport=maxport)
-                slave_for_replicate = workset_slaves_groups[group][0]
-                nodes = self.plan_clusternode_replicate(nodes=nodes, slavenodeid=slave_for_replicate['node_id'], masternodeid=master['node_id'])
-                workset_nodes.pop(self.get_node_index(nodes=workset_nodes, nodeid=slave_for_replicate['node_id']))
-        return nodes
+            # take groups and slaves in them without shared region or rack with shard and with the cheapest full sync from master
+            def sync_cost(node: Dict[str, Any]) -> Tuple[int, Tuple[bool, float, int]]:
+                return (domains.conflicts(nodeid=node['node_id'], masternodeid=master['node_id'], levels=self.FAILURE_DOMAIN_CHECK_LEVELS),
+                        self.get_sync_cost(slavenode=self.get_node(nodes=nodes, nodeid=node['node_id']), masternode=master, nodes=nodes,
+                                           headroom=headroom))
+
+            for group in sorted(workset_slaves_groups_wo_mg.keys(),
+                                key=lambda group: min(map(sync_cost, workset_slaves_groups_wo_mg[group])))[:replicas]:
+                workset_slaves = self.get_slaves(nodes=workset_nodes, maxport=maxport)
+                workset_slaves_groups = self.get_nodes_groups(nodes=workset_slaves, maxport=maxport)
+                slave_for_replicate = min(workset_slaves_groups[group], key=sync_cost)
+                nodes = self.plan_clusternode_replicate(nodes=nodes, slavenodeid=slave_for_replicate['node_id'], masternodeid=master['node_id'])
+                domains.replicate(nodeid=slave_for_replicate['node_id'], masternodeid=master['node_id'])
+                workset_nodes.pop(self.get_node_index(nodes=workset_nodes, nodeid=slave_for_replicate['node_id']))
+        return nodes
+
+    def plan_drain(self, host: str, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> List[Dict[str, Any]]:
+        """
+        Plan failovers of all masters from server to slaves on another servers
+
+        :param host: ip or hostname of server
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :return: planned nodes
+        """
+        if nodes is None:
+            nodes = deepcopy(self.currentnodes)
+        for masternode in list(filter(lambda node: host in (node['host'], node.get('hostname')), self.get_masters(nodes=nodes, maxport=maxport))):
+            slavenodeid = self.find_candidate_for_failover(masternodeid=masternode['node_id'], nodes=nodes, maxport=maxport)
+            if not slavenodeid:
+                # there is no slave in another group, take slave from another server
+                slaves = list(filter(lambda node: node['host'] != masternode['host'],
+                                     self.get_slaves(nodes=nodes, masternodeid=masternode['node_id'], maxport=maxport)))
+                if not slaves:
+                    raise Exception(f"Master {masternode['node_id']} {masternode['host']}:{masternode['port']} doesn't have slaves on another servers")
+                slavenodeid = self.choose_failover_slave(slaves=slaves)['node_id']
+            nodes = self.plan_clusternode_failover(slavenodeid=slavenodeid, nodes=nodes, option='')
+        return nodes
+
+    def plan_restore(self, snapshot: List[Dict[str, Any]], host: str = None, nodes: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Plan failovers that return masters of snapshot (for example before drain) that are slaves of the same shard now
+
+        :param snapshot: nodes list from --save-nodes or --drain-out file
+        :param host: ip or hostname of server, restore only its masters if defined
+        :param nodes: nodes list
+        :return: planned nodes
+        """
+        if nodes is None:
+            nodes = deepcopy(self.currentnodes)
+        for snapshot_master in self.get_masters(nodes=snapshot):
+            if host and host not in (snapshot_master['host'], snapshot_master.get('hostname')):
+                continue
+            node = self.get_node(nodes=nodes, nodeid=snapshot_master['node_id'])
+            if not node:
+                print(f"Node {snapshot_master['node_id']} {snapshot_master['host']}:{snapshot_master['port']} isn't in cluster, skip")
+                continue
+            if 'master' in node['flags']:
+                continue
+            masternode = self.get_node(nodes=nodes, nodeid=node['master_id'])
+            if not masternode or self.get_slots_ranges(masternode) != self.get_slots_ranges(snapshot_master):
+                print(f"Node {node['node_id']} {node['host']}:{node['port']} replicates another shard now, skip")
+                continue
+            nodes = self.plan_clusternode_failover(slavenodeid=node['node_id'], nodes=nodes, option='')
+        return nodes
+
+    def get_reshard_weights(self, nodes: List[Dict[str, Any]] = None) -> Optional[Dict[str, float]]:
+        """
+        Return slots weights of masters for plan_reshard from capacity of their hosts: host capacity is shared by masters of host,
+        so slots of hosts are proportional to capacity however masters are placed
+
+        :param nodes: nodes list
+        :return: dict like {'masternodeid': weight}, None if capacities of hosts with masters are equal
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        masters = self.get_masters(nodes=nodes)
+        hosts_capacity = {node['host']: self.get_node_capacity(node) for node in masters}
+        if len(set(hosts_capacity.values())) <= 1:
+            return None
+        masters_per_host = Counter(map(lambda node: node['host'], masters))
+        return {node['node_id']: hosts_capacity[node['host']] / masters_per_host[node['host']] for node in masters}
+
+    def plan_reshard(self, nodes: List[Dict[str, Any]] = None, weights: Dict[str, float] = None) -> List[Dict[str, Any]]:
+        """
+        Plan minimal slots movement between masters toward equal or weighted slots ownership
+
+        :param nodes: nodes list
+        :param weights: dict like {'masternodeid': weight}, equal weights if None
+        :return: list like [{'source': masternodeid, 'target': masternodeid, 'slots': [1, 2, 3]}]
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        masters = self.get_masters(nodes=nodes)
+        if not masters:
+            return []
+        owned: Dict[str, List[int]] = {node['node_id']: [slot for slots_range in self.get_slots_ranges(node)
+                                                         for slot in range(slots_range[0], slots_range[-1] + 1)]
+                                       for node in masters}
+        if weights is None:
+            weights = dict()
+        masters_weights: Dict[str, float] = {node['node_id']: weights.get(node['node_id'], 1) for node in masters}
+        total_slots = sum(map(len, owned.values()))
+
+        # on equal remainders masters with more slots get extra slot for less movement
+        desired = self.split_by_weights(total_slots, OrderedDict(sorted(masters_weights.items(), key=lambda kv: -len(owned[kv[0]]))))
+
+        # donors give slots from the end of their ranges
+        excess_slots: List[Tuple[str, int]] = [(nodeid, slot) for nodeid, slots in owned.items() for slot in slots[desired[nodeid]:]]
+        moves: List[Dict[str, Any]] = []
+        for nodeid, slots in owned.items():
+            for _ in range(desired[nodeid] - len(slots)):
+                source, slot = excess_slots.pop(0)
+                if moves and moves[-1]['source'] == source and moves[-1]['target'] == nodeid:
+                    moves[-1]['slots'].append(slot)
+                else:
+                    moves.append({'source': source, 'target': nodeid, 'slots': [slot]})
+        return moves
+
+    @classmethod
+    def load_desired_state(cls, path: str) -> Dict[str, Any]:
+        """
+        load and validate desired state file
+
+        :param path: json file like {'default': {'replicas': 2, 'distinct_groups': true},
+         'shards': [{'slot': 0, 'master_host': '10.0.0.1', 'replica_datacenters': ['DC2', 'DC3']}]},
+         shard is defined by any of its slots, default fields are applied to all shards
+        :return: desired state with hosts and datacenters as lists
+        """
+        with open(path, 'r') as f:
+            state = json.load(f)
+        for spec in [state.get('default', dict())] + state.get('shards', []):
+            unknown_fields = set(spec) - set(cls.DESIRED_STATE_FIELDS)
+            if unknown_fields:
+                raise Exception(f"Unknown fields {', '.join(sorted(unknown_fields))} in desired state {path}")
+            for field in ('master_host', 'master_datacenter', 'replica_hosts', 'replica_datacenters'):
+                if isinstance(spec.get(field), str):
+                    spec[field] = [spec[field]]
+        if any(map(lambda spec: 'slot' not in spec, state.get('shards', []))):
+            raise Exception(f"Every shard of desired state {path} must have slot")
+        return state
+
+    @staticmethod
+    def match_placement(node: Dict[str, Any], hosts: List[str] = None, datacenters: List[str] = None) -> bool:
+        """
+        return True if node is placed on one of hosts (ip or hostname) and one of datacenters, empty lists allow any
+
+        :param node: node dict
+        :param hosts: list of ip or hostnames
+        :param datacenters: list of datacenters
+        :return: bool
+        """
+        if hosts and node['host'] not in hosts and node.get('hostname') not in hosts:
+            return False
+        if datacenters and node.get('datacenter') not in datacenters:
+            return False
+        return True
+
+    def plan_desired_state(self, state: Dict[str, Any], nodes: List[Dict[str, Any]] = None, replicas: int = REPLICAS,
+                           maxport: int = MAXPORT) -> List[Dict[str, Any]]:
+        """
+        Plan minimal failovers and replicates from nodes to desired state: failover to suitable replica for master placement
+        and replicate of spare slaves (of shards with more replicas than desired) for replicas placement, misplaced replicas
+        are kept and become spare for other shards. If there is no spare slave, suitable slave of other shard is swapped
+        with slave of the shard that keeps placement of other shard
+
+        :param state: result of load_desired_state
+        :param nodes: nodes list
+        :param replicas: desired number of replicas of shards without replicas in desired state
+        :param maxport: reduce ports to maximum value
+        :return: planned nodes
+        """
+        if nodes is None:
+            nodes = deepcopy(self.currentnodes)
+        node_group: Dict[str, str] = {node['node_id']: group for group, groupnodes in self.get_nodes_groups(nodes=nodes, maxport=maxport).items()
+                                      for node in groupnodes}
+        default = state.get('default', dict())
+        # shard is defined by its first slot, slots move with master role on failover
+        shard_specs: Dict[int, Dict[str, Any]] = dict()
+        for masternode in filter(lambda node: node.slots, self.get_masters(nodes=nodes, maxport=maxport)):
+            slots_ranges = self.get_slots_ranges(masternode)
+            shard_specs[slots_ranges[0][0]] = default
+            for spec in state.get('shards', []):
+                if any(map(lambda slots_range: slots_range[0] <= spec['slot'] <= slots_range[-1], slots_ranges)):
+                    shard_specs[slots_ranges[0][0]] = dict(default, **spec)
+        shards: Dict[str, int] = dict()
+        slaves_of_master: Dict[str, List[Dict[str, Any]]] = dict()
+        unresolved: List[str] = []
+
+        def reindex() -> None:
+            # shards and slaves of masters of planned nodes, rebuilt after every planned command
+            shards.clear()
+            slaves_of_master.clear()
+            for node in self.nodes_reduced_max_port(nodes=nodes, maxport=maxport):
+                if 'master' in node['flags']:
+                    slaves_of_master.setdefault(node['node_id'], [])
+                    if node.slots:
+                        shards[node['node_id']] = self.get_slots_ranges(node)[0][0]
+                else:
+                    slaves_of_master.setdefault(node['master_id'], []).append(node)
+
+        def shard_placement(masternodeid: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[Dict[str, Any]], set]:
+            # return spec, well placed slaves, misplaced slaves and groups of master and well placed slaves
+            spec = shard_specs.get(shards.get(masternodeid), default)
+            placed, misplaced, used_groups = [], [], {node_group[masternodeid]}
+            for slavenode in slaves_of_master.get(masternodeid, []):
+                if self.match_placement(slavenode, spec.get('replica_hosts'), spec.get('replica_datacenters')) and \
+                        not (spec.get('distinct_groups') and node_group[slavenode['node_id']] in used_groups):
+                    placed.append(slavenode)
+                    used_groups.add(node_group[slavenode['node_id']])
+                else:
+                    misplaced.append(slavenode)
+            return spec, placed, misplaced, used_groups
+
+        def find_spare(match: Callable[[Dict[str, Any]], bool], masternodeid: str) -> Optional[Dict[str, Any]]:
+            # misplaced slaves are taken first, well placed slaves only from shards that have more of them than desired
+            placed_candidate = None
+            for donorid in slaves_of_master:
+                if donorid == masternodeid or donorid not in node_group:
+                    continue
+                spec, placed, misplaced, _ = shard_placement(donorid)
+                desired = spec.get('replicas', replicas)
+                if len(placed) + len(misplaced) <= desired:
+                    continue
+                for slavenode in filter(match, misplaced):
+                    return slavenode
+                if placed_candidate is None and len(placed) > desired:
+                    placed_candidate = next(filter(match, placed), None)
+            return placed_candidate
+
+        def find_swap(match: Callable[[Dict[str, Any]], bool], masternodeid: str,
+                      givable: List[Dict[str, Any]]) -> Optional[Tuple[Dict[str, Any], Dict[str, Any], str]]:
+            # slave of other shard that match and one of givable slaves of masternodeid that takes its place in other shard
+            for donorid in slaves_of_master:
+                if donorid == masternodeid or donorid not in node_group:
+                    continue
+                spec, placed, misplaced, used_groups = shard_placement(donorid)
+                for slavenode in filter(match, misplaced + placed):
+                    donor_groups = used_groups - {node_group[slavenode['node_id']]}
+                    for givennode in givable:
+                        if node_group[givennode['node_id']] == node_group[donorid]:
+                            continue
+                        # well placed slave of other shard is replaced only by well placed one
+                        if slavenode in placed and not (
+                                self.match_placement(givennode, spec.get('replica_hosts'), spec.get('replica_datacenters')) and
+                                not (spec.get('distinct_groups') and node_group[givennode['node_id']] in donor_groups)):
+                            continue
+                        return slavenode, givennode, donorid
+            return None
+
+        def plan_swap(masternodeid: str, swap: Tuple[Dict[str, Any], Dict[str, Any], str]) -> List[Dict[str, Any]]:
+            # replicate of slave from other shard to masternodeid and of given slave to other shard
+            slavenode, givennode, donorid = swap
+            swapped = self.plan_clusternode_replicate(masternodeid=masternodeid, slavenodeid=slavenode['node_id'], nodes=nodes)
+            return self.plan_clusternode_replicate(masternodeid=donorid, slavenodeid=givennode['node_id'], nodes=swapped)
+
+        reindex()
+        shard_masters = {shard: masternodeid for masternodeid, shard in shards.items()}
+        # masters placement
+        for shard in sorted(shard_masters):
+            masternodeid = shard_masters[shard]
+            masternode, spec = self.get_node(nodeid=masternodeid, nodes=nodes), shard_specs[shard]
+            if self.match_placement(masternode, spec.get('master_host'), spec.get('master_datacenter')):
+                continue
+            slaves = list(filter(lambda node: self.match_placement(node, spec.get('master_host'), spec.get('master_datacenter')),
+                                 slaves_of_master[masternodeid]))
+            if not slaves:
+                match = lambda node: self.match_placement(node, spec.get('master_host'), spec.get('master_datacenter'))
+                spare = find_spare(match, masternodeid=masternodeid)
+                if spare is not None:
+                    nodes = self.plan_clusternode_replicate(masternodeid=masternodeid, slavenodeid=spare['node_id'], nodes=nodes)
+                else:
+                    _, placed, misplaced, _ = shard_placement(masternodeid)
+                    swap = find_swap(match, masternodeid=masternodeid, givable=misplaced + placed)
+                    if swap is None:
+                        unresolved.append(f"no slave for master of slot {shard} on "
+                                          f"{', '.join(spec.get('master_host') or spec.get('master_datacenter'))}")
+                        continue
+                    nodes = plan_swap(masternodeid, swap)
+                    spare = swap[0]
+                slaves = [spare]
+            nodes = self.plan_clusternode_failover(slavenodeid=self.choose_failover_slave(slaves)['node_id'], nodes=nodes)
+            reindex()
+
+        # replicas placement
+        shard_masters = {shard: masternodeid for masternodeid, shard in shards.items()}
+        for shard in sorted(shard_masters):
+            masternodeid = shard_masters[shard]
+            spec, placed, _, used_groups = shard_placement(masternodeid)
+            for _ in range(spec.get('replicas', replicas) - len(placed)):
+                match = lambda node: self.match_placement(node, spec.get('replica_hosts'), spec.get('replica_datacenters')) and \
+                    not (spec.get('distinct_groups') and node_group[node['node_id']] in used_groups)
+                spare = find_spare(match, masternodeid=masternodeid)
+                if spare is not None:
+                    nodes = self.plan_clusternode_replicate(masternodeid=masternodeid, slavenodeid=spare['node_id'], nodes=nodes)
+                else:
+                    # only misplaced slaves are given to other shard
+                    swap = find_swap(match, masternodeid=masternodeid, givable=shard_placement(masternodeid)[2])
+                    if swap is None:
+                        unresolved.append(f"no spare slave for replica of slot {shard} master")
+                        break
+                    nodes = plan_swap(masternodeid, swap)
+                    spare = swap[0]
+                used_groups.add(node_group[spare['node_id']])
+                reindex()
+        for problem in unresolved:
+            print(f"Can't reach desired state: {problem}")
+        return nodes
+
+    def plan_rolling_waves(self, nodes: List[Dict[str, Any]] = None) -> List[List[str]]:
+        """
+        Split servers to waves for rolling restart: servers of one wave don't have nodes of the same shard and are in different datacenters
+
+        :param nodes: nodes list
+        :return: list like [['10.0.0.1', '10.0.0.5'], ['10.0.0.2']]
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        host_shards: defaultdict = defaultdict(set)
+        host_datacenter: Dict[str, Optional[str]] = dict()
+        for node in nodes:
+            host_shards[node['host']].add(node['node_id'] if 'master' in node['flags'] else node['master_id'])
+            host_datacenter[node['host']] = node.get('datacenter')
+
+        waves: List[List[str]] = []
+        waves_shards: List[set] = []
+        waves_datacenters: List[set] = []
+        # servers with more shards first, greedy coloring gives less waves in this order
+        for host in sorted(host_shards, key=lambda host: (-len(host_shards[host]), host)):
+            for index, wave in enumerate(waves):
+                if not waves_shards[index] & host_shards[host] and \
+                        (host_datacenter[host] is None or host_datacenter[host] not in waves_datacenters[index]):
+                    break
+            else:
+                index = len(waves)
+                waves.append([])
+                waves_shards.append(set())
+                waves_datacenters.append(set())
+            waves[index].append(host)
+            waves_shards[index].update(host_shards[host])
+            waves_datacenters[index].add(host_datacenter[host])
+        return waves
+
+    def create_command(self, command: str, run_node: Dict[str, Any], affected_node: Dict[str, Any], args: Union[tuple, List] = tuple(),
+                       command_option: str = "") -> Dict[str, Any]:
+        """
+        Construct a redis command for clusterexecute function with description
+
+        :param command: command to run on redis
+        :param run_node: node where to execute command
+        :param affected_node: node that will be affected
+        :param args: arguments for clusterexecute func
+        :param command_option: optional argument for command such as TAKEOVER / FORCE
+        :return: command in {func, args, kwargs, msg} format
+        """
+
+        if command == 'CLUSTER REPLICATE':
+            exec_command = 'CLUSTER REPLICATE ' + affected_node['node_id']
+            command_desc = f'Attach slave  {run_node["node_id"]} {run_node["host"]}:{run_node["port"]} ' \
+                           f'to {affected_node["node_id"]} {affected_node["host"]}:{affected_node["port"]}'
+
+        elif command == 'CLUSTER FAILOVER':
+            if command_option == "":
+                exec_command = 'CLUSTER FAILOVER'
+            else:
+                exec_command = 'CLUSTER FAILOVER ' + command_option
+            command_desc = f'Failover node {run_node["node_id"]} {run_node["host"]}:{run_node["port"]} ' \
+                           f'[old master {affected_node["node_id"]} {affected_node["host"]}:{affected_node["port"]}]'
+        else:
+            raise Exception(f"Unknown command for redisclustertool: {command}")
+
+        command = {'func': self.cluster_execute, 'args': args,
+                   'kwargs': {'ip': run_node['host'],
+                              'port': run_node['port'],
+                              'command': exec_command},
+                   'msg': command_desc
+                   }
+        return command
+
+    def get_current_nodes(self, onlyconnected: bool = False) -> List[Dict[str, Any]]:
+        """
+        return current cluster nodes configuration from actual cluster
+
+        :param onlyconnected: not use disconnected node
+        :rtype: List[Dict[str, Any]]
+        :return: list like {'node_id': 'nodeid' 'host': 'hostip', 'port': someport,
+         'flags': ('slave',), 'master_id': 'masternodeid', 'ping-sent': 0, 'pong-recv': 1610468870000,
+         'link-state': 'connected', 'slots': [], 'migrations': []}
+        """
+        prepared_nodes = []
+        for host, params in self.rc.cluster_nodes().items():
+            host, port = host.split(':')
+            params['host'], params['port'] = host, int(port)
+            # INFO fields are merged to this dict on first use, planned copies share it
+            params['info'] = dict()
+            prepared_nodes.append(NodeRecord(params))
+        if onlyconnected:
+            return sorted(self.filter_only_connected_nodes(
+                nodes=self.filter_without_noaddr_flag_nodes(nodes=prepared_nodes)
+            ),
+                key=lambda node: (node['host'], node['port']))
+        else:
+            return sorted(self.filter_without_noaddr_flag_nodes(nodes=prepared_nodes),
+                          key=lambda node: (node['host'], node['port']))
+
+    def get_nodes_info(self, nodes: List[Dict[str, Any]] = None, section: str = 'all') -> Dict[str, Dict[str, Any]]:
+        """
+        return INFO answers of nodes, requested concurrently
+
+        :param nodes: nodes list
+        :param section: INFO section
+        :return: dict like {'nodeid': {'used_memory': 1024, ...}}, nodes without answer are skipped
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+
+        def node_info(node: Dict[str, Any]) -> Tuple[str, Optional[Dict[str, Any]]]:
+            try:
+                return node['node_id'], self.rc.get_node(host=node['host'], port=node['port']).redis_connection.info(section)
+            except Exception as e:
+                print(f"Can't get INFO {section} from {node['host']}:{node['port']}: {e}")
+                return node['node_id'], None
+
+        with ThreadPoolExecutor(max_workers=min(32, max(1, len(nodes)))) as executor:
+            return {nodeid: info for nodeid, info in executor.map(node_info, nodes) if info is not None}
+
+    def merge_nodes_info(self, fields: List[str], nodes: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        add INFO fields to node['info'] of every node, only sections of fields from INFO_SECTIONS are requested
+
+        :param fields: INFO fields like used_memory
+        :param nodes: nodes list
+        :return: nodes list merged with info
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        sections = set(map(lambda field: self.INFO_SECTIONS.get(field, 'all'), fields))
+        nodes_info: defaultdict = defaultdict(dict)
+        for section in (['all'] if 'all' in sections else sorted(sections)):
+            for nodeid, info in self.get_nodes_info(nodes=nodes, section=section).items():
+                nodes_info[nodeid].update(info)
+        for node in nodes:
+            node.setdefault('info', dict()).update({field: nodes_info.get(node['node_id'], dict()).get(field) for field in fields})
+        return nodes
+
+    @staticmethod
+    def get_slots_count(node: NodeRecord) -> int:
+        """
+        return count of slots served by node
+
+        :param node: node record
+        :return: slots count
+        """
+        return sum(node.slots[1::2]) - sum(node.slots[::2]) + len(node.slots) // 2
+
+    @staticmethod
+    def get_slots_ranges(node: NodeRecord) -> List[List[int]]:
+        """
+        return sorted slots ranges of node as integers
+
+        :param node: node record
+        :return: list like [[0, 5460], [10923, 10923]]
+        """
+        return sorted([node.slots[index], node.slots[index + 1]] for index in range(0, len(node.slots), 2))
+
+    @staticmethod
+    def split_by_weights(total: int, weights: Dict[str, float]) -> OrderedDict:
+        """
+        split total proportionally to weights with largest remainder method, on equal remainders first keys get more
+
+        :param total: number to split
+        :param weights: ordered dict like {'group1': weight}
+        :return: ordered dict like {'group1': number}
+        """
+        total_weight = sum(weights.values())
+        quotas: Dict[str, float] = {key: total * weight / total_weight for key, weight in weights.items()}
+        split: OrderedDict[str, int] = OrderedDict(map(lambda key: (key, int(quotas[key])), weights))
+        for key in sorted(weights, key=lambda key: split[key] - quotas[key])[:total - sum(split.values())]:
+            split[key] += 1
+        return split
+
+    def load_capacities(self, path: str) -> None:
+        """
+        load capacity weights from config file with [hosts] section (ip or hostname = weight) and [groups] section (group = weight)
+
+        :param path: config file path
+        :return: None
+        """
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        if not config.read(path):
+            raise Exception(f"Can't read capacity config {path}")
+        for section in ('hosts', 'groups'):
+            if config.has_section(section):
+                self.capacities[section] = {key: config.getfloat(section, key) for key in config.options(section)}
+
+    def get_node_capacity(self, node: Dict[str, Any]) -> float:
+        """
+        return capacity weight of node host from capacity config (by ip, then hostname) or from inventory
+
+        :param node: node dict
+        :return: capacity weight, 1 if not defined
+        """
+        hosts = self.capacities['hosts']
+        if node['host'] in hosts:
+            return hosts[node['host']]
+        if node.get('hostname') in hosts:
+            return hosts[node['hostname']]
+        return float(node.get('capacity') or 1)
+
+    def get_hosts_capacity(self, nodes: List[Dict[str, Any]] = None) -> Dict[str, float]:
+        """
+        return capacity weights of hosts
+
+        :param nodes: nodes list
+        :return: dict like {'host1': capacity}
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        return {node['host']: self.get_node_capacity(node) for node in nodes}
+
+    def get_groups_capacity(self, nodes_groups: Dict[str, List[Dict[str, Any]]] = None) -> Dict[str, float]:
+        """
+        return capacity weights of groups, group is host so group capacity is host capacity
+
+        :param nodes_groups: dict like {'group1': [node1, node2]} from get_nodes_groups
+        :return: dict like {'group1': capacity}
+        """
+        if nodes_groups is None:
+            nodes_groups = self.get_nodes_groups()
+        return {group: self.get_node_capacity(groupnodes[0]) for group, groupnodes in nodes_groups.items()}
+
+    def get_node_weight(self, node: Dict[str, Any]) -> int:
+        """
+        return weight of master node for balancing by balance_by mode, INFO field value is load of shard:
+        it's measured on master and moves to new master with planned failover (see swap_shard_info)
+
+        :param node: node dict
+        :return: 1 for count mode, slots count or INFO field value
+        """
+        if self.balance_by == 'count':
+            return 1
+        if self.balance_by == 'slots':
+            return self.get_slots_count(node)
+        self.load_sync_info()
+        value = node.get('info', dict()).get(self.BALANCE_MODES[self.balance_by])
+        if value is None:
+            raise Exception(f"Node {node['node_id']} {node['host']}:{node['port']} doesn't have INFO {self.BALANCE_MODES[self.balance_by]} "
+                            f"for balancing by {self.balance_by}")
+        return int(value)
+
+    def swap_shard_info(self, node: Dict[str, Any], othernode: Dict[str, Any]) -> None:
+        """
+        swap INFO fields of balance modes (shard load) between master and slave of planned failover,
+        info dicts are replaced, not changed, because they can be shared with current nodes
+
+        :param node: node dict
+        :param othernode: node dict
+        :return: None
+        """
+        fields = list(filter(lambda field: field in node.get('info', dict()) or field in othernode.get('info', dict()),
+                             filter(None, self.BALANCE_MODES.values())))
+        if not fields:
+            return
+        info, otherinfo = dict(node.get('info', dict())), dict(othernode.get('info', dict()))
+        for field in fields:
+            info[field], otherinfo[field] = otherinfo.get(field), info.get(field)
+        node['info'], othernode['info'] = info, otherinfo
+
+    def get_share_desc(self, counter: MasterCounter, group: str, scope: str = '') -> str:
+        """
+        return masters share of group for printing, with percent normalized by capacity if capacities differ
+
+        :param counter: master counter with group
+        :param group: group or host of counter
+        :param scope: description of counter scope after share, like ' of datacenter'
+        :return: string like '40.0% masters by slots, 26.67% normalized by capacity'
+        """
+        share_desc = f'{counter.percent(counter[group])}% masters{self.get_balance_desc()}{scope}'
+        if counter.factors:
+            share_desc += f', {counter.percent(counter[group], group=group)}% normalized by capacity'
+        return share_desc
+
+    def get_balance_desc(self) -> str:
+        """
+        return balance mode description for printing, empty for count mode
+
+        :return: string like ' by slots'
+        """
+        return '' if self.balance_by == 'count' else f' by {self.balance_by}'
+
+    def get_masters_weight(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> int:
+        """
+        return summary weight of masters in nodes list
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :return: masters count for count mode or sum of masters weights
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        return sum(map(self.get_node_weight, self.get_masters(nodes=nodes, maxport=maxport)))
+
+    def load_nodes_info(self, fields: Iterable[str]) -> None:
+        """
+        request INFO fields of current nodes once per nodes list, fields that are already requested are skipped
+
+        :param fields: INFO fields like used_memory
+        :return: None
+        """
+        fields = list(filter(lambda field: self.info_nodes.get(field) is not self.currentnodes, fields))
+        if self.skipconnection or not fields:
+            return
+        self.merge_nodes_info(fields=fields)
+        for field in fields:
+            self.info_nodes[field] = self.currentnodes
+
+    def load_replication_info(self) -> None:
+        """
+        request INFO replication of current nodes once per nodes list, it's needed only for planned failovers
+
+        :return: None
+        """
+        self.load_nodes_info(fields=self.REPLICATION_FIELDS)
+
+    def load_sync_info(self) -> None:
+        """
+        request INFO fields of full sync cost and balance mode of current nodes once per nodes list, they are requested together
+        because swap_shard_info replaces info dicts of planned failover and fields requested later don't reach them
+
+        :return: None
+        """
+        self.load_nodes_info(fields=self.SYNC_FIELDS + tuple(filter(None, (self.BALANCE_MODES[self.balance_by],))))
+
+    def get_replication_lag(self, slavenode: Dict[str, Any]) -> Optional[int]:
+        """
+        return replication offset delta between slave and its master from INFO replication of current nodes
+
+        :param slavenode: slave node dict
+        :return: bytes that slave is behind master or None if unknown (no INFO or slave is replicating another master now)
+        """
+        self.load_replication_info()
+        livenode = self.get_node(nodes=self.currentnodes, nodeid=slavenode['node_id'])
+        if not livenode or livenode['master_id'] != slavenode['master_id']:
+            return None
+        slave_offset = livenode.get('info', dict()).get('slave_repl_offset')
+        if slave_offset is None:
+            return None
+        masternode = self.get_node(nodes=self.currentnodes, nodeid=slavenode['master_id'])
+        master_offset = masternode.get('info', dict()).get('master_repl_offset') if masternode else None
+        if master_offset is None:
+            return None
+        return max(0, int(master_offset) - int(slave_offset))
+
+    def get_replication_rank(self, slavenode: Dict[str, Any]) -> Tuple[int, int]:
+        """
+        return sort key of failover candidate, the lowest is the best: link up before unknown before down, then lower offset delta
+
+        :param slavenode: slave node dict
+        :return: tuple like (0, 1024)
+        """
+        lag = self.get_replication_lag(slavenode=slavenode)
+        livenode = self.get_node(nodes=self.currentnodes, nodeid=slavenode['node_id']) or slavenode
+        link_status = livenode.get('info', dict()).get('master_link_status')
+        return {'up': 0, None: 1}.get(link_status, 2), lag or 0
+
+    def is_failover_slave_healthy(self, slavenode: Dict[str, Any]) -> bool:
+        """
+        return False if master link of slave is down or replication lag is more than FAILOVER_MAX_LAG, unknown state is healthy
+
+        :param slavenode: slave node dict
+        :return: True if slave can take over without data loss
+        """
+        link_rank, lag = self.get_replication_rank(slavenode=slavenode)
+        return link_rank < 2 and lag <= self.FAILOVER_MAX_LAG
+
+    @staticmethod
+    def get_sync_bytes(masternode: Dict[str, Any]) -> int:
+        """
+        return bytes that full sync from master transfers, used_memory of master or 0 if unknown
+
+        :param masternode: master node dict
+        :return: dataset size in bytes
+        """
+        return int(masternode.get('info', dict()).get('used_memory') or 0)
+
+    @staticmethod
+    def get_link_type(node: Dict[str, Any], othernode: Dict[str, Any]) -> str:
+        """
+        return link type between two nodes: host, datacenter or cross_datacenter
 
-    def create_command(self, command: str, run_node: Dict[str, Any], affected_node: Dict[str, Any], args: Union[tuple, List] = tuple(),
-                       command_option: str = "") -> Dict[str, Any]:
+        :param node: node dict
+        :param othernode: node dict
+        :return: key of SYNC_RATES
         """
-        Construct a redis command for clusterexecute function with description
+        if node['host'] == othernode['host']:
+            return 'host'
+        if node.get('datacenter') != othernode.get('datacenter'):
+            return 'cross_datacenter'
+        return 'datacenter'
 
-        :param command: command to run on redis
-        :param run_node: node where to execute command
-        :param affected_node: node that will be affected
-        :param args: arguments for clusterexecute func
-        :param command_option: optional argument for command such as TAKEOVER / FORCE
-        :return: command in {func, args, kwargs, msg} format
+    def get_host_headroom(self, host: str, nodes: List[Dict[str, Any]] = None) -> Optional[int]:
         """
+        return free memory of server: total_system_memory minus used_memory of all instances on it
 
-        if command == 'CLUSTER REPLICATE':
-            exec_command = 'CLUSTER REPLICATE ' + affected_node['node_id']
-            command_desc = f'Attach slave  {run_node["node_id"]} {run_node["host"]}:{run_node["port"]} ' \
-                           f'to {affected_node["node_id"]} {affected_node["host"]}:{affected_node["port"]}'
+        :param host: server ip
+        :param nodes: nodes list
+        :return: bytes or None if unknown
+        """
+        return self.get_hosts_headroom(nodes=nodes).get(host)
 
-        elif command == 'CLUSTER FAILOVER':
-            if command_option == "":
-                exec_command = 'CLUSTER FAILOVER'
-            else:
-                exec_command = 'CLUSTER FAILOVER ' + command_option
-            command_desc = f'Failover node {run_node["node_id"]} {run_node["host"]}:{run_node["port"]} ' \
-                           f'[old master {affected_node["node_id"]} {affected_node["host"]}:{affected_node["port"]}]'
-        else:
-            raise Exception(f"Unknown command for redisclustertool: {command}")
+    def get_hosts_headroom(self, nodes: List[Dict[str, Any]] = None) -> Dict[str, Optional[int]]:
+        """
+        return free memory of every server in one pass over nodes, replicates don't change it, so planners compute it once per pass
 
-        command = {'func': self.cluster_execute, 'args': args,
-                   'kwargs': {'ip': run_node['host'],
-                              'port': run_node['port'],
-                              'command': exec_command},
-                   'msg': command_desc
-                   }
-        return command
+        :param nodes: nodes list
+        :return: dict like {host: bytes or None if unknown}
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        self.load_sync_info()
+        total_memory: Counter = Counter()
+        used_memory: Counter = Counter()
+        for node in nodes:
+            info = node.get('info', dict())
+            total_memory[node['host']] = max(total_memory[node['host']], int(info.get('total_system_memory') or 0))
+            used_memory[node['host']] += int(info.get('used_memory') or 0)
+        return {host: total_memory[host] - used_memory[host] if total_memory[host] else None for host in total_memory}
+
+    def get_sync_cost(self, slavenode: Dict[str, Any], masternode: Dict[str, Any], nodes: List[Dict[str, Any]] = None,
+                      headroom: Dict[str, Optional[int]] = None) -> Tuple[bool, float, int]:
+        """
+        return cost of replication slavenode from masternode, the lowest is the best
 
-    def get_current_nodes(self, onlyconnected: bool = False) -> List[Dict[str, Any]]:
+        :param slavenode: slave node dict that will replicate
+        :param masternode: new master node dict
+        :param nodes: nodes list
+        :param headroom: result of get_hosts_headroom for nodes, computed if not defined
+        :return: tuple (dataset doesn't fit slave server memory, full sync seconds, bytes)
         """
-        return current cluster nodes configuration from actual cluster
+        if nodes is None:
+            nodes = self.currentnodes
+        if slavenode['master_id'] == masternode['node_id']:
+            return False, 0, 0
+        self.load_sync_info()
+        sync_bytes = self.get_sync_bytes(masternode=masternode)
+        if headroom is None:
+            headroom = self.get_hosts_headroom(nodes=nodes)
+        headroom = headroom.get(slavenode['host'])
+        # slave drops own dataset before loading master one
+        overflow = headroom is not None and sync_bytes > headroom + int(slavenode.get('info', dict()).get('used_memory') or 0)
+        return overflow, sync_bytes / self.SYNC_RATES[self.get_link_type(slavenode, masternode)], sync_bytes
+
+    def choose_failover_slave(self, slaves: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        return the most caught up slave, the last one of slaves list if replication info is equal or unknown
 
-        :param onlyconnected: not use disconnected node
-        :rtype: List[Dict[str, Any]]
-        :return: list like {'node_id': 'nodeid' 'host': 'hostip', 'port': someport,
-         'flags': ('slave',), 'master_id': 'masternodeid', 'ping-sent': 0, 'pong-recv': 1610468870000,
-         'link-state': 'connected', 'slots': [], 'migrations': []}
+        :param slaves: slave nodes of the same master
+        :return: slave node
         """
-        prepared_nodes = []
-        for host, params in self.rc.cluster_nodes().items():
-            host, port = host.split(':')
-            params['host'], params['port'] = host, int(port)
-            prepared_nodes.append(params)
-        if onlyconnected:
-            return sorted(self.filter_only_connected_nodes(
-                nodes=self.filter_without_noaddr_flag_nodes(nodes=prepared_nodes)
-            ),
-                key=lambda node: (node['host'], node['port']))
-        else:
-            return sorted(self.filter_without_noaddr_flag_nodes(nodes=prepared_nodes),
-                          key=lambda node: (node['host'], node['port']))
+        return min(reversed(slaves), key=lambda slavenode: self.get_replication_rank(slavenode=slavenode))
 
     def filter_only_connected_nodes(self, nodes: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
@@ -399,13 +2330,14 @@ class RedisClusterTool:
             slavenode = self.get_node(nodes=nodes, maxport=maxport, nodeid=slavenodeid)
             if 'slave' not in slavenode['flags']:
                 raise Exception(f'Provided slavenode {slavenode["node_id"]} is not slave!')
-            masternodes: List[Dict[str, Any]] = list(filter(lambda x: x['node_id'] == slavenode['master_id'], self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)))
+            masternodes: List[Dict[str, Any]] = list(filter(lambda x: x.node_id == slavenode['master_id'],
+                                                            self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)))
             if masternodes:
                 return masternodes[0]
             else:
                 return masternodes
-        return list(filter(lambda node: 'master' in node.get('flags'),
-                           self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)))
+        return [node for node in self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)
+                if node.mask & NodeRecord.MASTER]
 
     def get_slaves(self, nodes: List[Dict[str, Any]] = None, masternodeid: str = None, maxport: int = MAXPORT) -> List[Dict[str, Any]]:
         """
@@ -423,12 +2355,11 @@ class RedisClusterTool:
         if not isinstance(nodes, list):
             raise TypeError(f"Nodes must be list, got {type(nodes)}")
         if masternodeid:
-            return list(filter(lambda node: node['master_id'] == masternodeid,
-                               self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)))
+            return [node for node in self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)
+                    if node.master_id == masternodeid]
         else:
-            return list(
-                filter(lambda node: 'slave' in node['flags'],
-                       self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)))
+            return [node for node in self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)
+                    if node.mask & NodeRecord.SLAVE]
 
     def get_node(self, nodeid: Union[str, List[str]], nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
         """
@@ -447,13 +2378,13 @@ class RedisClusterTool:
 
         if isinstance(nodeid, str):
             for node in self.nodes_reduced_max_port(nodes=nodes, maxport=maxport):
-                if node['node_id'] == nodeid:
+                if node.node_id == nodeid:
                     return node
         elif isinstance(nodeid, list):
             nodeslist: List = list()
             for ID in nodeid:
                 for node in self.nodes_reduced_max_port(nodes=nodes, maxport=maxport):
-                    if node['node_id'] == ID:
+                    if node.node_id == ID:
                         nodeslist.append(node)
             return nodeslist
 
@@ -522,7 +2453,7 @@ class RedisClusterTool:
             raise TypeError(f"Nodes must be list, got {type(nodes)}")
         nodesgroup: defaultdict = defaultdict(list)
         for node in self.nodes_reduced_max_port(maxport=maxport, nodes=nodes):
-            nodesgroup[node['host']].append(node)
+            nodesgroup[node.host].append(node)
         return nodesgroup
 
     def get_node_group(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, node: Dict[str, Any] = None, nodeid: str = None) -> str:
@@ -560,16 +2491,29 @@ class RedisClusterTool:
         """
         if nodes is None:
             nodes = self.currentnodes
-        nodesgroups = self.get_nodes_groups(nodes=nodes, maxport=maxport)
-        nodesgroupscounter: Counter = Counter(dict(map(lambda kv: (kv[0], len(kv[1])), nodesgroups.items())))
+        spread = self.get_max_replica_spread(nodes=nodes, maxport=maxport)
+        return spread is None or replicas <= spread
 
-        for group in range(len(self.get_masters(nodes=nodes))):
-            if len(nodesgroupscounter) < replicas + 1:
-                return False
-            nodesgroupscounter.subtract(
-                Counter(dict(map(lambda kv: (kv[0], 1), nodesgroupscounter.most_common()[:replicas + 1]))))
-            nodesgroupscounter = +nodesgroupscounter  # remove zero and negative numbers
-        return True
+    def get_max_replica_spread(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> Optional[int]:
+        """
+        Return maximum number of replicas that every master can have in groups different from master and each other.
+        Every group gives at most one node to every master-slave group, so m master-slave groups of k nodes fit groups
+        of c nodes if and only if sum(min(c, m)) >= m * k, result is cached per groups sizes and masters count
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :return: maximum replicas count, None if cluster doesn't have masters
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        groups_sizes = tuple(sorted(map(len, self.get_nodes_groups(nodes=nodes, maxport=maxport).values())))
+        masters_count = len(self.get_masters(nodes=nodes))
+        if masters_count == 0:
+            return None
+        key = (groups_sizes, masters_count)
+        if key not in self.spread_cache:
+            self.spread_cache[key] = sum(map(lambda size: min(size, masters_count), groups_sizes)) // masters_count - 1
+        return self.spread_cache[key]
 
     def nodes_reduced_max_port(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> List[Dict[str, Any]]:
         """
@@ -583,6 +2527,9 @@ class RedisClusterTool:
             nodes = self.currentnodes
         if not isinstance(nodes, list):
             raise TypeError(f"Nodes must be list, got {type(nodes)}")
+        if maxport >= self.MAXPORT:
+            # every port fits
+            return list(nodes)
         filtered_node = list(filter(lambda node: node['port'] <= maxport, nodes))
         return filtered_node
 
@@ -698,11 +2645,12 @@ class RedisClusterTool:
         """
         if nodes is None:
             nodes = self.currentnodes
-        allmastercount: int = len(self.get_masters(nodes=nodes, maxport=maxport))
-        master_per_group_percentage: Dict = {
-            group: round((100 / allmastercount) * len(self.get_masters(nodes=groupnodes, maxport=maxport)),
-                         2) if allmastercount != 0 else 0
-            for group, groupnodes in self.get_nodes_groups(nodes=nodes, maxport=maxport).items()}
+        nodes_groups = self.get_nodes_groups(nodes=nodes, maxport=maxport)
+        masters_per_group = MasterCounter({group: self.get_masters_weight(nodes=groupnodes, maxport=maxport)
+                                           for group, groupnodes in nodes_groups.items()},
+                                          capacities=self.get_groups_capacity(nodes_groups=nodes_groups))
+        master_per_group_percentage: Dict = {group: masters_per_group.percent(count, group=group)
+                                             for group, count in masters_per_group.items()}
         percents = self.mergevalueslists(master_per_group_percentage)
         if max(percents) - min(percents) > skew:
             return master_per_group_percentage
@@ -724,12 +2672,57 @@ class RedisClusterTool:
         if any([self.check_masterslave_in_group(nodes=nodes, maxport=maxport, replicas=replicas),
                 self.check_slavesofmaster_in_group(nodes=nodes, maxport=maxport, replicas=replicas),
                 self.check_master_does_not_have_desired_replica_count(nodes=nodes, maxport=maxport, replicas=replicas),
-                self.check_master_does_not_have_slaves(nodes=nodes, maxport=maxport)]):
+                self.check_master_does_not_have_slaves(nodes=nodes, maxport=maxport),
+                self.check_failure_domains(nodes=nodes, maxport=maxport)]):
             return 2
         if self.check_group_master_distribution(nodes=nodes, maxport=maxport, skew=skew):
             return 1
         return 0
 
+    def get_failure_domains(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> FailureDomains:
+        """
+        Return failure domains tree with masters and shards counters of all levels
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :return: FailureDomains object
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        return FailureDomains(self.nodes_reduced_max_port(nodes=nodes, maxport=maxport), weight=self.get_node_weight)
+
+    def check_failure_domains(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> Dict[str, List[str]]:
+        """
+        Return shards that have master and slaves in one region or rack while they can be spread, all levels are checked in one pass
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :return: dict like {'rack': [masternodeid1, masternodeid2]}
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        domains = self.get_failure_domains(nodes=nodes, maxport=maxport)
+        problems = {level: domains.spread_problems(level) for level in self.FAILURE_DOMAIN_CHECK_LEVELS}
+        return dict(filter(lambda kv: kv[1], problems.items()))
+
+    def print_failure_domains_problems(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> None:
+        """
+        Print shards that can be spread to more regions or racks
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :return: None
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        for level, masternodeids in self.check_failure_domains(nodes=nodes, maxport=maxport).items():
+            print(f'Shards in one {level} problem ({len(masternodeids)}):')
+            for masternodeid in masternodeids:
+                members = [self.get_node(nodes=nodes, nodeid=masternodeid)] + self.get_slaves(nodes=nodes, masternodeid=masternodeid, maxport=maxport)
+                placement = ', '.join(map(lambda node: f'{node["host"]}:{node["port"]} ({node[level]})', members))
+                print(f'    Master {masternodeid} shard has several nodes in one {level}: {placement}')
+            print()
+
     def check_master_without_slots(self, nodes: List[Dict[str, Any]] = None) -> Tuple[Any]:
         """
         check that redis cluster doesn't have masters without slots
@@ -810,9 +2803,11 @@ class RedisClusterTool:
                 print(f'    Master node {master_node["node_id"]} ({master_node["host"]}) has no slaves')
             print()
 
+        self.print_failure_domains_problems(nodes=nodes, maxport=maxport)
+
         masters_group_skew: Dict = self.check_group_master_distribution(nodes=nodes, maxport=maxport, skew=skew)
         if masters_group_skew:
-            print(f'Groups have master distribution skew more than {skew}% (actual '
+            print(f'Groups have master distribution{self.get_balance_desc()} skew more than {skew}% (actual '
                   f'{round(max(masters_group_skew.values()) - min(masters_group_skew.values()), 2)}%): {masters_group_skew}\n')
 
     @staticmethod
@@ -857,135 +2852,753 @@ class RedisClusterTool:
         if nodes is None:
             nodes = self.currentnodes
         for index, node in enumerate(nodes):
-            if node['node_id'] == nodeid:
+            if node.node_id == nodeid:
                 return index
 
-    def plan_clusternode_failover(self, slavenodeid: str, nodes: List[Dict[str, Any]] = None, option: str = 'TAKEOVER',
-                                  dryrun: bool = False, deep_copy: bool = False) -> List[Dict[str, Any]]:
+    def plan_clusternode_failover(self, slavenodeid: str, nodes: List[Dict[str, Any]] = None, option: str = 'TAKEOVER',
+                                  dryrun: bool = False, deep_copy: bool = False) -> List[Dict[str, Any]]:
+        """
+        Plan future cluster failover operations and return nodes list that must be after node failover
+
+        :rtype: List[Dict[str, Any]]
+        :param slavenodeid: id of slave node
+        :param nodes: nodes list
+        :param option: TAKEOVER or FORCE
+        :param dryrun: do not actually append new plan, just return new nodelist
+        :param deep_copy: use deepcopy nodes or not for provided nodes
+        :return: renewed nodes list
+        """
+        if nodes is None:
+            nodes = deepcopy(self.currentnodes)
+        elif deep_copy:
+            nodes = deepcopy(nodes)
+
+        masternode = self.get_masters(nodes=nodes, slavenodeid=slavenodeid)
+        if masternode:
+            masternode = masternode
+        else:
+            raise Exception('Slavenodeid mast be id of slave node, not master')
+        masternodeindex = self.get_node_index(nodes=nodes, nodeid=masternode['node_id'])
+        slavenodeindex = self.get_node_index(nodes=nodes, nodeid=slavenodeid)
+        lag = None if dryrun else self.get_replication_lag(slavenode=nodes[slavenodeindex])
+        pre = None if dryrun else [self.get_node_state(nodes[slavenodeindex]), self.get_node_state(nodes[masternodeindex])]
+        slavesofmasterreduced = list(
+            filter(lambda node: node['node_id'] != slavenodeid, self.get_slaves(nodes=nodes, masternodeid=masternode['node_id'])))
+
+        # swap old-new master-slave fields
+        nodes[masternodeindex].slots, nodes[slavenodeindex].slots = nodes[slavenodeindex].slots, nodes[masternodeindex].slots
+        # load of shard moves with master role, so new master gets memory and ops of old master
+        self.swap_shard_info(nodes[masternodeindex], nodes[slavenodeindex])
+        nodes[masternodeindex]['master_id'], nodes[slavenodeindex]['master_id'] = slavenodeid, nodes[masternodeindex][
+            'master_id']
+        nodes[masternodeindex]['flags'], nodes[slavenodeindex]['flags'] = ('slave',), ('master',)
+        for node in slavesofmasterreduced:
+            nodes[self.get_node_index(nodes=nodes, nodeid=node['node_id'])]['master_id'] = slavenodeid
+
+        if not dryrun:
+            slave_node = self.get_node(nodes=nodes, nodeid=slavenodeid)
+            command = self.create_command('CLUSTER FAILOVER', run_node=slave_node, affected_node=masternode,
+                                          command_option=option)
+            command.update(node_id=slavenodeid, pre=pre,
+                           post=[self.get_node_state(nodes[slavenodeindex]), self.get_node_state(nodes[masternodeindex])])
+            if lag is not None:
+                command['catch_up'] = round(lag / self.REPLICATION_RATE, 2)
+                command['msg'] += f' (replication lag {lag} bytes, expected catch-up {command["catch_up"]}s)'
+            self.plans.append(command)
+
+        return nodes
+
+    def plan_clusternode_replicate(self, masternodeid: str, slavenodeid: str, nodes: List[Dict[str, Any]] = None,
+                                   dryrun: bool = False, deep_copy: bool = False) -> List[Dict[str, Any]]:
+        """
+        Plan future cluster replication operations and return nodes list that must be after node replication
+
+        :rtype: List[Dict[str, Any]]
+        :param masternodeid: id of specified master node
+        :param slavenodeid: id of slave node
+        :param nodes: nodes list
+        :param dryrun: do not actually append new plan, just return new nodelist
+        :param deep_copy: use deepcopy nodes or not for provided nodes
+        :return: renewed nodes list
+        """
+        if nodes is None:
+            nodes = deepcopy(self.currentnodes)
+        elif deep_copy:
+            nodes = deepcopy(nodes)
+
+        slavenode: Dict = self.get_node(nodes=nodes, nodeid=slavenodeid)
+        if 'slave' not in slavenode['flags']:
+            raise Exception('Slavenodeid must be id of slave node, not master')
+        newmasternode: Dict = self.get_node(nodes=nodes, nodeid=masternodeid)
+        if 'master' not in newmasternode['flags']:
+            raise Exception('Masternodeid must be id of master node, not slave')
+
+        sync_cost = None if dryrun else self.get_sync_cost(slavenode=slavenode, masternode=newmasternode, nodes=nodes)
+        pre = None if dryrun else [self.get_node_state(slavenode)]
+        nodes[self.get_node_index(nodes=nodes, nodeid=slavenodeid)]['master_id'] = masternodeid
+
+        if not dryrun:
+            command = self.create_command('CLUSTER REPLICATE', run_node=slavenode, affected_node=newmasternode)
+            command.update(node_id=slavenodeid, pre=pre, post=[self.get_node_state(self.get_node(nodes=nodes, nodeid=slavenodeid))])
+            overflow, command['sync_time'], command['sync_bytes'] = sync_cost
+            if command['sync_bytes']:
+                command['msg'] += f' (full sync {round(command["sync_bytes"] / 1024 ** 2, 1)} MB over ' \
+                                  f'{self.get_link_type(slavenode, newmasternode)} link, ~{round(command["sync_time"], 1)}s' \
+                                  f'{", exceeds server free memory" if overflow else ""})'
+            self.plans.append(command)
+
+        return nodes
+
+    def get_node_connection(self, ip: str, port: Union[int, str], fresh: bool = False) -> redis.Redis:
+        """
+        Return redis connection of cluster node
+
+        :param ip: ip address of redis instance
+        :param port: port of redis instance
+        :param fresh: drop pooled connections of node to get new one
+        :return: redis.Redis object
+        """
+        redis_node = self.rc.get_node(host=ip, port=port)
+        if redis_node is None:
+            raise redis.exceptions.ConnectionError(f"Node {ip}:{port} is unknown for cluster client")
+        if fresh:
+            redis_node.redis_connection.connection_pool.disconnect()
+        return redis_node.redis_connection
+
+    def cluster_execute(self, ip: str, port: Union[int, str], command: str) -> bool:
+        """
+        Executor method, retries temporary errors by retry_policy
+
+        :param ip: ip address of target execute command host
+        :param port: port address of target execute command redis instance
+        :param command: string with full command
+        :return: True if command was successful, raise exception on fatal error or after deadline
+        """
+        start = monotonic()
+        for attempt in itertools.count():
+            try:
+                resp = self.get_node_connection(ip=ip, port=port, fresh=attempt > 0).execute_command(command)
+                resp = resp.decode('utf-8') if isinstance(resp, bytes) else resp
+                print(f'Cluster answer: {resp}')
+                if resp in ("OK", True):
+                    return True
+                error: Exception = Exception(f"Node {ip}:{port} not accept command {command}: {resp}")
+            except Exception as e:
+                if not self.retry_policy.is_retryable(e):
+                    raise Exception(f'Can not execute command with args: ip = {ip}, port = {port}, command = {command}: {e}')
+                error = e
+            delay = self.retry_policy.delay(attempt)
+            if monotonic() - start + delay > self.retry_policy.deadline:
+                raise Exception(f'Can not execute command with args: ip = {ip}, port = {port}, command = {command} '
+                                f'in {self.retry_policy.deadline}s: {error}')
+            print(f"Got error:\n{error}\nRetry {attempt + 1}\nSleep {round(delay, 1)}s...")
+            sleep(delay)
+
+    def get_simulation_steps(self, plans: List[Dict[str, Any]] = None, nodes: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Return plans as steps for PlanSimulator with nodes, servers and datacenters that every step touches
+
+        :param plans: list of plan dicts
+        :param nodes: nodes list before plans
+        :return: list like [{'msg': msg, 'sync': True, 'sync_time': 60.0, 'catch_up': 0, 'nodes': {nodeid}, 'hosts': {ip}, 'datacenters': {dc}}]
+        """
+        if plans is None:
+            plans = self.plans
+        if nodes is None:
+            nodes = self.currentnodes
+        nodes_by_id: Dict[str, Dict[str, Any]] = {node['node_id']: node for node in nodes}
+        steps = []
+        for plan in plans:
+            # failover touches new and old master, replicate touches replica and its new master
+            nodeids = set(map(lambda state: state['node_id'], plan.get('pre', ())))
+            sync = False
+            if plan['kwargs']['command'].startswith('CLUSTER REPLICATE'):
+                masternodeid = plan['kwargs']['command'].split()[-1]
+                nodeids.add(masternodeid)
+                # replica that already replicates the master doesn't need full sync
+                sync = not any(map(lambda state: state['master_id'] == masternodeid, plan.get('pre', ())))
+            stepnodes = list(filter(None, map(nodes_by_id.get, nodeids)))
+            steps.append({'msg': plan['msg'], 'sync': sync, 'sync_time': plan.get('sync_time', 0) if plan.get('sync_bytes') else 0,
+                          'catch_up': plan.get('catch_up', 0), 'nodes': nodeids,
+                          'hosts': set(map(lambda node: node['host'], stepnodes)),
+                          'datacenters': set(filter(None, map(lambda node: node.get('datacenter'), stepnodes)))})
+        return steps
+
+    def print_plan_simulation(self, simulator: PlanSimulator, plans: List[Dict[str, Any]] = None, nodes: List[Dict[str, Any]] = None,
+                              timeline: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Print simulated duration of serial and parallel plan execution
+
+        :param simulator: PlanSimulator object
+        :param plans: list of plan dicts
+        :param nodes: nodes list before plans
+        :param timeline: print timeline and critical path of every strategy
+        :return: dict like {'serial': simulation result, 'parallel': simulation result}
+        """
+        steps = self.get_simulation_steps(plans=plans, nodes=nodes)
+        simulations = {strategy: simulator.run(steps=steps, strategy=strategy) for strategy in ('serial', 'parallel')}
+        for strategy, simulation in simulations.items():
+            print(f"Simulated {strategy} execution will take {datetime.timedelta(seconds=round(simulation['duration']))} time, "
+                  f"peak concurrent full syncs {simulation['peak_syncs']}, critical path {len(simulation['critical_path'])} steps")
+            if timeline:
+                for index, (start, end) in enumerate(simulation['timeline']):
+                    print(f"    {'*' if index in simulation['critical_path'] else ' '} "
+                          f"{datetime.timedelta(seconds=round(start))} - {datetime.timedelta(seconds=round(end))} {steps[index]['msg']}")
+        return simulations
+
+    @staticmethod
+    def get_node_state(node: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return role state of node for plan file
+
+        :param node: node dict
+        :return: dict like {'node_id': nodeid, 'host': '10.0.0.1', 'port': 7000, 'role': 'master', 'master_id': '-'}
+        """
+        return {'node_id': node['node_id'], 'host': node['host'], 'port': node['port'],
+                'role': 'master' if 'master' in node['flags'] else 'slave', 'master_id': node['master_id']}
+
+    def get_topology_fingerprint(self, nodes: List[Dict[str, Any]] = None) -> str:
+        """
+        Return hash of nodes roles, replication and slots, that doesn't depend on nodes order and INFO
+
+        :param nodes: nodes list
+        :return: sha1 hex digest
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        topology = sorted([node['node_id'], node['host'], int(node['port']), 'master' in node['flags'], node['master_id'],
+                           self.get_slots_ranges(node)] for node in nodes)
+        return hashlib.sha1(json.dumps(topology).encode('utf-8')).hexdigest()
+
+    def export_plans(self, plans: List[Dict[str, Any]] = None, nodes: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Return plans in json serializable form for --plan-out
+
+        :param plans: list of plan dicts
+        :param nodes: nodes list before plans
+        :return: dict like {'version': 1, 'fingerprint': 'sha1', 'created': 'iso date', 'steps': [{'command': 'CLUSTER FAILOVER TAKEOVER', ...}]}
+        """
+        if plans is None:
+            plans = self.plans
+        if nodes is None:
+            nodes = self.currentnodes
+        steps = [dict({'command': plan['kwargs']['command'], 'host': plan['kwargs']['ip'], 'port': plan['kwargs']['port']},
+                      **{field: plan[field] for field in self.PLAN_FIELDS if field in plan})
+                 for plan in plans]
+        return {'version': self.PLAN_VERSION, 'fingerprint': self.get_topology_fingerprint(nodes=nodes),
+                'created': datetime.datetime.now().isoformat(timespec='seconds'), 'steps': steps}
+
+    def import_plans(self, plan: Dict[str, Any], nodes: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Check topology fingerprint of plan from --plan-in, set plans and return nodes list that must be after them
+
+        :param plan: result of export_plans
+        :param nodes: nodes list
+        :return: planned nodes
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        if plan.get('version') != self.PLAN_VERSION:
+            raise Exception(f"Unknown plan version {plan.get('version')}, expected {self.PLAN_VERSION}")
+        fingerprint = self.get_topology_fingerprint(nodes=nodes)
+        if plan['fingerprint'] != fingerprint:
+            raise Exception(f"Cluster topology was changed since plan creation at {plan.get('created')}: "
+                            f"fingerprint {fingerprint} instead of {plan['fingerprint']}")
+
+        planned_nodes = deepcopy(nodes)
+        plans = []
+        for step in plan['steps']:
+            # replay step to get nodes after plan, it also checks that roles fit commands
+            if step['command'].startswith('CLUSTER FAILOVER'):
+                planned_nodes = self.plan_clusternode_failover(slavenodeid=step['node_id'], nodes=planned_nodes, dryrun=True)
+            elif step['command'].startswith('CLUSTER REPLICATE'):
+                planned_nodes = self.plan_clusternode_replicate(masternodeid=step['command'].split()[-1], slavenodeid=step['node_id'],
+                                                                nodes=planned_nodes, dryrun=True)
+            else:
+                raise Exception(f"Unknown command for redisclustertool: {step['command']}")
+            plans.append(dict({'func': self.cluster_execute, 'args': tuple(),
+                               'kwargs': {'ip': step['host'], 'port': step['port'], 'command': step['command']}},
+                              **{field: step[field] for field in self.PLAN_FIELDS if field in step}))
+        self.plans = plans
+        return planned_nodes
+
+    def get_involved_nodes(self, plan: Dict[str, Any], nodes: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Return masters and all their slaves of shards that plan step touches
+
+        :param plan: plan dict
+        :param nodes: nodes list
+        :return: nodes list
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        nodeids = set(map(lambda state: state['node_id'], plan.get('pre', ())))
+        if plan['kwargs']['command'].startswith('CLUSTER REPLICATE'):
+            nodeids.add(plan['kwargs']['command'].split()[-1])
+        if not nodeids:
+            nodeids = set(map(lambda node: node['node_id'],
+                              filter(lambda node: (node['host'], node['port']) == (plan['kwargs']['ip'], plan['kwargs']['port']), nodes)))
+        shard_masters = set(map(lambda node: node['node_id'] if 'master' in node['flags'] else node['master_id'],
+                                filter(lambda node: node['node_id'] in nodeids, nodes)))
+        return list(filter(lambda node: node['node_id'] in shard_masters or node['master_id'] in shard_masters or node['node_id'] in nodeids,
+                           nodes))
+
+    def get_node_health(self, node: Dict[str, Any], gate: HealthGate) -> List[str]:
+        """
+        Return health problems of node by gate
+
+        :param node: node dict
+        :param gate: HealthGate object
+        :return: list of problems descriptions with node address
+        """
+        try:
+            connection = self.rc.get_node(host=node['host'], port=node['port']).redis_connection
+            start = monotonic()
+            connection.ping()
+            latency = (monotonic() - start) * 1000
+            problems = gate.check(node=node, info=connection.info(), cluster_info=connection.cluster('INFO'), latency=latency)
+        except Exception as e:
+            problems = [f'unavailable: {e}']
+        return list(map(lambda problem: f"{node['host']}:{node['port']} {problem}", problems))
+
+    def check_health(self, gate: HealthGate, plan: Dict[str, Any] = None) -> List[str]:
+        """
+        Return health problems of cluster: failed nodes and problems of nodes involved in plan step, nodes are polled concurrently
+
+        :param gate: HealthGate object
+        :param plan: plan dict, all nodes are checked if None
+        :return: list of problems descriptions, empty if cluster is healthy
+        """
+        # fresh nodes without inventory lookups
+        nodes = RedisClusterTool.get_current_nodes(self)
+        problems = list(map(lambda node: f"{node['host']}:{node['port']} has flags {node['flags']}", self.check_failed_nodes(nodes=nodes)))
+        involved_nodes = self.get_involved_nodes(plan=plan, nodes=nodes) if plan else nodes
+        with ThreadPoolExecutor(max_workers=min(32, max(1, len(involved_nodes)))) as executor:
+            for node_problems in executor.map(lambda node: self.get_node_health(node=node, gate=gate), involved_nodes):
+                problems.extend(node_problems)
+        return problems
+
+    def wait_health(self, gate: HealthGate, plan: Dict[str, Any] = None) -> None:
+        """
+        Wait until cluster is healthy with growing pauses
+
+        :param gate: HealthGate object
+        :param plan: plan dict, all nodes are checked if None
+        :return: None
+        """
+        start = monotonic()
+        for attempt in itertools.count():
+            problems = self.check_health(gate=gate, plan=plan)
+            if not problems:
+                return
+            if monotonic() - start > gate.max_wait:
+                raise Exception(f"Cluster is not healthy for {datetime.timedelta(seconds=round(monotonic() - start))}: {', '.join(problems)}")
+            pause = gate.backoff(attempt)
+            print(f"Cluster is not healthy: {', '.join(problems)}\nSleep {pause}s...")
+            sleep(pause)
+
+    def check_slots(self, nodes: List[Dict[str, Any]] = None) -> List[str]:
+        """
+        Return slots coverage problems of nodes
+
+        :param nodes: nodes list
+        :return: list of problems descriptions, empty if all slots are served by one node
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        return SlotMap(nodes).problems()
+
+    def get_masters_claims(self, nodes: List[Dict[str, Any]] = None) -> Dict[str, Dict[str, list]]:
         """
-        Plan future cluster failover operations and return nodes list that must be after node failover
+        Return slots and open slots that every master claims in own CLUSTER NODES, so masters are polled concurrently:
+        every master shows only own migrations, and after lost failover or split its slots differ from view of other nodes
 
-        :rtype: List[Dict[str, Any]]
-        :param slavenodeid: id of slave node
         :param nodes: nodes list
-        :param option: TAKEOVER or FORCE
-        :param dryrun: do not actually append new plan, just return new nodelist
-        :param deep_copy: use deepcopy nodes or not for provided nodes
-        :return: renewed nodes list
+        :return: dict like {masternodeid: {'slots': [['0', '5460']], 'migrations': [{'slot': '100', 'node_id': nodeid, 'state': 'migrating'}]}}
         """
         if nodes is None:
-            nodes = deepcopy(self.currentnodes)
-        elif deep_copy:
-            nodes = deepcopy(nodes)
+            nodes = self.currentnodes
 
-        masternode = self.get_masters(nodes=nodes, slavenodeid=slavenodeid)
-        if masternode:
-            masternode = masternode
-        else:
-            raise Exception('Slavenodeid mast be id of slave node, not master')
-        masternodeindex = self.get_node_index(nodes=nodes, nodeid=masternode['node_id'])
-        slavenodeindex = self.get_node_index(nodes=nodes, nodeid=slavenodeid)
-        slavesofmasterreduced = list(
-            filter(lambda node: node['node_id'] != slavenodeid, self.get_slaves(nodes=nodes, masternodeid=masternode['node_id'])))
+        def claims(node: Dict[str, Any]) -> Dict[str, list]:
+            for params in self.get_node_connection(ip=node['host'], port=node['port']).cluster('NODES').values():
+                if 'myself' in params['flags']:
+                    return {'slots': params['slots'], 'migrations': params['migrations']}
+            return {'slots': node['slots'], 'migrations': []}
 
-        # swap old-new master-slave fields
-        nodes[masternodeindex]['slots'], nodes[slavenodeindex]['slots'] = nodes[slavenodeindex]['slots'], \
-            nodes[masternodeindex]['slots']
-        nodes[masternodeindex]['master_id'], nodes[slavenodeindex]['master_id'] = slavenodeid, nodes[masternodeindex][
-            'master_id']
-        nodes[masternodeindex]['flags'], nodes[slavenodeindex]['flags'] = ('slave',), ('master',)
-        for node in slavesofmasterreduced:
-            nodes[self.get_node_index(node['node_id'])]['master_id'] = slavenodeid
+        masters = self.get_masters(nodes=nodes)
+        with ThreadPoolExecutor(max_workers=min(32, max(1, len(masters)))) as executor:
+            return dict(zip(map(lambda node: node['node_id'], masters), executor.map(claims, masters)))
 
-        if not dryrun:
-            slave_node = self.get_node(nodes=nodes, nodeid=slavenodeid)
-            command = self.create_command('CLUSTER FAILOVER', run_node=slave_node, affected_node=masternode,
-                                          command_option=option)
-            self.plans.append(command)
+    def verify_slots(self, stage: str) -> None:
+        """
+        Check that all slots of actual cluster are claimed by one master and aren't migrating or importing
 
-        return nodes
+        :param stage: description of execution stage for error
+        :return: None
+        """
+        # fresh nodes without inventory lookups
+        nodes = RedisClusterTool.get_current_nodes(self)
+        # slots of every master are taken from its own view, one view has only one owner of slot and can't show overlap
+        for nodeid, claims in self.get_masters_claims(nodes=nodes).items():
+            masternode = nodes[self.get_node_index(nodeid=nodeid, nodes=nodes)]
+            masternode['slots'], masternode['migrations'] = claims['slots'], claims['migrations']
+        problems = self.check_slots(nodes=nodes)
+        if problems:
+            raise Exception(f"Slots check {stage} failed: {'; '.join(problems)}")
+
+    def start_write_probe(self, plan: Dict[str, Any]) -> Optional[WriteProbe]:
+        """
+        Start write probe of shard that is failed over by plan step
 
-    def plan_clusternode_replicate(self, masternodeid: str, slavenodeid: str, nodes: List[Dict[str, Any]] = None,
-                                   dryrun: bool = False, deep_copy: bool = False) -> List[Dict[str, Any]]:
+        :param plan: plan dict
+        :return: started WriteProbe object or None if probes are disabled, step isn't failover or shard doesn't have slots
         """
-        Plan future cluster replication operations and return nodes list that must be after node replication
+        if not self.write_probe or not plan['kwargs']['command'].startswith('CLUSTER FAILOVER'):
+            return None
+        # fresh nodes without inventory lookups
+        nodes = RedisClusterTool.get_current_nodes(self)
+        slavenodes = list(filter(lambda node: (node['host'], node['port']) == (plan['kwargs']['ip'], int(plan['kwargs']['port'])), nodes))
+        if not slavenodes or 'slave' not in slavenodes[0]['flags']:
+            return None
+        masternode = self.get_node(nodeid=slavenodes[0]['master_id'], nodes=nodes)
+        if not masternode or not self.get_slots_count(masternode):
+            return None
+        probe = WriteProbe(host=masternode['host'], port=masternode['port'], slot=self.get_slots_ranges(masternode)[0][0],
+                           passwd=self.passwd, interval=self.probe_interval)
+        probe.start()
+        return probe
 
-        :rtype: List[Dict[str, Any]]
-        :param masternodeid: id of specified master node
-        :param slavenodeid: id of slave node
-        :param nodes: nodes list
-        :param dryrun: do not actually append new plan, just return new nodelist
-        :param deep_copy: use deepcopy nodes or not for provided nodes
-        :return: renewed nodes list
+    def stop_write_probe(self, probe: Optional[WriteProbe], plan: Dict[str, Any]) -> None:
         """
-        if nodes is None:
-            nodes = deepcopy(self.currentnodes)
-        elif deep_copy:
-            nodes = deepcopy(nodes)
+        Stop write probe, add its measurements to execution report and save report to probe_report file if defined
 
-        slavenode: Dict = self.get_node(nodes=nodes, nodeid=slavenodeid)
-        if 'slave' not in slavenode['flags']:
-            raise Exception('Slavenodeid must be id of slave node, not master')
-        newmasternode: Dict = self.get_node(nodes=nodes, nodeid=masternodeid)
-        if 'master' not in newmasternode['flags']:
-            raise Exception('Masternodeid must be id of master node, not slave')
+        :param probe: WriteProbe object from start_write_probe
+        :param plan: plan dict
+        :return: None
+        """
+        if probe is None:
+            return
+        result = dict({'step': plan['msg'], 'host': plan['kwargs']['ip'], 'port': plan['kwargs']['port'],
+                       'command': plan['kwargs']['command']}, **probe.stop())
+        self.execution_report.append(result)
+        print(f"Write probe of {result['host']}:{result['port']}: unavailable {result['unavailable']}s, redirects {result['redirects']}, "
+              f"errors {result['errors']}, latency p50 {result['p50']}ms p99 {result['p99']}ms max {result['max']}ms")
+        if self.probe_report:
+            with open(self.probe_report, 'w') as f:
+                json.dump(self.execution_report, f, indent=2)
+
+    def record_history(self) -> None:
+        """
+        Append current nodes to topology history if defined
 
-        nodes[self.get_node_index(nodes=nodes, nodeid=slavenodeid)]['master_id'] = masternodeid
+        :return: None
+        """
+        if self.history is not None:
+            self.history.record(nodes=self.currentnodes)
 
-        if not dryrun:
-            command = self.create_command('CLUSTER REPLICATE', run_node=slavenode, affected_node=newmasternode)
-            self.plans.append(command)
+    def get_node_role(self, ip: str, port: Union[int, str]) -> str:
+        """
+        Return role of redis instance from INFO replication
 
-        return nodes
+        :param ip: ip address of redis instance
+        :param port: port of redis instance
+        :return: master or slave
+        """
+        return self.get_node_connection(ip=ip, port=port).info('replication')['role']
 
-    def cluster_execute(self, ip: str, port: Union[int, str], command: str) -> bool:
+    def wait_node_role(self, ip: str, port: Union[int, str], role: str = 'master', timeout: float = 90, interval: float = 1) -> bool:
         """
-        Executor method
+        Poll redis instance until it has role
+
+        :param ip: ip address of redis instance
+        :param port: port of redis instance
+        :param role: master or slave
+        :param timeout: maximum seconds of polling
+        :param interval: seconds between polls
+        :return: True if instance has role before timeout
+        """
+        start = monotonic()
+        while True:
+            try:
+                if self.get_node_role(ip=ip, port=port) == role:
+                    return True
+            except Exception as e:
+                print(f"Can't get role of {ip}:{port}: {e}")
+            if monotonic() - start > timeout:
+                return False
+            sleep(interval)
 
-        :param ip: ip address of target execute command host
-        :param port: port address of target execute command redis instance
-        :param command: string with full command
-        :return: True if command was successful else False
+    def wait_node_synced(self, ip: str, port: Union[int, str], timeout: float = 90, interval: float = 1) -> bool:
         """
-        resp = None
-        for n in itertools.count(start=1, step=1):
+        Poll slave until it has master link up and doesn't sync with master
+
+        :param ip: ip address of redis instance
+        :param port: port of redis instance
+        :param timeout: maximum seconds of polling
+        :param interval: seconds between polls
+        :return: True if slave is ready for failover before timeout
+        """
+        start = monotonic()
+        while True:
             try:
-                redis_node = self.rc.get_node(host=ip, port=port)
-                resp = redis_node.redis_connection.execute_command(command).decode('utf-8')
-                print(f'Cluster answer: {resp}')
-                if resp == "OK":
-                    resp = True
+                info = self.get_node_connection(ip=ip, port=port).info('replication')
+                if info['role'] != 'slave' or (info.get('master_link_status') == 'up' and not info.get('master_sync_in_progress')):
+                    return True
+            except Exception as e:
+                print(f"Can't get replication state of {ip}:{port}: {e}")
+            if monotonic() - start > timeout:
+                return False
+            sleep(interval)
+
+    def cluster_failovers_execute(self, plans: List[Dict[str, Any]] = None, concurrency: int = 4, timeout: float = 90,
+                                  wait_sync: bool = False, gate: HealthGate = None) -> List[Dict[str, Any]]:
+        """
+        Execute failovers of different shards concurrently and verify every one by polling role of new master
+
+        :param plans: list of CLUSTER FAILOVER plan dicts
+        :param concurrency: maximum number of concurrent failovers
+        :param timeout: maximum seconds to wait role change of every failover
+        :param wait_sync: wait until slave finishes sync with master before failover, skip it after timeout
+        :param gate: HealthGate object, every failover waits healthy cluster and nodes of failover if defined
+        :return: list of failed plans
+        """
+        if plans is None:
+            plans = self.plans
+        if self.slots_check:
+            self.verify_slots(stage='before failovers')
+
+        def failover(plan: Dict[str, Any]) -> bool:
+            try:
+                ip, port = plan['kwargs']['ip'], plan['kwargs']['port']
+                if wait_sync and not self.wait_node_synced(ip=ip, port=port, timeout=timeout):
+                    print(f"Failover skipped for {ip}:{port}: instance is still syncing with master after {timeout}s")
+                    return False
+                if self.get_node_role(ip=ip, port=port) != 'master':
+                    if gate:
+                        self.wait_health(gate=gate, plan=plan)
+                    probe = self.start_write_probe(plan)
+                    try:
+                        self.cluster_execute(**plan['kwargs'])
+                        role_changed = self.wait_node_role(ip=ip, port=port, role='master', timeout=timeout)
+                    finally:
+                        self.stop_write_probe(probe, plan)
+                else:
+                    role_changed = True
+                if role_changed:
+                    print(f"Failover successful for {ip}:{port}")
+                    return True
+                print(f"Failover failed for {ip}:{port}: instance is not master after {timeout}s")
+            except Exception as e:
+                print(f"Failover failed for {plan['kwargs']['ip']}:{plan['kwargs']['port']}: {e}")
+            return False
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            results = list(executor.map(failover, plans))
+        if self.slots_check:
+            self.verify_slots(stage='after failovers')
+        self.currentnodes = self.get_current_nodes()
+        self.record_history()
+        return [plan for plan, result in zip(plans, results) if not result]
+
+    def cluster_migrate_slot(self, source: Dict[str, Any], target: Dict[str, Any], slot: int, batch: int = 100, pipeline: int = 10,
+                             max_keys_per_sec: float = 0, timeout: int = 60000) -> int:
+        """
+        Migrate slot with keys from source master to target master with CLUSTER SETSLOT and pipelined MIGRATE ... KEYS batches
+
+        :param source: master node dict that owns slot
+        :param target: master node dict that will own slot
+        :param slot: slot number
+        :param batch: number of keys in one MIGRATE command
+        :param pipeline: number of MIGRATE commands in one pipeline
+        :param max_keys_per_sec: limit of migrated keys per second, 0 for unlimited
+        :param timeout: MIGRATE timeout in milliseconds
+        :return: number of migrated keys
+        """
+        source_connection = self.get_node_connection(ip=source['host'], port=source['port'])
+        target_connection = self.get_node_connection(ip=target['host'], port=target['port'])
+        auth = ('AUTH', self.passwd) if self.passwd else ()
+        migrated, start, keys_sent = 0, monotonic(), False
+        try:
+            target_connection.execute_command('CLUSTER', 'SETSLOT', slot, 'IMPORTING', source['node_id'])
+            source_connection.execute_command('CLUSTER', 'SETSLOT', slot, 'MIGRATING', target['node_id'])
+            while True:
+                keys = source_connection.execute_command('CLUSTER', 'GETKEYSINSLOT', slot, batch * pipeline)
+                if not keys:
                     break
-                print(f"Node {ip}:{port} not accept command {command}. Retry {n}/5\nSleep 2m...")
-                sleep(120)
-                if n > 5:
-                    raise Exception(f"Node {ip}:{port} not accept command {command}")
+                pipe = source_connection.pipeline(transaction=False)
+                for index in range(0, len(keys), batch):
+                    # key left on target by interrupted migration is overwritten by source one
+                    pipe.execute_command('MIGRATE', target['host'], target['port'], '', 0, timeout, 'REPLACE', *auth,
+                                         'KEYS', *keys[index:index + batch])
+                keys_sent = True
+                pipe.execute()
+                migrated += len(keys)
+                if max_keys_per_sec:
+                    sleep(max(0.0, migrated / max_keys_per_sec - (monotonic() - start)))
+        except Exception as e:
+            address = f"{source['host']}:{source['port']} to {target['host']}:{target['port']}"
+            if keys_sent:
+                # keys are on both nodes now, slot stays open so the next migration continues it
+                raise Exception(f"Migration of slot {slot} from {address} failed after {migrated} keys, slot is left MIGRATING on source "
+                                f"and IMPORTING on target, run --reshard again to continue it: {e}")
+            # keys are not moved yet, so slot is closed back
+            for connection in (target_connection, source_connection):
+                try:
+                    connection.execute_command('CLUSTER', 'SETSLOT', slot, 'STABLE')
+                except Exception as stable_error:
+                    print(f"Can't set slot {slot} stable: {stable_error}")
+            raise Exception(f"Migration of slot {slot} from {address} failed before keys move, slot is set stable: {e}")
+        # target first, then source, then other masters for faster propagation
+        for node in [target, source] + list(filter(lambda node: node['node_id'] not in (source['node_id'], target['node_id']),
+                                                   self.get_masters())):
+            try:
+                self.get_node_connection(ip=node['host'], port=node['port']).execute_command('CLUSTER', 'SETSLOT', slot, 'NODE',
+                                                                                              target['node_id'])
             except Exception as e:
-                if n > 5:
-                    raise Exception(
-                        f'Can not execute command with args: ip = {ip}, port = {port}, command = {command} ')
-                print(f"Got exception:\n{e}\nRepeat {n}/5\nSleep 2m...")
-                sleep(120)
-                break
-        return resp
+                if node in (target, source):
+                    raise
+                print(f"Can't set slot {slot} owner on {node['host']}:{node['port']}: {e}")
+        return migrated
+
+    def cluster_migrate_slots(self, moves: List[Dict[str, Any]], concurrency: int = 4, batch: int = 100, pipeline: int = 10,
+                              max_keys_per_sec: float = 0) -> int:
+        """
+        Execute moves of plan_reshard, moves run concurrently and slots of one move one by one
+
+        :param moves: result of plan_reshard
+        :param concurrency: maximum number of concurrent moves
+        :param batch: number of keys in one MIGRATE command
+        :param pipeline: number of MIGRATE commands in one pipeline
+        :param max_keys_per_sec: limit of migrated keys per second for all moves, 0 for unlimited
+        :return: number of migrated keys
+        """
+        def migrate(move: Dict[str, Any]) -> int:
+            source, target = self.get_node(nodeid=move['source']), self.get_node(nodeid=move['target'])
+            migrated = 0
+            for slot in move['slots']:
+                migrated += self.cluster_migrate_slot(source=source, target=target, slot=slot, batch=batch, pipeline=pipeline,
+                                                      max_keys_per_sec=max_keys_per_sec / min(concurrency, len(moves)))
+            print(f"Moved {len(move['slots'])} slots with {migrated} keys from {source['host']}:{source['port']} "
+                  f"to {target['host']}:{target['port']}")
+            return migrated
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(moves)))) as executor:
+            migrated_keys = sum(executor.map(migrate, moves))
+        self.currentnodes = self.get_current_nodes()
+        return migrated_keys
+
+    @staticmethod
+    def format_restart_command(restart_command: str, host: str) -> str:
+        """
+        Return restart command of server with shell quoted host
+
+        :param restart_command: shell command with {host} placeholder like 'ssh {host} systemctl restart redis-cluster'
+        :param host: server from nodes (ip or hostname)
+        :return: shell command
+        """
+        return restart_command.format(host=shlex.quote(host))
+
+    @classmethod
+    def restart_hosts(cls, hosts: List[str], restart_command: Optional[str] = None) -> None:
+        """
+        Restart redis instances on servers concurrently with shell command or wait operator confirmation
+
+        :param hosts: list of servers
+        :param restart_command: shell command with {host} placeholder like 'ssh {host} systemctl restart redis-cluster'
+        :return: None
+        """
+        if not restart_command:
+            print(f"Restart redis instances on {', '.join(hosts)} and press Enter")
+            input()
+            return
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            for host, result in zip(hosts, executor.map(lambda host: subprocess.run(cls.format_restart_command(restart_command, host),
+                                                                                     shell=True), hosts)):
+                if result.returncode != 0:
+                    raise Exception(f"Restart command for {host} exited with code {result.returncode}")
+
+    def cluster_rolling_restart(self, restart_command: Optional[str] = None, replicas: int = REPLICAS, concurrency: int = 4,
+                                timeout: float = 90, sync_timeout: float = 3600, gate: HealthGate = None) -> None:
+        """
+        Restart all servers by waves: drain, restart, wait full resync, restore masters
 
-    def cluster_plan_execute(self, plans: list = None, timeout: int = 90) -> bool:
+        :param restart_command: shell command with {host} placeholder, operator confirmation if None
+        :param replicas: desired number of replicas
+        :param concurrency: maximum number of concurrent failovers
+        :param timeout: maximum seconds to wait every failover
+        :param sync_timeout: maximum seconds to wait full resync of restarted instances
+        :param gate: HealthGate object, every wave waits healthy cluster if defined
+        :return: None
+        """
+        def invariants_broken() -> bool:
+            return bool(self.check_masterslave_in_group(replicas=replicas) or self.check_slavesofmaster_in_group(replicas=replicas))
+
+        if invariants_broken():
+            raise Exception('Cluster has master and slaves or slaves of one master in the same group, fix it before rolling restart')
+        waves = self.plan_rolling_waves()
+        for number, wave in enumerate(waves, start=1):
+            print(f"Wave {number}/{len(waves)}: {', '.join(wave)}")
+            if gate:
+                self.wait_health(gate=gate)
+
+            snapshot = deepcopy(self.currentnodes)
+            self.plans = list()
+            planned_nodes = deepcopy(snapshot)
+            for host in wave:
+                planned_nodes = self.plan_drain(host=host, nodes=planned_nodes)
+            if self.cluster_failovers_execute(concurrency=concurrency, timeout=timeout, gate=gate):
+                raise Exception(f"Drain of {', '.join(wave)} failed")
+
+            self.restart_hosts(hosts=wave, restart_command=restart_command)
+            wave_nodes = list(filter(lambda node: node['host'] in wave, snapshot))
+            with ThreadPoolExecutor(max_workers=min(32, max(1, len(wave_nodes)))) as executor:
+                synced = list(executor.map(lambda node: self.wait_node_synced(ip=node['host'], port=node['port'], timeout=sync_timeout),
+                                           wave_nodes))
+            if not all(synced):
+                raise Exception(f"Instances of {', '.join(wave)} didn't finish sync in {sync_timeout}s")
+            if gate:
+                self.wait_health(gate=gate)
+
+            self.currentnodes = self.get_current_nodes()
+            self.plans = list()
+            planned_nodes = deepcopy(self.currentnodes)
+            for host in wave:
+                planned_nodes = self.plan_restore(snapshot=snapshot, host=host, nodes=planned_nodes)
+            if self.cluster_failovers_execute(concurrency=concurrency, timeout=timeout, wait_sync=True, gate=gate):
+                raise Exception(f"Restore of {', '.join(wave)} failed")
+            if invariants_broken():
+                raise Exception(f"Masters and slaves distribution is broken after wave {number}")
+
+    def cluster_plan_execute(self, plans: list = None, timeout: int = 90, gate: HealthGate = None) -> bool:
         """
         Execute plan with timeout
 
         :param plans: list of plan dicts like {}
         {'func': func, 'args': [], 'kwargs': {'kwarg1': value1, 'kwarg1': 'value2', 'msg': 'human like description'}}
         :param timeout: timeout between operations
+        :param gate: HealthGate object, every step waits healthy cluster if defined
         :return: bool
         """
         if plans is None:
             plans = self.plans
 
+        if self.slots_check:
+            self.verify_slots(stage='before execution')
         for plan in plans:
+            if gate:
+                self.wait_health(gate=gate, plan=plan)
             print(plan['msg'])
-            plan['func'](*plan['args'], **plan['kwargs'])
-            sleep(timeout)
+            probe = self.start_write_probe(plan)
+            try:
+                plan['func'](*plan['args'], **plan['kwargs'])
+                sleep(timeout)
+            finally:
+                self.stop_write_probe(probe, plan)
+            # state after step is state before the next one
+            if self.slots_check:
+                self.verify_slots(stage=f"after step '{plan['msg']}'")
         self.currentnodes = self.get_current_nodes()
+        self.record_history()
         return True
 
     def find_candidate_for_failover(self, masternodeid: str, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> Optional[str]:
@@ -1004,15 +3617,16 @@ class RedisClusterTool:
 
         # find group with the lowest number of masters
         top_masters_groups: Counter = Counter(
-            {group: len(self.get_masters(nodes=nodelist)) for group, nodelist in nodesgroup.items()})
+            {group: self.get_masters_weight(nodes=nodelist) for group, nodelist in nodesgroup.items()})
         del top_masters_groups[self.get_node_group(nodes=nodes, nodeid=masternodeid)]
         if top_masters_groups:
             # iterate over reversed top (from min master count to max mastercount per group)
             for group, _ in top_masters_groups.most_common()[::-1]:
-                # check that group has connected to master slave
-                connectedslave = self.get_slaves(nodes=nodesgroup[group], masternodeid=masternodeid, maxport=maxport)
+                # check that group has connected to master slave that can take over without data loss
+                connectedslave = list(filter(self.is_failover_slave_healthy,
+                                             self.get_slaves(nodes=nodesgroup[group], masternodeid=masternodeid, maxport=maxport)))
                 if connectedslave:
-                    return connectedslave.pop()['node_id']
+                    return self.choose_failover_slave(slaves=connectedslave)['node_id']
             return None
         else:
             return None
@@ -1032,11 +3646,16 @@ class RedisClusterTool:
         masters_group_skew: Dict = self.check_group_master_distribution(nodes=nodes, maxport=maxport, skew=-1)
         masters_group_skew_delta = round(max(masters_group_skew.values()) - min(masters_group_skew.values()), 2)
         groupnodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
+        groups_capacity = self.get_groups_capacity(nodes_groups=groupnodes)
+        # real share of masters is printed, skew is calculated from percents normalized by capacity
+        distribution = self.get_master_distribution(nodes=nodes, maxport=maxport)
         for group, groups_master_percent in masters_group_skew.items():
-            print(f'{" " * indent}Server {group} (has {masters_group_skew[group]}% masters): '
+            capacity_desc = f' capacity {groups_capacity[group]:g}' if len(set(groups_capacity.values())) > 1 else ''
+            print(f'{" " * indent}Server {group}{capacity_desc} (has {self.get_share_desc(distribution.groups, group)}): '
                   f'(masters: {len(self.get_masters(nodes=groupnodes[group], maxport=maxport))!s:3} '
                   f'slaves: {len(self.get_slaves(nodes=groupnodes[group], maxport=maxport))!s:3})')
-        print(f'{" " * (indent - 4)}Skew is {masters_group_skew_delta}%\n')
+        normalized_desc = ' (normalized by capacity)' if distribution.groups.factors else ''
+        print(f'{" " * (indent - 4)}Skew{self.get_balance_desc()}{normalized_desc} is {masters_group_skew_delta}%\n')
 
     def get_current_replicas_count(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> int:
         """
@@ -1119,18 +3738,29 @@ class RedisClusterTool:
         master_node_slaves_groups = list(
             set(map(lambda node: self.get_node_group(nodes=nodes, maxport=maxport, node=node), master_node_slaves)))
 
-        # try to return slave with problems
+        masternode = self.get_node(nodes=nodes, nodeid=masternodeid)
+        domains = self.get_failure_domains(nodes=nodes, maxport=maxport)
+        headroom = self.get_hosts_headroom(nodes=nodes)
+
+        def cost(node: Dict[str, Any]) -> Tuple[int, Tuple[bool, float, int]]:
+            return (domains.conflicts(nodeid=node['node_id'], masternodeid=masternodeid, levels=self.FAILURE_DOMAIN_CHECK_LEVELS),
+                    self.get_sync_cost(slavenode=node, masternode=masternode, nodes=nodes, headroom=headroom))
+
+        # try to return slave with problems without shared region or rack with shard and the cheapest for full sync
         problem_slaves = self.check_slavesofmaster_in_group(nodes=nodes, replicas=replicas, maxport=maxport)
         if master_group in problem_slaves.keys():
             del problem_slaves[master_group]
+        candidates: List[Dict[str, Any]] = []
         for group, problems in problem_slaves.items():
             for problem in problems:
                 for slave_node in problem['slaves']:
                     slave_node_group = self.get_node_group(nodes=nodes, maxport=maxport, node=slave_node)
                     if slave_node_group not in master_node_slaves_groups:
-                        return slave_node['node_id']
+                        candidates.append(slave_node)
+        if candidates:
+            return min(candidates, key=cost)['node_id']
 
-        # or return slave of master with the highest number of slaves
+        # or return the cheapest slave of master with the highest number of slaves
         nodesgroup = self.get_nodes_groups(nodes=nodes, maxport=maxport)
 
         # remove masternode group from nodesgroup
@@ -1146,7 +3776,9 @@ class RedisClusterTool:
                 if slave_node_group in master_node_slaves_groups:
                     continue
                 if self.get_node(nodes=self.mergevalueslists(nodesgroup), nodeid=slave_node['node_id']):
-                    return slave_node['node_id']
+                    candidates.append(slave_node)
+            if candidates:
+                return min(candidates, key=cost)['node_id']
 
     def find_candidate_for_slave_to_replicate(self, slavenodeid: str, nodes: List[Dict[str, Any]] = None,
                                               excludegroup: Union[str, list, None] = None,
@@ -1181,71 +3813,231 @@ class RedisClusterTool:
                     if group in nodesgroup.keys():
                         del nodesgroup[group]
 
-        groupreducednodelist = self.mergevalueslists(nodesgroup)
+        groupreducednodeids = set(map(lambda node: node['node_id'], self.mergevalueslists(nodesgroup)))
 
+        slavenode = self.get_node(nodes=nodes, nodeid=slavenodeid)
+        domains = self.get_failure_domains(nodes=nodes, maxport=maxport)
+        headroom = self.get_hosts_headroom(nodes=nodes)
         # find global slave counts for masters
         masterslavecounter = self.get_slaves_counter_of_masters(nodes=nodes)
+        candidates: List[Tuple[int, int, Tuple[bool, float, int], str]] = []
         # iterate from the lowest slave count
         for masternodeid, count in masterslavecounter.most_common()[::-1]:
             # try to find candidate from reduced nodes list
-            if masternodeid in list(map(lambda node: node['node_id'], groupreducednodelist)):
+            if masternodeid in groupreducednodeids:
                 # don't offer for candidate to replicate current master
-                if masternodeid != self.get_node(nodes=nodes, nodeid=slavenodeid)['master_id']:
+                if masternodeid != slavenode['master_id']:
                     slave_nodes_of_master_nodeid = self.get_slaves(nodes=nodes, masternodeid=masternodeid)
                     # best choice, masternode doesn't have any slaves in slave's node groups
-                    if slavenode_group not in self.get_nodes_groups(nodes=slave_nodes_of_master_nodeid).keys():
-                        return masternodeid
-                    elif len(list(filter(lambda group: group != slavenode_group, self.get_nodes_groups(
-                            nodes=slave_nodes_of_master_nodeid).keys()))) >= replicas:
-                        return masternodeid
+                    if slavenode_group not in self.get_nodes_groups(nodes=slave_nodes_of_master_nodeid).keys() or \
+                            len(list(filter(lambda group: group != slavenode_group, self.get_nodes_groups(
+                                nodes=slave_nodes_of_master_nodeid).keys()))) >= replicas:
+                        candidates.append((count, domains.conflicts(nodeid=slavenodeid, masternodeid=masternodeid,
+                                                                    levels=self.FAILURE_DOMAIN_CHECK_LEVELS),
+                                           self.get_sync_cost(slavenode=slavenode, masternode=self.get_node(nodes=nodes, nodeid=masternodeid),
+                                                              nodes=nodes, headroom=headroom), masternodeid))
             # master should not have slaves in the same dc
+        if candidates:
+            # the lowest slave count first, then without shared region or rack, then the cheapest full sync, then original order
+            return min(candidates, key=lambda candidate: candidate[:3])[3]
         return None
 
-    def cluster_rebalance_iterate(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> Optional[List[Dict[str, Any]]]:
+    def cluster_rebalance_iterate(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT,
+                                  skew: int = 0) -> Optional[List[Dict[str, Any]]]:
         """
         Return new skew and new nodes plan or None if rebalance stuck in cycle
 
         :rtype: Optional[List[Dict[str, Any]]]
         :param nodes: nodes list
         :param maxport: reduce ports to maximum value
+        :param skew: max-min masters percentage difference that doesn't need failover, 0 for any improvement
         :return: new nodes plan or None if rebalance stuck in cycle
         """
         if nodes is None:
             nodes = deepcopy(self.currentnodes)
 
-        master_nodes_counter: Dict[str, int] = cluster.check_group_master_distribution(nodes=nodes, maxport=maxport,
-                                                                                       skew=0)
-        current_skew: int = max(master_nodes_counter.values()) - min(
-            master_nodes_counter.values()) if master_nodes_counter else 0
+        # current skews are rounded by the same counters as candidates scores, so equal skews don't pass as improvement
+        distribution = self.get_master_distribution(nodes=nodes, maxport=maxport)
+        current_skew: Tuple[float, float] = (distribution.groups.skew(), distribution.groups.skew(positive=True))
 
         cluster_group_master_distribution_problem = self.check_group_master_distribution(nodes=nodes,
                                                                                          maxport=maxport,
-                                                                                         skew=0)
-        nodesgroup = self.get_nodes_groups(nodes=nodes)
+                                                                                         skew=skew)
+        nodesgroup = self.get_nodes_groups(nodes=nodes, maxport=maxport)
         if cluster_group_master_distribution_problem:
+            candidates: List[str] = []
             for group, _ in Counter(cluster_group_master_distribution_problem).most_common():
                 for masternode in self.get_masters(nodes=nodesgroup[group]):
                     slavenodeid = self.find_candidate_for_failover(nodes=nodes, maxport=maxport,
                                                                    masternodeid=masternode['node_id'])
-                    if slavenodeid:
-                        slavenode = self.get_node(nodes=nodes, nodeid=slavenodeid)
-                        slavenodeid_already_in_plan = list(filter(lambda x: 'CLUSTER FAILOVER' in x['kwargs']['command']
-                                                                            and x['kwargs']['port'] == slavenode['port']
-                                                                            and x['kwargs']['ip'] == slavenode['host'],
-                                                                  self.plans))
-                        new_nodes_plan: list = self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid,
-                                                                              dryrun=True, deep_copy=True)
-                        new_master_nodes_counter: Dict[str, int] = cluster.check_group_master_distribution(
-                            nodes=new_nodes_plan,
-                            maxport=maxport,
-                            skew=0)
-                        new_master_nodes_counter_positive: Counter = +Counter(new_master_nodes_counter)
-                        new_skew_positive: int = max(new_master_nodes_counter.values()) - min(
-                            new_master_nodes_counter_positive.values()) if new_master_nodes_counter_positive else 0
-                        if not slavenodeid_already_in_plan and new_skew_positive < current_skew:
-                            return self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid, deep_copy=True)
+                    if slavenodeid and not self.failover_already_in_plan(nodes=nodes, slavenodeid=slavenodeid):
+                        candidates.append(slavenodeid)
+            # candidates are scored in original order, so the first good one wins like in sequential mode
+            for slavenodeid, new_skew in zip(candidates, self.score_failover_candidates(candidates=candidates, nodes=nodes,
+                                                                                        maxport=maxport)):
+                # skew of all groups decreases, or stays and skew of groups with masters decreases
+                if new_skew < current_skew:
+                    return self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid, deep_copy=True)
         return None
 
+    def failover_already_in_plan(self, slavenodeid: str, nodes: List[Dict[str, Any]] = None) -> bool:
+        """
+        Return True if failover of slavenodeid already planned
+
+        :param slavenodeid: id of slave node
+        :param nodes: nodes list
+        :return: True if plans has CLUSTER FAILOVER for slave node address
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        slavenode = self.get_node(nodes=nodes, nodeid=slavenodeid)
+        return any(map(lambda x: 'CLUSTER FAILOVER' in x['kwargs']['command']
+                                 and x['kwargs']['port'] == slavenode['port']
+                                 and x['kwargs']['ip'] == slavenode['host'],
+                       self.plans))
+
+    def get_master_distribution(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> MasterDistribution:
+        """
+        Return master counters per group and per host in group for delta scoring
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :return: MasterDistribution object
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        nodes_groups = self.get_nodes_groups(nodes=nodes, maxport=maxport)
+        return MasterDistribution(nodes_groups, weight=self.get_node_weight, groups_capacity=self.get_groups_capacity(nodes_groups=nodes_groups),
+                                  hosts_capacity=self.get_hosts_capacity(nodes=nodes))
+
+    @staticmethod
+    def score_failover_candidate(slavenodeid: str, distribution: MasterDistribution,
+                                 check: str = 'group') -> Union[Tuple[float, float], Dict[str, float]]:
+        """
+        Return skew after failover of slavenodeid derived from master counters, without new nodes list
+
+        :param slavenodeid: id of slave node
+        :param distribution: master counters of current nodes
+        :param check: 'group' for skews between groups or 'in_group' for skews between servers in every group
+        :return: new skews between all groups and groups with masters or dict like {group: skew} for groups with skew for in_group check
+        """
+        if check == 'in_group':
+            new_group_skews = dict()
+            for group, hosts_counter in distribution.hosts.items():
+                if len(hosts_counter) > 1:
+                    new_group_skew = distribution.failover_in_group_skew(group=group, slavenodeid=slavenodeid)
+                    if new_group_skew > 0:
+                        new_group_skews[group] = new_group_skew
+            return new_group_skews
+        return distribution.failover_skew(slavenodeid=slavenodeid, positive=False), distribution.failover_skew(slavenodeid=slavenodeid)
+
+    def score_failover_candidates(self, candidates: List[str], nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT,
+                                  check: str = 'group') -> Iterable[Union[Tuple[float, float], Dict[str, float]]]:
+        """
+        Return scores of failover candidates in candidates order, master counters are built once for all candidates
+
+        :param candidates: list of slave nodeids
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param check: 'group' or 'in_group', see score_failover_candidate
+        :return: lazy iterable with scores, candidates after the chosen one are not scored
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        distribution = self.get_master_distribution(nodes=nodes, maxport=maxport)
+        return map(lambda slavenodeid: self.score_failover_candidate(slavenodeid=slavenodeid, distribution=distribution,
+                                                                     check=check), candidates)
+
+    @staticmethod
+    def pack_nodes(nodes: List[Dict[str, Any]]) -> List[NodeRecord]:
+        """
+        Return nodes list of compact records, records are kept as is
+
+        :param nodes: nodes list of dicts like --save-nodes json
+        :return: nodes list of records
+        """
+        return [node if type(node) is NodeRecord else NodeRecord(node) for node in nodes]
+
+    @staticmethod
+    def unpack_nodes(nodes: List[Union[NodeRecord, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Return nodes list of json serializable dicts for --save-nodes
+
+        :param nodes: nodes list of records or dicts
+        :return: nodes list of dicts
+        """
+        return [node.to_dict() if type(node) is NodeRecord else node for node in nodes]
+
+    def save_snapshot(self, path: str, nodes: List[Dict[str, Any]] = None, info: bool = False) -> None:
+        """
+        Save nodes snapshot: gzip compressed json lines with header (format, version, capture time, fields of nodes),
+        inventory answers and one row of fields values per node, so it can be read node by node
+
+        :param path: snapshot file
+        :param nodes: nodes list
+        :param info: save all INFO fields of nodes, requested concurrently
+        :return: None
+        """
+        if nodes is None:
+            # failover candidates of snapshot are ranked by replication info, replay needs full sync and balance fields
+            self.load_replication_info()
+            self.load_sync_info()
+            nodes = self.currentnodes
+        nodes = self.unpack_nodes(nodes)
+        if info:
+            nodes_info = self.get_nodes_info(nodes=nodes)
+            for node in nodes:
+                node['info'] = dict(node.get('info') or dict(), **nodes_info.get(node['node_id'], dict()))
+        fields = list(OrderedDict.fromkeys(itertools.chain.from_iterable(nodes)))
+        header = {'format': self.SNAPSHOT_FORMAT, 'version': self.SNAPSHOT_VERSION, 'cluster': f'{self.host}:{self.port}',
+                  'created': datetime.datetime.now().isoformat(timespec='seconds'), 'nodes': len(nodes), 'fields': fields}
+        inventory_answers = {ip: answer for ip, answer in self.inventory_answers.items() if ip in self.get_server_ips(nodes=nodes)}
+        with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            f.write(json.dumps(header) + '\n')
+            f.write(json.dumps({'inventory': inventory_answers}) + '\n')
+            for node in nodes:
+                row = list(map(lambda field: node.get(field), fields))
+                if isinstance(node['flags'], (list, tuple)):
+                    row[fields.index('flags')] = ','.join(node['flags'])
+                f.write(json.dumps(row, separators=(',', ':')) + '\n')
+
+    @classmethod
+    def read_snapshot(cls, path: str) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]], Iterator[NodeRecord]]:
+        """
+        Read nodes snapshot of save_snapshot or plain json nodes list of old --save-nodes files
+
+        :param path: snapshot file
+        :return: header, inventory answers like {ip: {ip: ip, dc: dc, fqdn: fqdn}} and iterator of node records that reads rows lazily
+        """
+        with open(path, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        if not compressed:
+            with open(path, 'r') as f:
+                return {'format': cls.SNAPSHOT_FORMAT, 'version': 0}, dict(), iter(cls.pack_nodes(json.load(f)))
+        f = gzip.open(path, 'rt', encoding='utf-8')
+        header = json.loads(f.readline())
+        if header.get('format') != cls.SNAPSHOT_FORMAT or header.get('version', 0) > cls.SNAPSHOT_VERSION:
+            f.close()
+            raise Exception(f"Unsupported snapshot {path}: format {header.get('format')} version {header.get('version')}")
+        inventory_answers = json.loads(f.readline())['inventory']
+
+        def records() -> Iterator[NodeRecord]:
+            with f:
+                for line in f:
+                    yield NodeRecord({field: value for field, value in zip(header['fields'], json.loads(line)) if value is not None})
+
+        return header, inventory_answers, records()
+
+    @classmethod
+    def load_snapshot(cls, path: str) -> List[NodeRecord]:
+        """
+        Return nodes list of snapshot or plain json nodes file
+
+        :param path: snapshot file
+        :return: nodes list of records
+        """
+        return list(cls.read_snapshot(path)[2])
+
     def cluster_resolve_master_problem(self, problems: List[str], nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT,
                                        replicas: int = REPLICAS) -> Optional[List[Dict[str, Any]]]:
         if nodes is None:
@@ -1262,39 +4054,329 @@ class RedisClusterTool:
     def cluster_resolve_slave_problem(self, problems: Dict[str, List[Dict[str, Union[str, List[Dict[str, Any]]]]]],
                                       nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, replicas: int = REPLICAS) -> Optional[List[Dict[str, Any]]]:
         """
-        Return a non-empty dict (new nodes list) if resolved or None
+        Return a non-empty dict (new nodes list) if resolved or None
+
+        :rtype: Optional[List[Dict[str, Any]]]
+        :param problems: dict list {'group_with_slaves': [ {'master': masternode, 'slaves': [slavenode1, slavenode2...] } ] }
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param replicas: desired number of replicas
+        :return: dict with future nodes list if resolve of problem found or None if you don't have problems
+        """
+        if nodes is None:
+            nodes = deepcopy(self.currentnodes)
+        nodes = deepcopy(nodes)
+
+        for n in itertools.count(start=1, step=1):
+            if n > 1000:
+                for plan in self.plans:
+                    print(plan['msg'])
+                raise Exception("Can't find candidate for replicate, may be you don't have master in other nodes group")
+            for group, group_problems in problems.items():
+                for problem in group_problems:
+                    for slavenode in problem['slaves']:
+                        master_nodeid_for_replicate_of_candidate: str = self.find_candidate_for_slave_to_replicate(
+                            nodes=nodes, excludegroup=group, slavenodeid=slavenode['node_id'], maxport=maxport,
+                            replicas=replicas)
+                        if master_nodeid_for_replicate_of_candidate:
+                            return self.plan_clusternode_replicate(nodes=nodes, slavenodeid=slavenode['node_id'],
+                                                                   masternodeid=master_nodeid_for_replicate_of_candidate, deep_copy=True)
+            if problems:
+                rebalance_iteration = self.cluster_rebalance_iterate(nodes=nodes, maxport=maxport)
+                if rebalance_iteration:
+                    nodes = rebalance_iteration
+            else:
+                return None
+
+    def get_problems(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT,
+                     replicas: int = REPLICAS) -> Dict[str, Any]:
+        """
+        Return results of all critical check_* methods
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param replicas: desired number of replicas
+        :return: dict like {'masterslave_in_group': {...}, 'slavesofmaster_in_group': {...}, 'desired_replica_count': {...}, 'without_slaves': [...],
+         'failure_domains': {...}}
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        return {'masterslave_in_group': self.check_masterslave_in_group(nodes=nodes, maxport=maxport, replicas=replicas),
+                'slavesofmaster_in_group': self.check_slavesofmaster_in_group(nodes=nodes, maxport=maxport, replicas=replicas),
+                'desired_replica_count': self.check_master_does_not_have_desired_replica_count(nodes=nodes, maxport=maxport, replicas=replicas),
+                'without_slaves': self.check_master_does_not_have_slaves(nodes=nodes, maxport=maxport),
+                'failure_domains': self.check_failure_domains(nodes=nodes, maxport=maxport)}
+
+    @staticmethod
+    def count_problems(problems: Dict[str, Any]) -> Counter:
+        """
+        Return violations count of every check from get_problems result
+
+        :param problems: result of get_problems
+        :return: Counter like {'masterslave_in_group': 2, 'without_slaves': 1}
+        """
+        problems_counter: Counter = Counter()
+        for check, result in problems.items():
+            if isinstance(result, dict) and result and all(map(lambda value: isinstance(value, list), result.values())):
+                problems_counter[check] = sum(map(len, result.values()))
+            else:
+                problems_counter[check] = len(result)
+        return problems_counter
+
+    def get_skews(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, skew: int = SKEW) -> Dict[str, float]:
+        """
+        Return master distribution skews over allowed skew
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param skew: max-min percentage difference
+        :return: dict like {'group': 10.0}
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        masters_group_skew: Dict = self.check_group_master_distribution(nodes=nodes, maxport=maxport, skew=-1)
+        masters_group_skew_delta = max(masters_group_skew.values()) - min(masters_group_skew.values()) if masters_group_skew else 0
+        return {'group': max(0, round(masters_group_skew_delta - skew, 2))}
+
+    def get_failover_skews(self, distribution: MasterDistribution, slavenodeid: str = None, skew: int = SKEW) -> Dict[str, int]:
+        """
+        Return masters count to move for master distribution skews within allowed skew from master counters, optionally after failover
+
+        :param distribution: master counters of nodes
+        :param slavenodeid: id of slave node for failover, current skews if not defined
+        :param skew: max-min percentage difference
+        :return: dict like {'group': 2}
+        """
+        return {'group': distribution.failover_excess(slavenodeid=slavenodeid, skew=skew) if slavenodeid
+                else distribution.groups.excess(skew, unit=distribution.unit())}
+
+    def get_shard_problems(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, replicas: int = REPLICAS) -> ShardProblems:
+        """
+        Return problems of every shard for delta scoring of search planner moves
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param replicas: desired number of replicas
+        :return: ShardProblems object
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        nodes_group: Dict[str, str] = {node['node_id']: group for group, groupnodes in self.get_nodes_groups(nodes=nodes, maxport=maxport).items()
+                                       for node in groupnodes}
+        return ShardProblems(nodes, nodes_group, replicas=replicas,
+                             spread=self.check_distribution_possibility(nodes=nodes, replicas=replicas, maxport=maxport),
+                             domains=self.get_failure_domains(nodes=nodes, maxport=maxport), levels=self.FAILURE_DOMAIN_CHECK_LEVELS)
+
+    def get_metrics(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, replicas: int = None) -> Dict[str, Any]:
+        """
+        Return distribution metrics of nodes for batch analytics
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param replicas: desired number of replicas, current replicas count if None
+        :return: dict with METRICS_FIELDS of nodes like {'masters': 10, 'skew': 20.0, 'replica_deficit': 2, 'misplaced': 1, ...}
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        if replicas is None:
+            replicas = self.get_current_replicas_count(nodes=nodes, maxport=maxport)
+        masters_group_percent: Dict = self.check_group_master_distribution(nodes=nodes, maxport=maxport, skew=-1)
+        problems = self.count_problems(self.get_problems(nodes=nodes, maxport=maxport, replicas=replicas))
+        replicas_count = self.check_master_does_not_have_desired_replica_count(nodes=nodes, replicas=replicas, maxport=maxport)
+        return {'nodes': len(self.nodes_reduced_max_port(nodes=nodes, maxport=maxport)),
+                'masters': len(self.get_masters(nodes=nodes, maxport=maxport)),
+                'slaves': len(self.get_slaves(nodes=nodes, maxport=maxport)), 'replicas': replicas,
+                'skew': round(max(masters_group_percent.values()) - min(masters_group_percent.values()), 2) if masters_group_percent else 0,
+                'replica_deficit': sum(map(lambda count: replicas - count, replicas_count.values())),
+                'without_slaves': problems['without_slaves'],
+                'misplaced': problems['masterslave_in_group'] + problems['slavesofmaster_in_group'],
+                'failure_domains': problems['failure_domains'], 'failed_nodes': len(self.check_failed_nodes(nodes=nodes)),
+                'slots_problems': len(self.check_slots(nodes=nodes))}
+
+    def get_search_moves(self, shards: ShardProblems, distribution: MasterDistribution, headroom: Dict[str, Optional[int]] = None,
+                         sync_costs: Dict[Tuple[str, str], Tuple[bool, float, int]] = None,
+                         branching: int = 32) -> List[Tuple[str, ...]]:
+        """
+        Return candidate steps for search planner ordered from the most promising, replicate candidates are chosen
+        like find_candidate_for_slave_to_replicate and find_slave_candidate_for_master_to_replicate from shard problems
+        and master counters of state without recheck of nodes
+
+        :param shards: problems of every shard of nodes
+        :param distribution: master counters of nodes
+        :param headroom: result of get_hosts_headroom for nodes
+        :param sync_costs: cache of get_sync_cost results like {(slavenodeid, masternodeid): cost} shared by states of one search
+        :param branching: maximum number of failover steps
+        :return: list like [('CLUSTER FAILOVER', slavenodeid), ('CLUSTER REPLICATE', slavenodeid, masternodeid)]
+        """
+        if sync_costs is None:
+            sync_costs = dict()
+        node_group: Dict[str, str] = shards.node_group
+        masters: List[str] = [nodeid for nodeid in shards.order if nodeid in shards.masters and nodeid in node_group]
+        slaves_groups: Dict[str, Counter] = {masternodeid: Counter(map(lambda nodeid: node_group[nodeid], shards.slaves.get(masternodeid, [])))
+                                             for masternodeid in shards.slaves}
+
+        def sync_cost(slavenodeid: str, masternodeid: str) -> Tuple[bool, float, int]:
+            if (slavenodeid, masternodeid) not in sync_costs:
+                sync_costs[(slavenodeid, masternodeid)] = self.get_sync_cost(slavenode=distribution.nodes[slavenodeid],
+                                                                             masternode=distribution.nodes[masternodeid], headroom=headroom)
+            return sync_costs[(slavenodeid, masternodeid)]
+
+        def cheapest(candidates: List[Tuple[int, str, str]]) -> Tuple[str, ...]:
+            # full sync cost is computed only for candidates with the least failure domain conflicts
+            best = min(map(lambda candidate: candidate[0], candidates))
+            return ('CLUSTER REPLICATE', *min(filter(lambda candidate: candidate[0] == best, candidates),
+                                              key=lambda candidate: sync_cost(*candidate[1:]))[1:])
+
+        # failover moves ranked by master count difference between old and new master group and host
+        failover_moves: List[Tuple[int, int, Tuple[str, ...]]] = []
+        for masternodeid in masters:
+            master_group, weight = node_group[masternodeid], distribution.weights[masternodeid]
+            master_host = distribution.nodes[masternodeid]['host']
+            for slavenodeid in shards.slaves.get(masternodeid, []):
+                slave_group, slave_host = node_group[slavenodeid], distribution.nodes[slavenodeid]['host']
+                group_gain = distribution.groups[master_group] - distribution.groups[slave_group]
+                host_gain = distribution.hosts[master_group][master_host] - distribution.hosts[slave_group][slave_host]
+                if group_gain > weight or (group_gain >= 0 and host_gain > weight):
+                    failover_moves.append((-group_gain, -host_gain, ('CLUSTER FAILOVER', slavenodeid)))
+        moves: List[Tuple[str, ...]] = list(map(lambda move: move[2], sorted(failover_moves)[:branching]))
+
+        # replicate moves of slaves in group of own master or with other slave of master to master with the least slaves count
+        # and without slaves in their group
+        group_masters: Dict[str, List[str]] = dict()
+        problem_slaves: List[str] = []
+        for masternodeid, problems in shards.counters.items():
+            if not problems['masterslave_in_group'] and not problems['slavesofmaster_in_group']:
+                continue
+            master_group = node_group.get(masternodeid)
+            for slavenodeid in shards.slaves[masternodeid]:
+                slave_group = node_group[slavenodeid]
+                if problems['slavesofmaster_in_group'] and slaves_groups[masternodeid][slave_group] > 1 and slave_group != master_group:
+                    problem_slaves.append(slavenodeid)
+                elif not problems['masterslave_in_group'] or slave_group != master_group:
+                    continue
+                if slave_group not in group_masters:
+                    group_masters[slave_group] = sorted(
+                        filter(lambda nodeid: node_group[nodeid] != slave_group and (slave_group not in slaves_groups[nodeid] or
+                                                                                   len(slaves_groups[nodeid]) - 1 >= shards.replicas), masters),
+                        key=lambda nodeid: len(shards.slaves[nodeid]))
+                candidates = list(filter(lambda nodeid: nodeid != masternodeid, group_masters[slave_group]))
+                if candidates:
+                    least = len(shards.slaves[candidates[0]])
+                    moves.append(cheapest([(shards.conflicts(slavenodeid, nodeid), slavenodeid, nodeid) for nodeid in
+                                           itertools.takewhile(lambda nodeid: len(shards.slaves[nodeid]) == least, candidates)]))
+
+        # replicate moves to masters without desired replicas count from problem slaves or from master with the most slaves
+        masters_by_slaves = sorted(masters, key=lambda nodeid: len(shards.slaves[nodeid]), reverse=True)
+        for masternodeid, problems in shards.counters.items():
+            if not problems['desired_replica_count'] or masternodeid not in node_group:
+                continue
+            excludegroups = set(slaves_groups[masternodeid]) | {node_group[masternodeid]}
+            candidates = [(shards.conflicts(slavenodeid, masternodeid), slavenodeid, masternodeid) for slavenodeid in problem_slaves
+                          if node_group[slavenodeid] not in excludegroups]
+            for donornodeid in masters_by_slaves:
+                if candidates:
+                    break
+                candidates = [(shards.conflicts(slavenodeid, masternodeid), slavenodeid, masternodeid)
+                              for slavenodeid in shards.slaves[donornodeid] if node_group[slavenodeid] not in excludegroups]
+            if candidates:
+                moves.append(cheapest(candidates))
+        return list(OrderedDict.fromkeys(moves))
+
+    def plan_search(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, replicas: int = REPLICAS,
+                    beam_width: int = 8, time_budget: float = 60, max_steps: int = None, cost: PlanCost = None,
+                    **skew_params: int) -> List[Dict[str, Any]]:
+        """
+        Search the shortest failover/replicate sequence with beam search ordered like A* (cost + heuristic)
+        and append the best found plan to plans
 
-        :rtype: Optional[List[Dict[str, Any]]]
-        :param problems: dict list {'group_with_slaves': [ {'master': masternode, 'slaves': [slavenode1, slavenode2...] } ] }
         :param nodes: nodes list
         :param maxport: reduce ports to maximum value
         :param replicas: desired number of replicas
-        :return: dict with future nodes list if resolve of problem found or None if you don't have problems
+        :param beam_width: number of states kept on each search depth
+        :param time_budget: time limit for search in seconds, the best plan found is returned after it
+        :param max_steps: maximum plan length, nodes count if not defined
+        :param cost: PlanCost object with step and residual costs
+        :param skew_params: skew (and groupskew for datacenter) for get_skews
+        :return: planned nodes
         """
         if nodes is None:
             nodes = deepcopy(self.currentnodes)
-        nodes = deepcopy(nodes)
+        if cost is None:
+            cost = PlanCost()
+        if max_steps is None:
+            max_steps = len(nodes)
+        deadline = monotonic() + time_budget
+        # replicates and failovers don't change memory of servers, so full sync costs are the same in all states
+        headroom = self.get_hosts_headroom(nodes=nodes)
+        sync_costs: Dict[Tuple[str, str], Tuple[bool, float, int]] = dict()
+
+        def evaluate(state: List[Dict[str, Any]]) -> Tuple[ShardProblems, MasterDistribution]:
+            return self.get_shard_problems(nodes=state, maxport=maxport, replicas=replicas), \
+                self.get_master_distribution(nodes=state, maxport=maxport)
+
+        shards, distribution = evaluate(nodes)
+        # plan must not add problems of any check, replica deficits opened by steps are allowed inside plan, so replicas are swapped
+        initial_problems: Counter = shards.total
+        heuristic = cost.residual(initial_problems, self.get_failover_skews(distribution=distribution, **skew_params))
+        # state is (f, g, steps, nodes, shards, distribution)
+        best: Tuple[float, float, List[Tuple[str, ...]]] = (heuristic, 0, [])
+        frontier = [(heuristic, 0, [], nodes, shards, distribution)]
+        seen = {shards.fingerprint()}
+        timed_out = False
+        for _ in range(max_steps):
+            # children are scored from counters of parent state, nodes list is copied only for states kept in beam
+            children = []
+            for _, g, steps, state, state_shards, state_distribution in frontier:
+                state_skews = None
+                state_transient = cost.transient(state_shards.total, initial_problems)
+                for move in self.get_search_moves(shards=state_shards, distribution=state_distribution, headroom=headroom,
+                                                  sync_costs=sync_costs, branching=beam_width * 4):
+                    if monotonic() > deadline:
+                        timed_out = True
+                        break
+                    if move[0] == 'CLUSTER FAILOVER':
+                        child_problems, child_fingerprint = state_shards.failover(slavenodeid=move[1])
+                        child_skews = self.get_failover_skews(distribution=state_distribution, slavenodeid=move[1], **skew_params)
+                    else:
+                        child_problems, child_fingerprint = state_shards.replicate(slavenodeid=move[1], masternodeid=move[2])
+                        if state_skews is None:
+                            state_skews = self.get_failover_skews(distribution=state_distribution, **skew_params)
+                        child_skews = state_skews
+                    # deficit opened by plan must be closed before the next one, so states with swaps in progress
+                    # are completed and become plans
+                    if child_fingerprint in seen or (state_transient and cost.transient(child_problems, initial_problems) > state_transient):
+                        continue
+                    seen.add(child_fingerprint)
+                    child_g = g + cost.step(move)
+                    child_f = child_g + cost.residual(child_problems, child_skews, initial=initial_problems)
+                    children.append((child_f, child_g, steps + [move], state, move))
+                    if (child_f, child_g) < best[:2] and all(map(lambda check: child_problems[check] <= initial_problems[check],
+                                                                 child_problems)):
+                        best = (child_f, child_g, steps + [move])
+                if timed_out:
+                    break
+            if timed_out or not children:
+                break
+            frontier = []
+            for child_f, child_g, child_steps, state, move in sorted(children, key=lambda child: child[:3])[:beam_width]:
+                if move[0] == 'CLUSTER FAILOVER':
+                    child = self.plan_clusternode_failover(nodes=state, slavenodeid=move[1], dryrun=True, deep_copy=True)
+                else:
+                    child = self.plan_clusternode_replicate(nodes=state, slavenodeid=move[1], masternodeid=move[2],
+                                                            dryrun=True, deep_copy=True)
+                frontier.append((child_f, child_g, child_steps, child, *evaluate(child)))
+            # costs only grow, no child can be better than the best plan
+            if min(map(lambda state: state[1], frontier)) >= best[0]:
+                break
+        if timed_out:
+            print(f'Search planner reached time budget {time_budget}s, using the best plan found')
 
-        for n in itertools.count(start=1, step=1):
-            if n > 1000:
-                for plan in cluster.plans:
-                    print(plan['msg'])
-                raise Exception("Can't find candidate for replicate, may be you don't have master in other nodes group")
-            for group, group_problems in problems.items():
-                for problem in group_problems:
-                    for slavenode in problem['slaves']:
-                        master_nodeid_for_replicate_of_candidate: str = cluster.find_candidate_for_slave_to_replicate(
-                            nodes=nodes, excludegroup=group, slavenodeid=slavenode['node_id'], maxport=maxport,
-                            replicas=replicas)
-                        if master_nodeid_for_replicate_of_candidate:
-                            return cluster.plan_clusternode_replicate(nodes=nodes, slavenodeid=slavenode['node_id'],
-                                                                      masternodeid=master_nodeid_for_replicate_of_candidate, deep_copy=True)
-            if problems:
-                rebalance_iteration = self.cluster_rebalance_iterate(nodes=nodes, maxport=maxport)
-                if rebalance_iteration:
-                    nodes = rebalance_iteration
+        for step in best[2]:
+            if step[0] == 'CLUSTER FAILOVER':
+                nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=step[1], deep_copy=True)
             else:
-                return None
+                nodes = self.plan_clusternode_replicate(nodes=nodes, slavenodeid=step[1], masternodeid=step[2], deep_copy=True)
+        return nodes
 
 
 class RedisClusterToolDatacenter(RedisClusterTool):
@@ -1303,7 +4385,8 @@ class RedisClusterToolDatacenter(RedisClusterTool):
     GROUPSKEW: ClassVar[int] = 30
     REPLICAS = RedisClusterTool.REPLICAS
 
-    def __init__(self, host: str, port: int, passwd: str, inventory: Inventory, skipconnection: bool = False, onlyconnected: bool = False):
+    def __init__(self, host: str, port: int, passwd: str, inventory: Inventory = None, skipconnection: bool = False,
+                 onlyconnected: bool = False, balance_by: str = 'count'):
         """
         initial func
 
@@ -1312,9 +4395,10 @@ class RedisClusterToolDatacenter(RedisClusterTool):
         :param inventory: class that contain func get_ip_info and return dict like {ip: {dc: dc_name, fqdn: hostname}}
         :param skipconnection: don't connect to redis server
         :param onlyconnected: not use disconnected node
+        :param balance_by: master weight for balancing: count, slots, memory (used_memory) or ops (instantaneous_ops_per_sec)
         """
         self.inventory: Inventory = inventory
-        super().__init__(host, port, passwd, skipconnection, onlyconnected)
+        super().__init__(host, port, passwd, skipconnection, onlyconnected, balance_by)
 
     def get_current_nodes(self, onlyconnected: bool = False) -> List[Dict[str, Any]]:
         """
@@ -1332,7 +4416,9 @@ class RedisClusterToolDatacenter(RedisClusterTool):
             params['master_id'] = params['master_id']
             host, port = host.split(':')
             params['host'], params['port'] = host, int(port)
-            prepared_nodes.append(params)
+            # INFO fields are merged to this dict on first use, planned copies share it
+            params['info'] = dict()
+            prepared_nodes.append(NodeRecord(params))
         if onlyconnected:
             return self.merge_server_datacenter(inventory=self.inventory,
                                                 nodes=sorted(self.filter_only_connected_nodes(
@@ -1349,13 +4435,20 @@ class RedisClusterToolDatacenter(RedisClusterTool):
 
         :rtype: list
         :param inventory: class that contains func get_ip_info that return prepared dict like {ip: ip, dc: dc, fqdn: fqdn}
+         and optional region, rack and capacity weight of host like {region: region1, rack: rack1, capacity: 2}
         :param nodes: nodes list
-        :return: merged nodes list with datacenter and hostname
+        :return: merged nodes list with datacenter, hostname and region, rack, capacity if defined
         """
         inventory_nodes = dict(map(lambda ip: (ip, inventory.get_ip_info(ip)), self.get_server_ips(nodes=nodes)))
+        self.inventory_answers.update(inventory_nodes)
         for index, node in enumerate(nodes):
             nodes[index]["hostname"] = inventory_nodes[node["host"]]["fqdn"]
             nodes[index]["datacenter"] = inventory_nodes[node["host"]]["dc"]
+            for level in ('region', 'rack'):
+                if inventory_nodes[node["host"]].get(level) is not None:
+                    nodes[index][level] = inventory_nodes[node["host"]][level]
+            if inventory_nodes[node["host"]].get("capacity") is not None:
+                nodes[index]["capacity"] = float(inventory_nodes[node["host"]]["capacity"])
         return nodes
 
     def get_nodes_groups(self, nodes: list = None, maxport: int = MAXPORT) -> Dict[str, List[Dict[str, Any]]]:
@@ -1374,6 +4467,17 @@ class RedisClusterToolDatacenter(RedisClusterTool):
             nodesgroup[node['datacenter']].append(node)
         return nodesgroup
 
+    def get_groups_capacity(self, nodes_groups: Dict[str, List[Dict[str, Any]]] = None) -> Dict[str, float]:
+        """
+        return capacity weights of datacenters from [groups] section of capacity config
+
+        :param nodes_groups: dict like {'group1': [node1, node2]} from get_nodes_groups
+        :return: dict like {'group1': capacity}
+        """
+        if nodes_groups is None:
+            nodes_groups = self.get_nodes_groups()
+        return {group: self.capacities['groups'].get(group, 1) for group in nodes_groups}
+
     def get_nodes_subgroups(self, nodes: list = None, maxport: int = MAXPORT) -> Dict[str, List[Dict[str, Any]]]:
         """
         return nodes placed into host subgroups
@@ -1387,7 +4491,7 @@ class RedisClusterToolDatacenter(RedisClusterTool):
             nodes = self.currentnodes
         nodesgroup: defaultdict = defaultdict(list)
         for node in self.nodes_reduced_max_port(maxport=maxport, nodes=nodes):
-            nodesgroup[node['host']].append(node)
+            nodesgroup[node.host].append(node)
         return nodesgroup
 
     def get_nodes_hosts(self, nodes: list = None) -> List[str]:
@@ -1431,15 +4535,15 @@ class RedisClusterToolDatacenter(RedisClusterTool):
         for group, groupnodes in self.get_nodes_groups(nodes=nodes, maxport=maxport).items():
             groupips: List[str] = self.get_server_ips(nodes=groupnodes, maxport=maxport)
             if len(groupips) > 1:
-                group_master_count = len(self.get_masters(nodes=groupnodes, maxport=maxport))
-                master_per_server_count: Counter = Counter(
-                    list(map(lambda node: node['host'], self.get_masters(nodes=groupnodes, maxport=maxport))))
+                master_per_server_count: Counter = Counter()
+                for masternode in self.get_masters(nodes=groupnodes, maxport=maxport):
+                    master_per_server_count[masternode['host']] += self.get_node_weight(masternode)
                 # add zeroes to counter
                 for ip in groupips:
                     master_per_server_count[ip] += 0
-                master_per_server_percentage: Dict = {
-                    host: round((100 / group_master_count) * count, 2) if group_master_count != 0 else 0 for host, count
-                    in master_per_server_count.items()}
+                masters_per_server = MasterCounter(master_per_server_count, capacities=self.get_hosts_capacity(nodes=groupnodes))
+                master_per_server_percentage: Dict = {host: masters_per_server.percent(count, group=host)
+                                                      for host, count in masters_per_server.items()}
                 percents = self.mergevalueslists(master_per_server_percentage)
                 if max(percents) - min(percents) > groupskew:
                     distribution_problem[group] = master_per_server_percentage
@@ -1462,13 +4566,69 @@ class RedisClusterToolDatacenter(RedisClusterTool):
         if any([self.check_masterslave_in_group(nodes=nodes, maxport=maxport, replicas=replicas),
                 self.check_slavesofmaster_in_group(nodes=nodes, maxport=maxport, replicas=replicas),
                 self.check_master_does_not_have_desired_replica_count(nodes=nodes, replicas=replicas),
-                self.check_master_does_not_have_slaves(nodes=nodes)]):
+                self.check_master_does_not_have_slaves(nodes=nodes),
+                self.check_failure_domains(nodes=nodes, maxport=maxport)]):
             return 2
         if any([self.check_group_master_distribution(nodes=nodes, maxport=maxport, skew=skew),
                 self.check_in_group_master_distribution(nodes=nodes, maxport=maxport, groupskew=groupskew)]):
             return 1
         return 0
 
+    def get_skews(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, skew: int = SKEW,
+                  groupskew: int = GROUPSKEW) -> Dict[str, float]:
+        """
+        Return master distribution skews over allowed skew
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param skew: max-min master percentage difference
+        :param groupskew: max-min master percentage difference in datacenter
+        :return: dict like {'group': 10.0, 'in_group': 20.0}
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        skews = super().get_skews(nodes=nodes, maxport=maxport, skew=skew)
+        masters_in_group_skew: Dict = self.check_in_group_master_distribution(nodes=nodes, maxport=maxport, groupskew=groupskew)
+        skews['in_group'] = round(sum(map(lambda percentage: max(percentage.values()) - min(percentage.values()) - groupskew,
+                                          masters_in_group_skew.values())), 2)
+        return skews
+
+    def get_failover_skews(self, distribution: MasterDistribution, slavenodeid: str = None, skew: int = SKEW,
+                           groupskew: int = GROUPSKEW) -> Dict[str, int]:
+        """
+        Return masters count to move for master distribution skews within allowed skew from master counters, optionally after failover
+
+        :param distribution: master counters of nodes
+        :param slavenodeid: id of slave node for failover, current skews if not defined
+        :param skew: max-min master percentage difference
+        :param groupskew: max-min master percentage difference in datacenter
+        :return: dict like {'group': 2, 'in_group': 1}
+        """
+        skews = super().get_failover_skews(distribution=distribution, slavenodeid=slavenodeid, skew=skew)
+        skews['in_group'] = 0
+        for group, hosts_counter in distribution.hosts.items():
+            if len(hosts_counter) > 1:
+                skews['in_group'] += distribution.failover_in_group_excess(group=group, slavenodeid=slavenodeid, skew=groupskew) \
+                    if slavenodeid else hosts_counter.excess(groupskew, unit=distribution.unit())
+        return skews
+
+    def get_metrics(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, replicas: int = None) -> Dict[str, Any]:
+        """
+        Return distribution metrics of nodes for batch analytics with the biggest skew of servers in datacenter
+
+        :param nodes: nodes list
+        :param maxport: reduce ports to maximum value
+        :param replicas: desired number of replicas, current replicas count if None
+        :return: dict with METRICS_FIELDS of nodes like {'masters': 10, 'skew': 20.0, 'group_skew': 30.0, ...}
+        """
+        if nodes is None:
+            nodes = self.currentnodes
+        metrics = super().get_metrics(nodes=nodes, maxport=maxport, replicas=replicas)
+        masters_in_group_percent: Dict = self.check_in_group_master_distribution(nodes=nodes, maxport=maxport, groupskew=-1)
+        metrics['group_skew'] = round(max(map(lambda percentage: max(percentage.values()) - min(percentage.values()),
+                                              masters_in_group_percent.values()), default=0), 2)
+        return metrics
+
     def print_problems(self, nodes: list = None, maxport: int = MAXPORT, skew: int = SKEW, groupskew: int = GROUPSKEW,
                        replicas: int = REPLICAS) -> None:
         """
@@ -1539,15 +4699,17 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                     f'    Master node {masternodeid} ({masternode["datacenter"]} {masternode["hostname"]}) has not slaves')
             print()
 
+        self.print_failure_domains_problems(nodes=nodes, maxport=maxport)
+
         masters_group_skew: Dict = self.check_group_master_distribution(nodes=nodes, maxport=maxport, skew=skew)
         if masters_group_skew:
-            print(f'Groups have master distribution skew more than {skew}% (actual '
+            print(f'Groups have master distribution{self.get_balance_desc()} skew more than {skew}% (actual '
                   f'{round(max(masters_group_skew.values()) - min(masters_group_skew.values()), 2)}%): {masters_group_skew}\n')
 
         masters_in_group_skew: Dict = self.check_in_group_master_distribution(nodes=nodes, maxport=maxport,
                                                                               groupskew=groupskew)
         for group, masterspercentage in masters_in_group_skew.items():
-            print(f'Group {group} has servers with distribution skew more than {groupskew}% in group (actual '
+            print(f'Group {group} has servers with distribution{self.get_balance_desc()} skew more than {groupskew}% in group (actual '
                   f'{round(max(masterspercentage.values()) - min(masterspercentage.values()), 2)}%): {masterspercentage}\n')
 
     def print_cluster_info(self, nodes: list = None, maxport: int = MAXPORT, indent: int = 4) -> None:
@@ -1567,8 +4729,13 @@ class RedisClusterToolDatacenter(RedisClusterTool):
         masters_in_group_skew: Dict = self.check_in_group_master_distribution(nodes=nodes, maxport=maxport,
                                                                               groupskew=-1)
         nodesgroups = self.get_nodes_groups(nodes=nodes, maxport=maxport)
+        groups_capacity = self.get_groups_capacity(nodes_groups=nodesgroups)
+        hosts_capacity = self.get_hosts_capacity(nodes=nodes)
+        # real share of masters is printed, skews are calculated from percents normalized by capacity
+        distribution = self.get_master_distribution(nodes=nodes, maxport=maxport)
         for group, groups_master_percent in masters_group_skew.items():
-            print(f'{" " * indent}Group {group} (has {masters_group_skew[group]}% masters): '
+            capacity_desc = f' capacity {groups_capacity[group]:g}' if len(set(groups_capacity.values())) > 1 else ''
+            print(f'{" " * indent}Group {group}{capacity_desc} (has {self.get_share_desc(distribution.groups, group)}): '
                   f'(masters: {len(self.get_masters(nodes=nodesgroups[group], maxport=maxport))!s:3} '
                   f'slaves: {len(self.get_slaves(nodes=nodesgroups[group], maxport=maxport))!s:3})', end='')
 
@@ -1578,14 +4745,16 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                 for ip in serversips:
                     servernodes = list(filter(lambda node: node['host'] == ip, nodesgroups[group]))
                     hostname = servernodes[0]['hostname']
+                    capacity_desc = f' capacity {hosts_capacity[ip]:g}' if len(set(hosts_capacity.values())) > 1 else ''
                     print(
-                        f'{" " * (4 + indent)}host {hostname} ({ip}) has {masters_in_group_skew[group].get(ip)}% masters of datacenter: ('
+                        f'{" " * (4 + indent)}host {hostname} ({ip}){capacity_desc} has {self.get_share_desc(distribution.hosts[group], ip, scope=" of datacenter")}: ('
                         f'masters: {len(self.get_masters(nodes=servernodes, maxport=maxport))!s:3}'
                         f'slaves: {len(self.get_slaves(nodes=servernodes, maxport=maxport))!s:3})')
             else:
                 print(f' server {nodesgroups[group][0]["hostname"]} ({serversips[0]})')
         print(
-            f'{" " * (indent - 4)}Skew: {masters_group_skew_delta}%\nActual replica count {self.get_current_replicas_count(nodes=nodes, maxport=maxport)}\n')
+            f'{" " * (indent - 4)}Skew{self.get_balance_desc()}{" (normalized by capacity)" if distribution.groups.factors else ""}: '
+            f'{masters_group_skew_delta}%\nActual replica count {self.get_current_replicas_count(nodes=nodes, maxport=maxport)}\n')
 
     def find_candidate_for_failover(self, masternodeid: str, nodes: list = None, maxport: int = MAXPORT) -> Optional[str]:
         """
@@ -1603,7 +4772,7 @@ class RedisClusterToolDatacenter(RedisClusterTool):
 
         # find group with the lowest number of masters
         top_masters_count_in_groups: Counter = Counter(
-            {group: len(self.get_masters(nodes=nodelist)) for group, nodelist in nodesgroup.items()})
+            {group: self.get_masters_weight(nodes=nodelist) for group, nodelist in nodesgroup.items()})
 
         masternode_group = self.get_node_group(nodes=nodes, nodeid=masternodeid)
         if masternode_group in top_masters_count_in_groups:
@@ -1612,22 +4781,24 @@ class RedisClusterToolDatacenter(RedisClusterTool):
         if top_masters_count_in_groups:
             # iterate over reversed top (from min master count to max mastercount per group)
             for group, _ in top_masters_count_in_groups.most_common()[::-1]:
-                # check that group has connected to master slave
-                connectedslave = self.get_slaves(nodes=nodesgroup[group], masternodeid=masternodeid, maxport=maxport)
+                # check that group has connected to master slave that can take over without data loss
+                connectedslave = list(filter(self.is_failover_slave_healthy,
+                                             self.get_slaves(nodes=nodesgroup[group], masternodeid=masternodeid, maxport=maxport)))
                 if connectedslave:
                     slaveips = self.get_server_ips(nodes=connectedslave)
                     if len(slaveips) > 1:  # if more than one server with situable slave find server with the lowest number of master
                         # get master count for each server
                         top_masters_count_in_group: Counter = Counter({
-                            ip: len(list(filter(lambda node: node['host'] == ip,
-                                                self.get_masters(nodes=nodesgroup[group], maxport=maxport))))
+                            ip: self.get_masters_weight(nodes=list(filter(lambda node: node['host'] == ip, nodesgroup[group])),
+                                                        maxport=maxport)
                             for ip in slaveips
                         })
                         # return first slaveid from server with lowest mastercount
                         for serverip, _ in top_masters_count_in_group.most_common()[::-1]:
-                            return list(filter(lambda node: node['host'] == serverip, connectedslave)).pop()['node_id']
+                            return self.choose_failover_slave(slaves=list(filter(lambda node: node['host'] == serverip,
+                                                                                 connectedslave)))['node_id']
                     else:
-                        return connectedslave.pop()['node_id']
+                        return self.choose_failover_slave(slaves=connectedslave)['node_id']
             return None
         else:
             return None
@@ -1647,43 +4818,35 @@ class RedisClusterToolDatacenter(RedisClusterTool):
         if nodes is None:
             nodes = deepcopy(self.currentnodes)
 
-        nodesgroup = self.get_nodes_groups(nodes=nodes)
+        nodesgroup = self.get_nodes_groups(nodes=nodes, maxport=maxport)
 
-        master_nodes_counter = cluster.check_group_master_distribution(nodes=nodes, maxport=maxport, skew=0)
-        current_skew = max(master_nodes_counter.values()) - min(
-            master_nodes_counter.values()) if master_nodes_counter else 0
+        # current skews are rounded by the same counters as candidates scores, so equal skews don't pass as improvement
+        distribution = self.get_master_distribution(nodes=nodes, maxport=maxport)
+        current_skew: Tuple[float, float] = (distribution.groups.skew(), distribution.groups.skew(positive=True))
 
         cluster_group_master_distribution_problem = self.check_group_master_distribution(nodes=nodes,
                                                                                          maxport=maxport,
                                                                                          skew=skew)
         if cluster_group_master_distribution_problem:
+            candidates: List[str] = []
             for group, _ in Counter(cluster_group_master_distribution_problem).most_common():
                 for masternode in self.get_masters(nodes=nodesgroup[group]):
                     slavenodeid = self.find_candidate_for_failover(nodes=nodes, maxport=maxport,
                                                                    masternodeid=masternode['node_id'])
-                    if slavenodeid:
-                        slavenode = self.get_node(nodes=nodes, nodeid=slavenodeid)
-                        slavenodeid_already_in_plan = list(filter(lambda x: 'CLUSTER FAILOVER' in x['kwargs']['command']
-                                                                            and x['kwargs']['port'] == slavenode['port']
-                                                                            and x['kwargs']['ip'] == slavenode['host'],
-                                                                  self.plans))
-                        new_nodes_plan = self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid,
-                                                                        dryrun=True, deep_copy=True)
-                        new_master_nodes_counter: Dict[str, int] = cluster.check_group_master_distribution(
-                            nodes=new_nodes_plan,
-                            maxport=maxport,
-                            skew=0)
-                        new_master_nodes_counter: Counter = +Counter(new_master_nodes_counter)
-                        new_master_nodes_counter_positive: Counter = +Counter(new_master_nodes_counter)
-                        new_skew_positive = max(new_master_nodes_counter.values()) - min(
-                            new_master_nodes_counter_positive.values()) if new_master_nodes_counter_positive else 0
-                        if not slavenodeid_already_in_plan and new_skew_positive < current_skew:
-                            return self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid, deep_copy=True)
+                    if slavenodeid and not self.failover_already_in_plan(nodes=nodes, slavenodeid=slavenodeid):
+                        candidates.append(slavenodeid)
+            for slavenodeid, new_skew in zip(candidates, self.score_failover_candidates(candidates=candidates, nodes=nodes,
+                                                                                        maxport=maxport)):
+                # skew of all groups decreases, or stays and skew of groups with masters decreases
+                if new_skew < current_skew:
+                    return self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid, deep_copy=True)
 
         cluster_in_group_master_distribution_problem = self.check_in_group_master_distribution(nodes=nodes,
                                                                                                maxport=maxport,
                                                                                                groupskew=groupskew)
         if cluster_in_group_master_distribution_problem:
+            old_group_skews = {group: distribution.hosts[group].skew() for group in cluster_in_group_master_distribution_problem}
+            candidates = []
             for group, node_counters in cluster_in_group_master_distribution_problem.items():
                 for node_ip, _ in Counter(node_counters).most_common():
                     # find candidate for node in group with the biggest number of masters
@@ -1691,49 +4854,36 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                                                   self.get_masters(nodes=nodesgroup[group]))):
                         slavenodeid = self.find_candidate_for_failover(nodes=nodes, maxport=maxport,
                                                                        masternodeid=masternode['node_id'])
-                        if slavenodeid:
-                            slavenode = self.get_node(nodes=nodes, nodeid=slavenodeid)
-                            slavenodeid_already_in_plan = list(
-                                filter(lambda x: 'CLUSTER FAILOVER' in x['kwargs']['command']
-                                                 and x['kwargs']['port'] == slavenode['port']
-                                                 and x['kwargs']['ip'] == slavenode['host'],
-                                       self.plans))
-
-                            new_nodes_plan = self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid,
-                                                                            dryrun=True, deep_copy=True)
-                            new_cluster_in_group_master_distribution_problem = self.check_in_group_master_distribution(
-                                nodes=new_nodes_plan,
-                                maxport=maxport,
-                                groupskew=0)
-                            old_group_skews = {group: max(skew.values()) - min(skew.values()) for group, skew in
-                                               cluster_in_group_master_distribution_problem.items()}
-                            new_group_skews = {group: max(skew.values()) - min(skew.values()) for group, skew in
-                                               new_cluster_in_group_master_distribution_problem.items()}
-                            if not slavenodeid_already_in_plan:
-                                for skew_group, old_group_skew in old_group_skews.items():
-                                    if old_group_skew > new_group_skews.get(skew_group, 0):
-                                        return self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid, deep_copy=True)
+                        if slavenodeid and not self.failover_already_in_plan(nodes=nodes, slavenodeid=slavenodeid):
+                            candidates.append(slavenodeid)
+            for slavenodeid, new_group_skews in zip(candidates, self.score_failover_candidates(candidates=candidates, nodes=nodes,
+                                                                                               maxport=maxport, check='in_group')):
+                for skew_group, old_group_skew in old_group_skews.items():
+                    if old_group_skew > new_group_skews.get(skew_group, 0):
+                        return self.plan_clusternode_failover(nodes=nodes, slavenodeid=slavenodeid, deep_copy=True)
 
         return None
 
-    def levelout_masters(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT) -> List[Dict[str, Any]]:
+    def levelout_masters(self, nodes: List[Dict[str, Any]] = None, maxport: int = MAXPORT, **skew_params: int) -> List[Dict[str, Any]]:
         """
         Levelout masters before rebalancing
         :param nodes: nodes list
         :param maxport: reduce ports to maximum value
+        :param skew_params: skew (and groupskew for datacenter) for weighted levelout
         :return: planned nodes
         """
         if nodes is None:
             nodes = deepcopy(self.currentnodes)
+        if self.balance_by != 'count':
+            return self.levelout_masters_weighted(nodes=nodes, maxport=maxport, **skew_params)
 
         # determine how much masters per group should be
         group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
         groups = sorted(group_nodes.keys())
         masters = self.get_masters(nodes=nodes, maxport=maxport)
-        floor, remainder = len(masters) // len(groups), len(masters) % len(groups)
-        desired_groups_master_num: OrderedDict[str, Union[OrderedDict[str, int], int]] = OrderedDict(map(lambda group: (group, floor), groups))
-        for index in range(remainder):
-            desired_groups_master_num[groups[index]] += 1
+        groups_capacity = self.get_groups_capacity(nodes_groups=group_nodes)
+        desired_groups_master_num: OrderedDict[str, Union[OrderedDict[str, int], int]] = self.split_by_weights(
+            len(masters), OrderedDict(map(lambda group: (group, groups_capacity[group]), groups)))
         desired_nodes_skew = dict()
         for group, number in desired_groups_master_num.items():   # there can't be more masters than nodes
             if number > len(group_nodes[group]):
@@ -1754,10 +4904,9 @@ class RedisClusterToolDatacenter(RedisClusterTool):
         for group, number in desired_groups_master_num.items():   # there can't be more masters than nodes
             hosts_in_group = self.get_nodes_hosts(nodes=group_nodes[group])
             nodes_by_hosts: Dict[str, List[Dict[str, Any]]] = dict(map(lambda host: (host, self.get_nodes_by_host(nodes=group_nodes[group], host=host)), hosts_in_group))
-            sub_floor, sub_remainder = number // len(hosts_in_group), number % len(hosts_in_group)
-            desired_subgroups_master_num: OrderedDict[str, int] = OrderedDict({subgroup: sub_floor for subgroup in hosts_in_group})
-            for index in range(sub_remainder):
-                desired_subgroups_master_num[hosts_in_group[index]] += 1
+            hosts_capacity = self.get_hosts_capacity(nodes=group_nodes[group])
+            desired_subgroups_master_num: OrderedDict[str, int] = self.split_by_weights(
+                number, OrderedDict(map(lambda host: (host, hosts_capacity[host]), hosts_in_group)))
             desired_subnodes_skew = dict()
             for subgroup, subnumber in desired_subgroups_master_num.items():  # there can't be more masters than nodes
                 if subnumber > len(nodes_by_hosts[subgroup]):
@@ -1775,25 +4924,25 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                                 break
             desired_groups_master_num[group] = desired_subgroups_master_num
 
-        # soft rebalance with failover (using only failover)
+        # soft rebalance with failover (using only failover), master counts are kept in counters instead of nodes recount
+        distribution = self.get_master_distribution(nodes=nodes, maxport=maxport)
         for group in groups:
             neighbor_groups: List[str] = list(filter(lambda gr: gr != group, group_nodes.keys()))
             for subgroup in self.get_nodes_hosts(nodes=group_nodes[group]):
                 subgroup_nodes = self.get_nodes_by_host(nodes=group_nodes[group], host=subgroup)
                 subgroup_masters = self.get_masters(nodes=subgroup_nodes, maxport=maxport)
-                master_skew = desired_groups_master_num[group][subgroup] - len(subgroup_masters)
+                master_skew = desired_groups_master_num[group][subgroup] - distribution.hosts[group][subgroup]
 
                 if master_skew > 0:  # need to get more masters (too low number of masters)
                     for _ in range(0, master_skew):
                         success = False
                         for neighbor_group in neighbor_groups:
-                            for neighbor_subgroup, neighbor_subgroup_nodes in self.get_nodes_subgroups(nodes=group_nodes[neighbor_group], maxport=maxport).items():
-                                neighbor_subgroup_masters: List[Dict[str, Any]] = self.get_masters(nodes=neighbor_subgroup_nodes, maxport=maxport)
-                                if len(neighbor_subgroup_masters) > desired_groups_master_num[neighbor_group][neighbor_subgroup]:
+                            for neighbor_subgroup in self.get_nodes_hosts(nodes=group_nodes[neighbor_group]):
+                                if distribution.hosts[neighbor_group][neighbor_subgroup] > desired_groups_master_num[neighbor_group][neighbor_subgroup]:
                                     for slave_node in self.get_slaves(nodes=subgroup_nodes, maxport=maxport):
-                                        if self.get_node_group(nodes=nodes,
-                                                               node=self.get_masters(nodes=nodes, slavenodeid=slave_node['node_id'], maxport=maxport),
-                                                               maxport=maxport) == neighbor_subgroup:  # orphaned nodes can't exist
+                                        if slave_node['master_id'] in distribution.nodes and \
+                                                distribution.nodes[slave_node['master_id']]['host'] == neighbor_subgroup:  # orphaned nodes can't exist
+                                            distribution.failover(slavenodeid=slave_node['node_id'], masternodeid=slave_node['master_id'])
                                             nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=slave_node['node_id'])
                                             group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
                                             subgroup_nodes = self.get_nodes_by_host(nodes=group_nodes[group], host=subgroup)
@@ -1814,6 +4963,7 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                                 if len(neighbor_subgroup_masters) > desired_groups_master_num[neighbor_group][neighbor_subgroup]:
                                     subgroup_slaves = self.get_slaves(nodes=subgroup_nodes, maxport=maxport)
                                     if subgroup_slaves:
+                                        distribution.failover(slavenodeid=subgroup_slaves[0]['node_id'], masternodeid=neighbor_subgroup_masters[-1]['node_id'])
                                         nodes = self.plan_clusternode_replicate(nodes=nodes, masternodeid=neighbor_subgroup_masters[-1]['node_id'], slavenodeid=subgroup_slaves[0]['node_id'])
                                         nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=subgroup_slaves[0]['node_id'])
                                         group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
@@ -1833,6 +4983,7 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                             if len(self_group_subgroup_neighbor_masters) > desired_groups_master_num[group][self_group_subgroup_neighbor]:
                                 subgroup_slaves = self.get_slaves(nodes=subgroup_nodes, maxport=maxport)
                                 if subgroup_slaves:
+                                    distribution.failover(slavenodeid=subgroup_slaves[0]['node_id'], masternodeid=self_group_subgroup_neighbor_masters[-1]['node_id'])
                                     nodes = self.plan_clusternode_replicate(nodes=nodes, masternodeid=self_group_subgroup_neighbor_masters[-1]['node_id'], slavenodeid=subgroup_slaves[0]['node_id'])
                                     nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=subgroup_slaves[0]['node_id'])
                                     group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
@@ -1843,10 +4994,11 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                         success = False
                         for neighbor_group in neighbor_groups:
                             for neighbor_subgroup, neighbor_subgroup_nodes in self.get_nodes_subgroups(nodes=group_nodes[neighbor_group], maxport=maxport).items():
-                                neighbor_subgroup_masters = self.get_masters(nodes=neighbor_subgroup_nodes, maxport=maxport)
-                                if len(neighbor_subgroup_masters) < desired_groups_master_num[neighbor_group][neighbor_subgroup]:
+                                if distribution.hosts[neighbor_group][neighbor_subgroup] < desired_groups_master_num[neighbor_group][neighbor_subgroup]:
                                     for slave_node in self.get_slaves(nodes=neighbor_subgroup_nodes, maxport=maxport):
-                                        if self.get_masters(nodes=nodes, slavenodeid=slave_node['node_id'], maxport=maxport)['host'] == subgroup:
+                                        if slave_node['master_id'] in distribution.nodes and \
+                                                distribution.nodes[slave_node['master_id']]['host'] == subgroup:
+                                            distribution.failover(slavenodeid=slave_node['node_id'], masternodeid=slave_node['master_id'])
                                             nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=slave_node['node_id'])
                                             group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
                                             subgroup_nodes = self.get_nodes_by_host(nodes=group_nodes[group], host=subgroup)
@@ -1867,6 +5019,7 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                                 if len(neighbor_subgroup_masters) < desired_groups_master_num[neighbor_group][neighbor_subgroup]:
                                     neighbor_subgroup_slaves = self.get_slaves(nodes=neighbor_subgroup_nodes, maxport=maxport)
                                     if neighbor_subgroup_slaves:
+                                        distribution.failover(slavenodeid=neighbor_subgroup_slaves[0]['node_id'], masternodeid=subgroup_masters[-1]['node_id'])
                                         nodes = self.plan_clusternode_replicate(nodes=nodes, masternodeid=subgroup_masters[-1]['node_id'], slavenodeid=neighbor_subgroup_slaves[0]['node_id'])
                                         nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=neighbor_subgroup_slaves[0]['node_id'])
                                         group_nodes = self.get_nodes_groups(nodes=nodes, maxport=maxport)
@@ -1885,6 +5038,7 @@ class RedisClusterToolDatacenter(RedisClusterTool):
                             if len(self_group_subgroup_neighbor_masters) < desired_groups_master_num[group][self_group_subgroup_neighbor]:
                                 self_group_subgroup_neighbor_slaves = self.get_slaves(nodes=self_group_subgroup_neighbor_nodes, maxport=maxport)
                                 if self_group_subgroup_neighbor_slaves:
+                                    distribution.failover(slavenodeid=self_group_subgroup_neighbor_slaves[0]['node_id'], masternodeid=subgroup_masters[-1]['node_id'])
                                     nodes = self.plan_clusternode_replicate(nodes=nodes, masternodeid=subgroup_masters[-1][
                                         'node_id'], slavenodeid=self_group_subgroup_neighbor_slaves[0]['node_id'])
                                     nodes = self.plan_clusternode_failover(nodes=nodes, slavenodeid=self_group_subgroup_neighbor_slaves[0]['node_id'])
@@ -1934,6 +5088,381 @@ class RedisClusterToolDatacenter(RedisClusterTool):
         return command
 
 
+class SharedHostsBalancer:
+    """
+    masters placement of several redis clusters on shared hosts with failovers planning for even combined load of hosts
+    """
+
+    def __init__(self, clusters: List[RedisClusterTool], skew: int = RedisClusterTool.SKEW):
+        """
+        initial func
+
+        :param clusters: cluster objects with current nodes
+        :param skew: max-min masters percentage difference between groups of every cluster that failovers can't exceed
+        """
+        self.clusters: List[RedisClusterTool] = clusters
+        self.skew: int = skew
+
+    @staticmethod
+    def collect(tool_class: type, addresses: List[Tuple[str, int]], **kwargs: Any) -> List[RedisClusterTool]:
+        """
+        Return cluster objects connected concurrently
+
+        :param tool_class: RedisClusterTool or RedisClusterToolDatacenter
+        :param addresses: list like [('127.0.0.1', 7000)]
+        :param kwargs: other arguments of tool_class
+        :return: cluster objects in addresses order
+        """
+        with ThreadPoolExecutor(max_workers=max(1, len(addresses))) as executor:
+            return list(executor.map(lambda address: tool_class(host=address[0], port=address[1], **kwargs), addresses))
+
+    def get_hosts_load(self, nodes_list: List[List[Dict[str, Any]]] = None, maxport: int = RedisClusterTool.MAXPORT) -> MasterCounter:
+        """
+        Return combined masters count (or weight) per host of all clusters
+
+        :param nodes_list: nodes lists in clusters order, current nodes if not defined
+        :param maxport: reduce ports to maximum value
+        :return: MasterCounter with hosts capacities
+        """
+        if nodes_list is None:
+            nodes_list = list(map(lambda cluster: cluster.currentnodes, self.clusters))
+        counts: Counter = Counter()
+        capacities: Dict[str, float] = dict()
+        for cluster, nodes in zip(self.clusters, nodes_list):
+            for node in cluster.nodes_reduced_max_port(nodes=nodes, maxport=maxport):
+                counts[node['host']] += cluster.get_node_weight(node) if 'master' in node['flags'] else 0
+                capacities[node['host']] = cluster.get_node_capacity(node)
+        return MasterCounter(dict(sorted(counts.items())), capacities=capacities)
+
+    def print_hosts_load(self, nodes_list: List[List[Dict[str, Any]]] = None, maxport: int = RedisClusterTool.MAXPORT,
+                         indent: int = 4) -> None:
+        """
+        Print combined masters percentage per host and skew
+
+        :param nodes_list: nodes lists in clusters order, current nodes if not defined
+        :param maxport: reduce ports to maximum value
+        :param indent: indent for printing
+        :return: None
+        """
+        load = self.get_hosts_load(nodes_list=nodes_list, maxport=maxport)
+        for host, count in load.items():
+            print(f'{" " * indent}Server {host} (has {load.percent(count, group=host)}% masters of all clusters): (masters: {count})')
+        print(f'{" " * (indent - 4)}Combined skew is {load.skew()}%\n')
+
+    @staticmethod
+    def get_load_delta(load: MasterCounter, decrement: str, increment: str, weight: int = 1) -> float:
+        """
+        Return change of sum of squared capacity normalized hosts loads after master move, unlike max-min skew
+        it decreases on every move from more loaded host to less loaded host
+
+        :param load: result of get_hosts_load
+        :param decrement: host that lose master
+        :param increment: host that get master
+        :param weight: weight of moved master
+        :return: delta, negative if move makes load more even
+        """
+        decrement_factor = load.factors[decrement] if load.factors else 1
+        increment_factor = load.factors[increment] if load.factors else 1
+        return decrement_factor ** 2 * (weight ** 2 - 2 * load[decrement] * weight) + \
+            increment_factor ** 2 * (weight ** 2 + 2 * load[increment] * weight)
+
+    def plan(self, maxport: int = RedisClusterTool.MAXPORT) -> List[List[Dict[str, Any]]]:
+        """
+        Plan failovers in every cluster while combined load of hosts becomes more even, the best failover of all clusters
+        is chosen on every step, failover can't make skew between groups of its cluster more than skew or current skew of cluster.
+        Failover slave is chosen like for levelout: it's placed in another group than master, slaves with down link or lag
+        more than FAILOVER_MAX_LAG are skipped and the most caught up slave of shard on host is taken
+
+        :param maxport: reduce ports to maximum value
+        :return: planned nodes lists in clusters order, plans are appended to plans of clusters
+        """
+        nodes_list = list(map(lambda cluster: deepcopy(cluster.currentnodes), self.clusters))
+        load = self.get_hosts_load(nodes_list=nodes_list, maxport=maxport)
+        distributions = [cluster.get_master_distribution(nodes=nodes, maxport=maxport) for cluster, nodes in zip(self.clusters, nodes_list)]
+        # failover rules of levelout: replication state is known only for slaves of current masters (see get_replication_lag),
+        # so slaves of planned masters are healthy like there
+        current_masters = [{node['node_id']: node['master_id'] for node in cluster.get_slaves()} for cluster in self.clusters]
+        healthy = [set(map(lambda node: node['node_id'], filter(cluster.is_failover_slave_healthy, cluster.get_slaves())))
+                   for cluster in self.clusters]
+        for _ in range(sum(map(lambda distribution: len(distribution.weights), distributions))):
+            best: Optional[Tuple[float, int, str, str]] = None
+            for index, (cluster, nodes, distribution) in enumerate(zip(self.clusters, nodes_list, distributions)):
+                allowed_skew = max(self.skew, distribution.groups.skew())
+                shard_host_slaves: defaultdict = defaultdict(list)
+                for slave in cluster.get_slaves(nodes=nodes, maxport=maxport):
+                    master_id = slave['master_id']
+                    # failover of levelout moves master to another group (server or datacenter)
+                    if master_id not in distribution.weights or distribution.node_group[master_id] == distribution.node_group[slave['node_id']]:
+                        continue
+                    if current_masters[index].get(slave['node_id']) == master_id and slave['node_id'] not in healthy[index]:
+                        continue
+                    shard_host_slaves[(master_id, slave['host'])].append(slave)
+                for (master_id, host), slaves in shard_host_slaves.items():
+                    delta = self.get_load_delta(load, decrement=distribution.nodes[master_id]['host'], increment=host,
+                                                weight=distribution.weights[master_id])
+                    if delta >= 0 or (best is not None and delta >= best[0]):
+                        continue
+                    # the most caught up slave of shard on host like for failover of levelout
+                    slavenodeid = cluster.choose_failover_slave(slaves=slaves)['node_id']
+                    if distribution.failover_skew(slavenodeid=slavenodeid, positive=False) > allowed_skew:
+                        continue
+                    best = (delta, index, slavenodeid, master_id)
+            if best is None:
+                break
+            _, index, slavenodeid, masternodeid = best
+            distribution = distributions[index]
+            load.move(decrement=distribution.nodes[masternodeid]['host'], increment=distribution.nodes[slavenodeid]['host'],
+                      weight=distribution.weights[masternodeid])
+            distribution.failover(slavenodeid=slavenodeid, masternodeid=masternodeid)
+            nodes_list[index] = self.clusters[index].plan_clusternode_failover(slavenodeid=slavenodeid, nodes=nodes_list[index])
+        return nodes_list
+
+
+class TopologyHistory:
+    """
+    append-only topology history: every record keeps only changed and removed nodes, periodic keyframes keep all nodes,
+    index file keeps time and offset of keyframes, so past topology is rebuilt from the nearest keyframe
+    """
+
+    # node state fields
+    FIELDS: ClassVar[Tuple[str, ...]] = ('host', 'port', 'role', 'master_id', 'slots', 'hostname', 'datacenter')
+
+    def __init__(self, path: str, keyframe_interval: int = 100):
+        """
+        initial func
+
+        :param path: history file, index is saved to path.idx
+        :param keyframe_interval: number of records between keyframes
+        """
+        self.path: str = path
+        self.index_path: str = f'{path}.idx'
+        self.keyframe_interval: int = keyframe_interval
+        # keyframes times and offsets in history file
+        self.keyframes: List[Tuple[float, int]] = list()
+        if isfile(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.keyframes = [(float(line.split()[0]), int(line.split()[1])) for line in f if line.strip()]
+        self.last_state: Optional[Dict[str, list]] = None
+        self.records_since_keyframe: int = 0
+
+    @staticmethod
+    def parse_time(value: Union[str, float, None]) -> Optional[float]:
+        """
+        return unix time of iso date or unix time
+
+        :param value: string like '2021-01-12T03:12:00' or unix time
+        :return: unix time
+        """
+        if value is None or isinstance(value, (int, float)):
+            return value
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.datetime.fromisoformat(value).timestamp()
+
+    @staticmethod
+    def format_time(timestamp: float) -> str:
+        """
+        return iso date of unix time
+
+        :param timestamp: unix time
+        :return: string like '2021-01-12T03:12:00'
+        """
+        return datetime.datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+    @classmethod
+    def get_node_state(cls, node: Dict[str, Any]) -> list:
+        """
+        return node state values of FIELDS
+
+        :param node: node dict
+        :return: list like ['10.0.0.1', 7000, 'master', '-', [[0, 5460]], 'host1', 'DC1']
+        """
+        return [node['host'], int(node['port']), 'master' if 'master' in node['flags'] else 'slave', node['master_id'],
+                [[slots_range[0], slots_range[-1]] for slots_range in RedisClusterTool.get_slots_ranges(node)],
+                node.get('hostname'), node.get('datacenter')]
+
+    @classmethod
+    def get_nodes(cls, state: Dict[str, list]) -> List[NodeRecord]:
+        """
+        return nodes list of state
+
+        :param state: dict like {nodeid: node state values}
+        :return: nodes list of records sorted like current nodes
+        """
+        nodes = []
+        for nodeid, values in state.items():
+            node = {'node_id': nodeid, 'flags': values[cls.FIELDS.index('role')], 'connected': True}
+            node.update({field: value for field, value in zip(cls.FIELDS, values) if field != 'role' and value is not None})
+            nodes.append(NodeRecord(node))
+        return sorted(nodes, key=lambda node: (node['host'], node['port']))
+
+    def iter_records(self, start: float = None, end: float = None) -> Iterator[Tuple[float, Dict[str, list], Dict[str, Optional[list]]]]:
+        """
+        return iterator of history records from the last keyframe before start, state is changed in place,
+        keyframe is returned as the first record with all nodes as new ones
+
+        :param start: unix time, from the beginning of history if None
+        :param end: unix time, till the end of history if None
+        :return: iterator of (time, state, previous values of changed nodes, None for new nodes)
+        """
+        if not isfile(self.path):
+            return
+        state: Dict[str, list] = dict()
+        position = bisect_left(self.keyframes, (start,)) - 1 if start is not None else -1
+        with open(self.path, 'rb') as f:
+            if position >= 0:
+                f.seek(self.keyframes[position][1])
+                keyframe = json.loads(f.readline())
+                state = keyframe['nodes']
+                yield keyframe['keyframe'], state, dict.fromkeys(state)
+            for line in f:
+                # keyframes repeat state that is already built from records
+                if line.startswith(b'{"keyframe"'):
+                    continue
+                record = json.loads(line)
+                if end is not None and record['time'] > end:
+                    return
+                previous = {nodeid: state.get(nodeid) for nodeid in itertools.chain(record['changed'], record['removed'])}
+                state.update(record['changed'])
+                for nodeid in record['removed']:
+                    state.pop(nodeid, None)
+                yield record['time'], state, previous
+
+    def get_last_state(self) -> Dict[str, list]:
+        """
+        return last recorded state
+
+        :return: dict like {nodeid: node state values}
+        """
+        if self.last_state is None:
+            self.last_state = dict()
+            # the first record is the last keyframe itself
+            self.records_since_keyframe = -1 if self.keyframes else 0
+            for timestamp, state, previous in self.iter_records(start=self.keyframes[-1][0] + 1e-6 if self.keyframes else None):
+                self.last_state = state
+                self.records_since_keyframe += 1
+        return self.last_state
+
+    def record(self, nodes: List[Dict[str, Any]], timestamp: float = None) -> bool:
+        """
+        append changed and removed nodes since last record and keyframe every keyframe_interval records
+
+        :param nodes: nodes list
+        :param timestamp: unix time, now if None
+        :return: False if nodes are not changed and nothing is written
+        """
+        if timestamp is None:
+            timestamp = datetime.datetime.now().timestamp()
+        last_state = self.get_last_state()
+        state = {node['node_id']: self.get_node_state(node) for node in nodes}
+        changed = {nodeid: values for nodeid, values in state.items() if last_state.get(nodeid) != values}
+        removed = [nodeid for nodeid in last_state if nodeid not in state]
+        if not changed and not removed:
+            return False
+        with open(self.path, 'ab') as f:
+            f.write(json.dumps({'time': timestamp, 'changed': changed, 'removed': removed}, separators=(',', ':')).encode('utf-8') + b'\n')
+            self.records_since_keyframe += 1
+            if not self.keyframes or self.records_since_keyframe >= self.keyframe_interval:
+                offset = f.tell()
+                f.write(json.dumps({'keyframe': timestamp, 'nodes': state}, separators=(',', ':')).encode('utf-8') + b'\n')
+                with open(self.index_path, 'a') as index:
+                    index.write(f'{timestamp} {offset}\n')
+                self.keyframes.append((timestamp, offset))
+                self.records_since_keyframe = 0
+        self.last_state = state
+        return True
+
+    def get_state(self, timestamp: float) -> Dict[str, list]:
+        """
+        return state at time
+
+        :param timestamp: unix time
+        :return: dict like {nodeid: node state values}, empty if history starts later
+        """
+        result: Dict[str, list] = dict()
+        for record_time, state, previous in self.iter_records(start=timestamp + 1e-6, end=timestamp):
+            result = state
+        return dict(result)
+
+    def get_host_masters(self, host: str, start: float = None, end: float = None) -> List[Tuple[float, int]]:
+        """
+        return masters count of server over time, only changes of count are returned
+
+        :param host: ip or hostname of server
+        :param start: unix time, from the beginning of history if None
+        :param end: unix time, till the end of history if None
+        :return: list like [(time, masters count)]
+        """
+        def on_host(values: Optional[list]) -> bool:
+            return values is not None and values[self.FIELDS.index('role')] == 'master' and \
+                host in (values[self.FIELDS.index('host')], values[self.FIELDS.index('hostname')])
+
+        counts: List[Tuple[float, int]] = list()
+        count, recorded = 0, False
+        for record_time, state, previous in self.iter_records(start=start, end=end):
+            # count at start is count of the last record before it
+            if start is not None and record_time > start and not counts and recorded:
+                counts.append((start, count))
+            count += sum(map(lambda nodeid: on_host(state.get(nodeid)) - on_host(previous[nodeid]), previous))
+            recorded = True
+            if (start is None or record_time >= start) and (not counts or counts[-1][1] != count):
+                counts.append((max(record_time, start) if start is not None else record_time, count))
+        if start is not None and not counts and recorded:
+            counts.append((start, count))
+        return counts
+
+    def get_failovers(self, start: float = None, end: float = None) -> List[Dict[str, Any]]:
+        """
+        return nodes that became masters in time window
+
+        :param start: unix time, from the beginning of history if None
+        :param end: unix time, till the end of history if None
+        :return: list like [{'time': time, 'node_id': nodeid, 'host': ip, 'port': port, 'old_master_id': masternodeid}]
+        """
+        failovers = list()
+        for record_time, state, previous in self.iter_records(start=start, end=end):
+            if start is not None and record_time < start:
+                continue
+            for nodeid, values in previous.items():
+                if values is not None and values[self.FIELDS.index('role')] == 'slave' and nodeid in state \
+                        and state[nodeid][self.FIELDS.index('role')] == 'master':
+                    failovers.append({'time': record_time, 'node_id': nodeid, 'host': state[nodeid][self.FIELDS.index('host')],
+                                      'port': state[nodeid][self.FIELDS.index('port')],
+                                      'old_master_id': values[self.FIELDS.index('master_id')]})
+        return failovers
+
+
+def snapshot_metrics_worker(path: str, simple: bool = False, replicas: int = None, maxport: int = RedisClusterTool.MAXPORT,
+                            capacity: str = None) -> Dict[str, Any]:
+    """
+    Process pool worker for batch analytics, reads snapshot and returns its metrics
+
+    :param path: nodes snapshot or plain json nodes file
+    :param simple: don't use datacenters of snapshot inventory
+    :param replicas: desired number of replicas, current replicas count of snapshot if None
+    :param maxport: reduce ports to maximum value
+    :param capacity: capacity config file
+    :return: dict with METRICS_FIELDS, error is defined if snapshot can't be analyzed
+    """
+    metrics: Dict[str, Any] = {'snapshot': path}
+    try:
+        header, inventory_answers, nodes = RedisClusterTool.read_snapshot(path)
+        metrics.update(created=header.get('created'), cluster=header.get('cluster'))
+        if simple or not inventory_answers:
+            worker_cluster = RedisClusterTool(host='127.0.0.1', port=0, passwd=None, skipconnection=True)
+        else:
+            worker_cluster = RedisClusterToolDatacenter(host='127.0.0.1', port=0, passwd=None, inventory=SnapshotInventory(inventory_answers),
+                                                        skipconnection=True)
+        if capacity:
+            worker_cluster.load_capacities(capacity)
+        worker_cluster.currentnodes = list(nodes)
+        metrics.update(worker_cluster.get_metrics(maxport=maxport, replicas=replicas))
+    except Exception as e:
+        metrics['error'] = f'{type(e).__name__}: {e}'
+    return metrics
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='redis cluster node print helper')
 
@@ -1952,6 +5481,10 @@ if __name__ == '__main__':
     optional_group.add_argument('--group-skew', '-g', type=int, default=30,
                                 help='desired master count percentage difference per server in datacenter')
     optional_group.add_argument('--timeout', '-t', type=int, default=90, help='timeout between operations')
+    optional_group.add_argument('--retry-max-delay', type=float, default=120,
+                                help='maximum delay in seconds between retries of failed command, delays grow exponentially with jitter')
+    optional_group.add_argument('--retry-deadline', type=float, default=600,
+                                help='maximum seconds for command with all retries')
     optional_group.add_argument('--fix-only', action='store_true', help='Only fix problems, skip rebalance')
     optional_group.add_argument('--force', action='store_true', help='Force rebalance iteration')
     optional_group.add_argument('--alive-only', action='store_true', help='Use only connected nodes', default=False)
@@ -1959,6 +5492,19 @@ if __name__ == '__main__':
                                 default='/etc/redisclustertool/config.cfg')
     optional_group.add_argument('--simple', action='store_true', help='Do not use datacenter detection functionality with inventory', default=False)
 
+    optional_group.add_argument('--planner', type=str, choices=('greedy', 'search'), default='greedy',
+                                help='greedy levelout or search planner (beam search over failover/replicate sequences)')
+    optional_group.add_argument('--plan-time-budget', type=float, default=60,
+                                help='time budget for search planner in seconds, the best found plan is used after it')
+    optional_group.add_argument('--beam-width', type=int, default=8, help='number of states kept by search planner on each step')
+
+    optional_group.add_argument('--balance-by', type=str, choices=tuple(RedisClusterTool.BALANCE_MODES), default='count',
+                                help='master weight for skew checks and levelout: count of masters, slots count, '
+                                     'used_memory or instantaneous_ops_per_sec')
+    optional_group.add_argument('--capacity', type=str,
+                                help='capacity config file with [hosts] (ip or hostname = weight) and [groups] (datacenter = weight) '
+                                     'sections, masters are balanced proportionally to capacity')
+
     optional_group.add_argument('--noslots_ok', action='store_true', help='Still rebalance despite having '
                                                                           'masters without slots')
 
@@ -1966,16 +5512,97 @@ if __name__ == '__main__':
     monitoring_group.add_argument('--dry-run', action='store_true', help='Only print current distribution problems')
     monitoring_group.add_argument('--nagios', action='store_true', help='Print short message for nagios short line')
 
+    plan_group = parser.add_argument_group('plan')
+    plan_group_mutual = plan_group.add_mutually_exclusive_group()
+    plan_group_mutual.add_argument('--plan-out', type=str, required=False,
+                                   help='save computed plan with topology fingerprint to json file and exit without execution')
+    plan_group_mutual.add_argument('--plan-in', type=str, required=False,
+                                   help='execute plan from json file if cluster topology fingerprint is the same')
+    plan_group.add_argument('--simulate', action='store_true',
+                            help='print simulated timeline and critical path of serial and parallel plan execution and exit')
+    plan_group.add_argument('--host-syncs', type=int, default=1,
+                            help='maximum concurrent full syncs per server for parallel execution simulation')
+    plan_group.add_argument('--datacenter-syncs', type=int, default=2,
+                            help='maximum concurrent full syncs per datacenter for parallel execution simulation')
+
+    health_group = parser.add_argument_group('health')
+    health_group.add_argument('--no-health-gate', action='store_true',
+                              help='do not check cluster health before every step of plan execution')
+    health_group.add_argument('--max-latency', type=float, default=100.0,
+                              help='maximum PING latency in milliseconds of nodes involved in step')
+    health_group.add_argument('--max-ops', type=int, required=False,
+                              help='maximum instantaneous_ops_per_sec of nodes involved in step')
+    health_group.add_argument('--health-wait', type=float, default=3600.0,
+                              help='maximum seconds to wait for healthy cluster before step')
+    health_group.add_argument('--no-slots-check', action='store_true',
+                              help='do not check slots coverage and open slots before and after every step of plan execution')
+    health_group.add_argument('--write-probe', action='store_true',
+                              help='measure write unavailability of shard during every failover with writes of sentinel key')
+    health_group.add_argument('--probe-interval', type=float, default=10,
+                              help='milliseconds between writes of write probe')
+    health_group.add_argument('--probe-report', type=str, required=False,
+                              help='save write probe measurements of every failover to json file')
+
+    maintenance_group = parser.add_argument_group('maintenance')
+    maintenance_group.add_argument('--shared-clusters', type=str,
+                                   help='comma separated host:port of other clusters on the same servers, '
+                                        'plan failovers in all clusters for even masters count of servers')
+    maintenance_group.add_argument('--drain', type=str, required=False,
+                                   help='failover all masters from server (ip or hostname) to slaves on another servers')
+    maintenance_group.add_argument('--drain-out', type=str, required=False,
+                                   help='file for nodes snapshot before drain, default drain-<server>-<date>.json.gz')
+    maintenance_group.add_argument('--restore', type=str, required=False,
+                                   help='failover back masters from nodes file of --save-nodes or --drain-out that are slaves now')
+    maintenance_group.add_argument('--restore-host', type=str, required=False,
+                                   help='restore only masters of server (ip or hostname)')
+    maintenance_group.add_argument('--concurrency', type=int, default=4, help='maximum number of concurrent failovers or slots migrations')
+    maintenance_group.add_argument('--desired-state', type=str,
+                                   help='json file with desired master and replicas placement of shards, plan minimal failovers '
+                                        'and replicates to reach it')
+    maintenance_group.add_argument('--reconcile-interval', type=int, default=0,
+                                   help='with --desired-state check and reach desired state every seconds without prompt, 0 for once')
+    maintenance_group.add_argument('--reshard', action='store_true',
+                                   help='move minimal number of slots between masters to make slots distribution even')
+    maintenance_group.add_argument('--migrate-batch', type=int, default=100, help='number of keys in one MIGRATE command')
+    maintenance_group.add_argument('--migrate-pipeline', type=int, default=10, help='number of MIGRATE commands in one pipeline')
+    maintenance_group.add_argument('--max-keys-per-sec', type=float, default=0,
+                                   help='limit of migrated keys per second, 0 for unlimited')
+    maintenance_group.add_argument('--rolling-restart', action='store_true',
+                                   help='restart all servers by waves: drain, restart, wait full resync and restore masters')
+    maintenance_group.add_argument('--restart-command', type=str, required=False,
+                                   help="shell command for restart of server instances with {host} placeholder, "
+                                        "like 'ssh {host} systemctl restart redis-cluster'. Tool waits Enter if not defined")
+    maintenance_group.add_argument('--sync-timeout', type=float, default=3600,
+                                   help='maximum seconds to wait full resync of restarted instances')
+
     # Example of inventory group
     # inventory_group = parser.add_argument_group('inventory')
     # inventory_group.add_argument("--inventory-host", type=str, default="somehost", help="Inventory host")
 
+    history_group = parser.add_argument_group('history')
+    history_group.add_argument('--history', type=str, required=False,
+                               help='topology history file, topology is appended on every run, reconcile tick and after execution')
+    history_group.add_argument('--history-at', type=str, required=False,
+                               help='print topology of history at time (iso date or unix time)')
+    history_group.add_argument('--history-host', type=str, required=False,
+                               help='print masters count of server (ip or hostname) over time from history')
+    history_group.add_argument('--history-failovers', action='store_true', help='print failovers from history')
+    history_group.add_argument('--history-from', type=str, required=False, help='start of --history-host and --history-failovers window')
+    history_group.add_argument('--history-to', type=str, required=False, help='end of --history-host and --history-failovers window')
+
+    batch_group = parser.add_argument_group('batch')
+    batch_group.add_argument('--batch-dir', type=str, required=False,
+                             help='print metrics of every --save-nodes snapshot in directory, snapshots are analyzed in --batch-workers processes')
+    batch_group.add_argument('--batch-out', type=str, required=False, help='save batch metrics to csv file instead of stdout')
+    batch_group.add_argument('--batch-workers', type=int, default=1, help='number of processes for --batch-dir analytics')
+
     debug_group = parser.add_argument_group('debug')
     debug_group_mutual = debug_group.add_mutually_exclusive_group()
     debug_group_mutual.add_argument('--save-nodes', type=str, required=False,
-                                    help='save original nodes objects in json file')
+                                    help='save nodes snapshot with inventory answers to compressed file')
     debug_group_mutual.add_argument('--load-nodes', type=str, required=False,
-                                    help='load original nodes objects from json file')
+                                    help='load nodes snapshot or plain json nodes file of old versions')
+    debug_group.add_argument('--save-info', action='store_true', help='save all INFO fields of nodes to --save-nodes snapshot')
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -1997,30 +5624,97 @@ if __name__ == '__main__':
     # example
     # inventory_helper = MyInventory(host=args.inventory_host)
 
+    if args.batch_dir:
+        snapshots = sorted(filter(isfile, map(lambda name: join(args.batch_dir, name), listdir(args.batch_dir))))
+        batch_out = open(args.batch_out, 'w', newline='') if args.batch_out else sys.stdout
+        writer = csv.DictWriter(batch_out, fieldnames=RedisClusterTool.METRICS_FIELDS)
+        writer.writeheader()
+        with ProcessPoolExecutor(max_workers=args.batch_workers) as executor:
+            # rows are written in snapshots order as soon as they are ready
+            for metrics in executor.map(snapshot_metrics_worker, snapshots, itertools.repeat(args.simple), itertools.repeat(args.replicas),
+                                        itertools.repeat(args.reduce), itertools.repeat(args.capacity),
+                                        chunksize=max(1, len(snapshots) // (args.batch_workers * 4))):
+                writer.writerow(metrics)
+        if args.batch_out:
+            batch_out.close()
+            print(f'Metrics of {len(snapshots)} snapshots saved to {args.batch_out}')
+        sys.exit(0)
+
+    if args.history and (args.history_at or args.history_host or args.history_failovers):
+        history = TopologyHistory(args.history)
+        history_from, history_to = history.parse_time(args.history_from), history.parse_time(args.history_to)
+        if args.history_at:
+            history_nodes = history.get_nodes(history.get_state(history.parse_time(args.history_at)))
+            if not history_nodes:
+                print(f'History has no topology at {args.history_at}')
+                sys.exit(1)
+            if args.simple or not all(map(lambda node: node.get('datacenter'), history_nodes)):
+                cluster = RedisClusterTool(host=args.host, port=args.port, passwd=redis_password, skipconnection=True)
+            else:
+                history_inventory = SnapshotInventory({node['host']: {'ip': node['host'], 'dc': node['datacenter'],
+                                                                      'fqdn': node.get('hostname', node['host'])}
+                                                       for node in history_nodes})
+                cluster = RedisClusterToolDatacenter(host=args.host, port=args.port, passwd=redis_password, inventory=history_inventory,
+                                                     skipconnection=True)
+            cluster.currentnodes = history_nodes
+            print(f'Cluster at {args.history_at} had instances per group:')
+            cluster.print_cluster_info()
+        if args.history_host:
+            print(f'Masters of {args.history_host}:')
+            for timestamp, count in history.get_host_masters(host=args.history_host, start=history_from, end=history_to):
+                print(f'    {history.format_time(timestamp)} {count}')
+        if args.history_failovers:
+            print('Failovers:')
+            for failover in history.get_failovers(start=history_from, end=history_to):
+                print(f"    {history.format_time(failover['time'])} node {failover['node_id']} {failover['host']}:{failover['port']} "
+                      f"became master instead of {failover['old_master_id']}")
+        sys.exit(0)
+
     # debug
     if args.save_nodes:
         if args.simple or not inventory_helper:
-            cluster = RedisClusterTool(host=args.host, port=args.port, passwd=redis_password)
+            cluster = RedisClusterTool(host=args.host, port=args.port, passwd=redis_password, balance_by=args.balance_by)
         else:
-            cluster = RedisClusterToolDatacenter(host=args.host, port=args.port, passwd=redis_password, inventory=inventory_helper)
-        with open(args.save_nodes, 'w') as f:
-            json.dump(cluster.currentnodes, f)
+            cluster = RedisClusterToolDatacenter(host=args.host, port=args.port, passwd=redis_password, inventory=inventory_helper,
+                                                 balance_by=args.balance_by)
+        cluster.save_snapshot(args.save_nodes, info=args.save_info)
     elif args.load_nodes:
+        snapshot_header, snapshot_inventory, snapshot_nodes = RedisClusterTool.read_snapshot(args.load_nodes)
+        # snapshot is replayed with saved inventory answers
+        if snapshot_inventory:
+            inventory_helper = SnapshotInventory(snapshot_inventory)
         if args.simple or not inventory_helper:
             cluster = RedisClusterTool(host=args.host, port=args.port, passwd=redis_password,
-                                       skipconnection=True)
+                                       skipconnection=True, balance_by=args.balance_by)
         else:
             cluster = RedisClusterToolDatacenter(host=args.host, port=args.port, passwd=redis_password, inventory=inventory_helper,
-                                                 skipconnection=True)
-        with open(args.load_nodes, 'r') as f:
-            cluster.currentnodes = json.load(f)
+                                                 skipconnection=True, balance_by=args.balance_by)
+        cluster.currentnodes = list(snapshot_nodes)
+        cluster.inventory_answers = snapshot_inventory
+        balance_field = RedisClusterTool.BALANCE_MODES[args.balance_by]
+        if balance_field and any(map(lambda node: node.get('info', dict()).get(balance_field) is None, cluster.get_masters())):
+            print(f"Nodes snapshot {args.load_nodes} doesn't have INFO {balance_field} of masters for balancing by {args.balance_by}, "
+                  f"save it with --save-nodes and --balance-by {args.balance_by} or --save-info")
+            sys.exit(1)
+        if snapshot_header.get('created'):
+            print(f"Nodes snapshot of {snapshot_header.get('cluster')} captured at {snapshot_header['created']}")
     else:
         if args.simple or not inventory_helper:
             cluster = RedisClusterTool(host=args.host, port=args.port, passwd=redis_password,
-                                       onlyconnected=args.alive_only)
+                                       onlyconnected=args.alive_only, balance_by=args.balance_by)
         else:
             cluster = RedisClusterToolDatacenter(host=args.host, port=args.port, passwd=redis_password, inventory=inventory_helper,
-                                                 onlyconnected=args.alive_only)
+                                                 onlyconnected=args.alive_only, balance_by=args.balance_by)
+    if args.capacity:
+        cluster.load_capacities(args.capacity)
+    if args.history and not args.load_nodes:
+        cluster.history = TopologyHistory(args.history)
+        cluster.record_history()
+    cluster.retry_policy = RetryPolicy(max_delay=args.retry_max_delay, deadline=args.retry_deadline)
+    cluster.slots_check = not args.no_slots_check
+    cluster.write_probe, cluster.probe_interval, cluster.probe_report = args.write_probe, args.probe_interval / 1000, args.probe_report
+    health_gate = None if args.no_health_gate else HealthGate(max_latency=args.max_latency, max_ops=args.max_ops,
+                                                              max_wait=args.health_wait)
     if isinstance(cluster, RedisClusterToolDatacenter):
         skew_params = {'skew': args.skew, 'groupskew': args.group_skew}
     else:
@@ -2029,6 +5723,162 @@ if __name__ == '__main__':
     if not args.replicas:
         args.replicas = cluster.get_current_replicas_count()
 
+    if args.drain:
+        failed_nodes = cluster.check_failed_nodes()
+        if failed_nodes:
+            print(f'Cluster has failed status node(s): {failed_nodes}')
+            sys.exit(2)
+        cluster.plan_drain(host=args.drain, maxport=args.reduce)
+        for plan in cluster.plans:
+            print(plan['msg'])
+        if not cluster.plans:
+            print(f'Server {args.drain} has no masters')
+        if not cluster.plans or args.dry_run:
+            sys.exit(0)
+        print('Proceed? y/n')
+        while True:
+            choice = input().lower()
+            if choice in ('yes', 'y', 'ye'):
+                drain_out = args.drain_out or f"drain-{args.drain}-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.json.gz"
+                cluster.save_snapshot(drain_out)
+                print(f'Nodes before drain saved to {drain_out}')
+                failed_plans = cluster.cluster_failovers_execute(concurrency=args.concurrency, timeout=args.timeout, gate=health_gate)
+                sys.exit(1 if failed_plans else 0)
+            elif choice in ('no', 'n'):
+                sys.exit(0)
+            else:
+                print("Please respond with 'yes' or 'no'")
+
+    if args.shared_clusters:
+        addresses = list(map(lambda address: (address.rsplit(':', 1)[0], int(address.rsplit(':', 1)[1])), args.shared_clusters.split(',')))
+        cluster_kwargs = {'passwd': redis_password, 'onlyconnected': args.alive_only, 'balance_by': args.balance_by}
+        if isinstance(cluster, RedisClusterToolDatacenter):
+            cluster_kwargs['inventory'] = cluster.inventory
+        balancer = SharedHostsBalancer(clusters=[cluster] + SharedHostsBalancer.collect(type(cluster), addresses, **cluster_kwargs),
+                                       skew=args.skew)
+        for shared_cluster in balancer.clusters[1:]:
+            shared_cluster.capacities = cluster.capacities
+            shared_cluster.retry_policy = cluster.retry_policy
+            shared_cluster.slots_check = cluster.slots_check
+            shared_cluster.write_probe, shared_cluster.probe_interval = cluster.write_probe, cluster.probe_interval
+            shared_cluster.probe_report, shared_cluster.execution_report = cluster.probe_report, cluster.execution_report
+        print('Shared hosts before:')
+        balancer.print_hosts_load(maxport=args.reduce)
+        planned_nodes_list = balancer.plan(maxport=args.reduce)
+        for shared_cluster in balancer.clusters:
+            print(f'Cluster {shared_cluster.host}:{shared_cluster.port} plan:')
+            for plan in shared_cluster.plans:
+                print(plan['msg'])
+        print('Shared hosts after:')
+        balancer.print_hosts_load(nodes_list=planned_nodes_list, maxport=args.reduce)
+        if not any(map(lambda shared_cluster: shared_cluster.plans, balancer.clusters)) or args.dry_run:
+            sys.exit(0)
+        print('Proceed? y/n')
+        while True:
+            choice = input().lower()
+            if choice in ('yes', 'y', 'ye'):
+                for shared_cluster in balancer.clusters:
+                    shared_cluster.cluster_plan_execute(timeout=args.timeout, gate=health_gate)
+                sys.exit(0)
+            elif choice in ('no', 'n'):
+                sys.exit(0)
+            else:
+                print("Please respond with 'yes' or 'no'")
+
+    if args.desired_state:
+        desired_state = cluster.load_desired_state(args.desired_state)
+        while True:
+            cluster.plan_desired_state(desired_state, replicas=args.replicas, maxport=args.reduce)
+            for plan in cluster.plans:
+                print(plan['msg'])
+            if not cluster.plans:
+                print('Cluster is in desired state')
+            elif not args.dry_run:
+                choice = 'y' if args.reconcile_interval else ''
+                while choice not in ('yes', 'y', 'ye', 'no', 'n'):
+                    print('Proceed? y/n')
+                    choice = input().lower()
+                if choice in ('no', 'n'):
+                    sys.exit(0)
+                cluster.cluster_plan_execute(timeout=args.timeout, gate=health_gate)
+            if not args.reconcile_interval:
+                sys.exit(0)
+            sleep(args.reconcile_interval)
+            cluster.plans = list()
+            cluster.currentnodes = cluster.get_current_nodes()
+            cluster.record_history()
+
+    if args.reshard:
+        moves = cluster.plan_reshard(weights=cluster.get_reshard_weights())
+        for move in moves:
+            source, target = cluster.get_node(nodeid=move['source']), cluster.get_node(nodeid=move['target'])
+            print(f"Move {len(move['slots'])} slots from {source['node_id']} {source['host']}:{source['port']} "
+                  f"to {target['node_id']} {target['host']}:{target['port']}")
+        if not moves:
+            print('Slots are distributed evenly')
+        if not moves or args.dry_run:
+            sys.exit(0)
+        print(f"Proceed to move {sum(map(lambda move: len(move['slots']), moves))} slots? y/n")
+        while True:
+            choice = input().lower()
+            if choice in ('yes', 'y', 'ye'):
+                cluster.cluster_migrate_slots(moves=moves, concurrency=args.concurrency, batch=args.migrate_batch,
+                                              pipeline=args.migrate_pipeline, max_keys_per_sec=args.max_keys_per_sec)
+                sys.exit(0)
+            elif choice in ('no', 'n'):
+                sys.exit(0)
+            else:
+                print("Please respond with 'yes' or 'no'")
+
+    if args.rolling_restart:
+        failed_nodes = cluster.check_failed_nodes()
+        if failed_nodes:
+            print(f'Cluster has failed status node(s): {failed_nodes}')
+            sys.exit(2)
+        waves = cluster.plan_rolling_waves()
+        for number, wave in enumerate(waves, start=1):
+            print(f"Wave {number}/{len(waves)}: {', '.join(wave)}")
+            if args.restart_command:
+                for host in wave:
+                    print(f'    {cluster.format_restart_command(args.restart_command, host)}')
+        if args.dry_run:
+            sys.exit(0)
+        print('Proceed? y/n')
+        while True:
+            choice = input().lower()
+            if choice in ('yes', 'y', 'ye'):
+                cluster.cluster_rolling_restart(restart_command=args.restart_command, replicas=args.replicas, concurrency=args.concurrency,
+                                                timeout=args.timeout, sync_timeout=args.sync_timeout, gate=health_gate)
+                sys.exit(0)
+            elif choice in ('no', 'n'):
+                sys.exit(0)
+            else:
+                print("Please respond with 'yes' or 'no'")
+
+    if args.restore:
+        failed_nodes = cluster.check_failed_nodes()
+        if failed_nodes:
+            print(f'Cluster has failed status node(s): {failed_nodes}')
+            sys.exit(2)
+        cluster.plan_restore(snapshot=cluster.load_snapshot(args.restore), host=args.restore_host)
+        for plan in cluster.plans:
+            print(plan['msg'])
+        if not cluster.plans:
+            print('Nothing to restore')
+        if not cluster.plans or args.dry_run:
+            sys.exit(0)
+        print('Proceed? y/n')
+        while True:
+            choice = input().lower()
+            if choice in ('yes', 'y', 'ye'):
+                failed_plans = cluster.cluster_failovers_execute(concurrency=args.concurrency, timeout=args.timeout, wait_sync=True,
+                                                                 gate=health_gate)
+                sys.exit(1 if failed_plans else 0)
+            elif choice in ('no', 'n'):
+                sys.exit(0)
+            else:
+                print("Please respond with 'yes' or 'no'")
+
     if args.nagios and cluster.check_distribution_ok(**skew_params,
                                                      replicas=args.replicas) != 0:  # adapt for nagios
         print(f'Cluster has a problems. Run {__file__}')
@@ -2039,6 +5889,8 @@ if __name__ == '__main__':
     if failed_nodes:
         print(f'Cluster has failed status node(s): {failed_nodes}')
         sys.exit(2)
+    for slots_problem in cluster.check_slots():
+        print(f'Cluster has slots problem: {slots_problem}')
     print('Now cluster has instances per group:')
     cluster.print_cluster_info()
 
@@ -2051,99 +5903,109 @@ if __name__ == '__main__':
     if args.dry_run:
         sys.exit(cluster.check_distribution_ok(**skew_params, replicas=args.replicas))
 
-    if not cluster.check_distribution_possibility(replicas=args.replicas):
-        print("Can't place all master-slave groups on different groups")
-        sys.exit(1)
-
-    # prepare
-    planned_nodes = deepcopy(cluster.currentnodes)
-
-    masters_without_slots = cluster.check_master_without_slots(nodes=planned_nodes)
-    if masters_without_slots and not args.noslots_ok:
-        print('There are masters without slots, refusing to operate. Add --noslots_ok if you still wish to continue')
-        print(masters_without_slots)
-        sys.exit(1)
-
-    # reduce slave nodes
-    if cluster.get_max_port() > args.reduce:
-        for n in itertools.count(start=1, step=1):
-            if n > 1000:
-                for plan in cluster.plans:
-                    print(plan['msg'])
-                raise Exception('Too many cycles. Stuck in a cycle during reducing nodes'
-                                ' Maybe you need to increase skew parameter')
-
-            master_nodes_for_slave: list = list(
-                filter(lambda node: node['port'] > args.reduce, cluster.get_masters(nodes=planned_nodes)))
-
-            if master_nodes_for_slave:
-                for masternode in master_nodes_for_slave:
-                    slavenodeid = cluster.find_candidate_for_failover(nodes=planned_nodes, maxport=args.reduce,
-                                                                      masternodeid=masternode['node_id'])
-                    if slavenodeid:
-                        planned_nodes = cluster.plan_clusternode_failover(nodes=planned_nodes, slavenodeid=slavenodeid)
-                        continue
-                    slave_node_for_replicate_candidate = cluster.find_slave_candidate_for_master_to_replicate(
-                        nodes=planned_nodes, maxport=args.reduce,
-                        masternodeid=masternode['node_id'])
-                    planned_nodes = cluster.plan_clusternode_replicate(nodes=planned_nodes, masternodeid=masternode['node_id'],
-                                                                       slavenodeid=slave_node_for_replicate_candidate)
-                    planned_nodes = cluster.plan_clusternode_failover(nodes=planned_nodes,
-                                                                      slavenodeid=slave_node_for_replicate_candidate)
-                    break
-            else:
-                break
-    if not args.fix_only:
-        distribution_check = cluster.check_distribution_ok(**skew_params, nodes=planned_nodes,
-                                                               replicas=args.replicas, maxport=args.reduce)
-        if distribution_check != 0 or args.force:
-            planned_nodes = cluster.levelout_masters(nodes=planned_nodes, maxport=args.reduce)
-            planned_nodes = cluster.levelout_slaves(nodes=planned_nodes, replicas=args.replicas, maxport=args.reduce)
+    if args.plan_in:
+        with open(args.plan_in, 'r') as f:
+            planned_nodes = cluster.import_plans(plan=json.load(f))
+        print(f'\nPlan from {args.plan_in} matches current cluster topology')
     else:
-        # fix problems
-        for n in itertools.count(start=1, step=1):
-            if n > 1000:
-                for plan in cluster.plans:
-                    print(plan['msg'])
-                raise Exception('Too many cycles. Is it stuck in a cycle? Maybe you need to increase skew parameter')
-
-            master_does_not_have_slaves_resolve = cluster.cluster_resolve_master_problem(
-                problems=cluster.check_master_does_not_have_slaves(nodes=planned_nodes, maxport=args.reduce),
-                nodes=planned_nodes, maxport=args.reduce, replicas=args.replicas)
-            if master_does_not_have_slaves_resolve:
-                planned_nodes = master_does_not_have_slaves_resolve
-                continue
+        if not cluster.check_distribution_possibility(replicas=args.replicas):
+            print(f"Can't place all master-slave groups on different groups, maximum replicas count in different groups is "
+                  f"{cluster.get_max_replica_spread()}")
+            sys.exit(1)
+
+        # prepare
+        planned_nodes = deepcopy(cluster.currentnodes)
+
+        masters_without_slots = cluster.check_master_without_slots(nodes=planned_nodes)
+        if masters_without_slots and not args.noslots_ok:
+            print('There are masters without slots, refusing to operate. Add --noslots_ok if you still wish to continue')
+            print(masters_without_slots)
+            sys.exit(1)
+
+        # reduce slave nodes
+        if cluster.get_max_port() > args.reduce:
+            for n in itertools.count(start=1, step=1):
+                if n > 1000:
+                    for plan in cluster.plans:
+                        print(plan['msg'])
+                    raise Exception('Too many cycles. Stuck in a cycle during reducing nodes'
+                                    ' Maybe you need to increase skew parameter')
+
+                master_nodes_for_slave: list = list(
+                    filter(lambda node: node['port'] > args.reduce, cluster.get_masters(nodes=planned_nodes)))
+
+                if master_nodes_for_slave:
+                    for masternode in master_nodes_for_slave:
+                        slavenodeid = cluster.find_candidate_for_failover(nodes=planned_nodes, maxport=args.reduce,
+                                                                          masternodeid=masternode['node_id'])
+                        if slavenodeid:
+                            planned_nodes = cluster.plan_clusternode_failover(nodes=planned_nodes, slavenodeid=slavenodeid)
+                            continue
+                        slave_node_for_replicate_candidate = cluster.find_slave_candidate_for_master_to_replicate(
+                            nodes=planned_nodes, maxport=args.reduce,
+                            masternodeid=masternode['node_id'])
+                        planned_nodes = cluster.plan_clusternode_replicate(nodes=planned_nodes, masternodeid=masternode['node_id'],
+                                                                           slavenodeid=slave_node_for_replicate_candidate)
+                        planned_nodes = cluster.plan_clusternode_failover(nodes=planned_nodes,
+                                                                          slavenodeid=slave_node_for_replicate_candidate)
+                        break
+                else:
+                    break
+        if args.planner == 'search':
+            planned_nodes = cluster.plan_search(nodes=planned_nodes, **skew_params, replicas=args.replicas, maxport=args.reduce,
+                                                beam_width=args.beam_width, time_budget=args.plan_time_budget,
+                                                cost=PlanCost(skew=0) if args.fix_only else PlanCost())
+        elif not args.fix_only:
+            distribution_check = cluster.check_distribution_ok(**skew_params, nodes=planned_nodes,
+                                                                   replicas=args.replicas, maxport=args.reduce)
+            if distribution_check != 0 or args.force:
+                planned_nodes = cluster.levelout_masters(nodes=planned_nodes, maxport=args.reduce, **skew_params)
+                planned_nodes = cluster.levelout_slaves(nodes=planned_nodes, replicas=args.replicas, maxport=args.reduce)
+        else:
+            # fix problems
+            for n in itertools.count(start=1, step=1):
+                if n > 1000:
+                    for plan in cluster.plans:
+                        print(plan['msg'])
+                    raise Exception('Too many cycles. Is it stuck in a cycle? Maybe you need to increase skew parameter')
+
+                master_does_not_have_slaves_resolve = cluster.cluster_resolve_master_problem(
+                    problems=cluster.check_master_does_not_have_slaves(nodes=planned_nodes, maxport=args.reduce),
+                    nodes=planned_nodes, maxport=args.reduce, replicas=args.replicas)
+                if master_does_not_have_slaves_resolve:
+                    planned_nodes = master_does_not_have_slaves_resolve
+                    continue
 
-            masterslave_in_group_resolve = cluster.cluster_resolve_slave_problem(
-                problems=cluster.check_masterslave_in_group(nodes=planned_nodes, replicas=args.replicas,
-                                                            maxport=args.reduce),
-                nodes=planned_nodes, maxport=args.reduce, replicas=args.replicas)
-            if masterslave_in_group_resolve:
-                planned_nodes = masterslave_in_group_resolve
-                continue
+                masterslave_in_group_resolve = cluster.cluster_resolve_slave_problem(
+                    problems=cluster.check_masterslave_in_group(nodes=planned_nodes, replicas=args.replicas,
+                                                                maxport=args.reduce),
+                    nodes=planned_nodes, maxport=args.reduce, replicas=args.replicas)
+                if masterslave_in_group_resolve:
+                    planned_nodes = masterslave_in_group_resolve
+                    continue
 
-            master_does_not_have_desired_replica_count_resolve = cluster.cluster_resolve_master_problem(
-                problems=list(
-                    cluster.check_master_does_not_have_desired_replica_count(nodes=planned_nodes, replicas=args.replicas,
-                                                                             maxport=args.reduce).keys()),
-                nodes=planned_nodes, maxport=args.reduce, replicas=args.replicas)
-            if master_does_not_have_desired_replica_count_resolve:
-                planned_nodes = master_does_not_have_desired_replica_count_resolve
-                continue
+                master_does_not_have_desired_replica_count_resolve = cluster.cluster_resolve_master_problem(
+                    problems=list(
+                        cluster.check_master_does_not_have_desired_replica_count(nodes=planned_nodes, replicas=args.replicas,
+                                                                                 maxport=args.reduce).keys()),
+                    nodes=planned_nodes, maxport=args.reduce, replicas=args.replicas)
+                if master_does_not_have_desired_replica_count_resolve:
+                    planned_nodes = master_does_not_have_desired_replica_count_resolve
+                    continue
 
-            slaveofmaster_on_group_resolve = cluster.cluster_resolve_slave_problem(
-                problems=cluster.check_slavesofmaster_in_group(nodes=planned_nodes, maxport=args.reduce,
-                                                               replicas=args.replicas),
-                nodes=planned_nodes, maxport=args.reduce, replicas=args.replicas)
-            if slaveofmaster_on_group_resolve:
-                planned_nodes = slaveofmaster_on_group_resolve
-                continue
+                slaveofmaster_on_group_resolve = cluster.cluster_resolve_slave_problem(
+                    problems=cluster.check_slavesofmaster_in_group(nodes=planned_nodes, maxport=args.reduce,
+                                                                   replicas=args.replicas),
+                    nodes=planned_nodes, maxport=args.reduce, replicas=args.replicas)
+                if slaveofmaster_on_group_resolve:
+                    planned_nodes = slaveofmaster_on_group_resolve
+                    continue
 
-            if cluster.check_distribution_ok(**skew_params, nodes=planned_nodes,
-                                             replicas=args.replicas, maxport=args.reduce) in (
-                    0, 1):  # if OK or WARN (skew check) it's OK
-                break
-            raise Exception("All problems was resolved, but checks not ok")
+                if cluster.check_distribution_ok(**skew_params, nodes=planned_nodes,
+                                                 replicas=args.replicas, maxport=args.reduce) in (
+                        0, 1):  # if OK or WARN (skew check) it's OK
+                    break
+                raise Exception("All problems was resolved, but checks not ok")
 
     if cluster.plans:
         print('Printing new plan:')
@@ -2151,7 +6013,17 @@ if __name__ == '__main__':
             print(plan['msg'])
         print()
         print(
-            f"It will take {len(cluster.plans)} iterations with timeout {args.timeout} and will take {datetime.timedelta(seconds=args.timeout * len(cluster.plans))} time")
+            f"It will take {len(cluster.plans)} iterations with timeout {args.timeout}")
+        simulations = cluster.print_plan_simulation(simulator=PlanSimulator(timeout=args.timeout, host_syncs=args.host_syncs,
+                                                                            datacenter_syncs=args.datacenter_syncs),
+                                                    timeline=args.simulate)
+        sync_bytes = sum(map(lambda plan: plan.get('sync_bytes', 0), cluster.plans))
+        if sync_bytes:
+            print(f"Full syncs will transfer {round(sync_bytes / 1024 ** 2, 1)} MB and will take "
+                  f"{datetime.timedelta(seconds=round(sum(map(lambda plan: plan.get('sync_time', 0), cluster.plans))))} time")
+        catch_up = sum(map(lambda plan: plan.get('catch_up', 0), cluster.plans))
+        if catch_up:
+            print(f"Replicas are expected to catch up with masters before failovers in {datetime.timedelta(seconds=catch_up)}")
 
     # print cluster info
     print("\nCluster will have instances per group:")
@@ -2164,14 +6036,23 @@ if __name__ == '__main__':
         print('    None')
     print()
 
+    if args.simulate:
+        sys.exit(0)
+
+    if args.plan_out:
+        with open(args.plan_out, 'w') as f:
+            json.dump(cluster.export_plans(), f, indent=2)
+        print(f'Plan saved to {args.plan_out}')
+        sys.exit(0)
+
     if cluster.plans:
         print(f'Proceed plan to execute with timeout {args.timeout} seconds between operations? y/n')
         while True:
             choice = input().lower()
             if choice in ('yes', 'y', 'ye'):
                 print(
-                    f"Will be finished at {(datetime.datetime.now() + datetime.timedelta(seconds=args.timeout * len(cluster.plans))).strftime('%Y-%m-%d %H:%M')}")
-                cluster.cluster_plan_execute(timeout=args.timeout)
+                    f"Will be finished at {(datetime.datetime.now() + datetime.timedelta(seconds=simulations['serial']['duration'])).strftime('%Y-%m-%d %H:%M')}")
+                cluster.cluster_plan_execute(timeout=args.timeout, gate=health_gate)
                 sys.exit(0)
             elif choice in ('no', 'n'):
                 sys.exit(0) if cluster.check_distribution_ok() == 0 else sys.exit(1)
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import sys
+from typing import Any, Dict, List
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redisclustertool as rct  # noqa: E402
+
+
+def get_node_id(*parts: Any) -> str:
+    """
+    return stable 40 chars node id of parts
+
+    :param parts: values like host and port
+    :return: sha1 hex digest
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def get_node(host: str, port: int, master_id: str = '-', slots: List[List[str]] = None, **fields: Any) -> Dict[str, Any]:
+    """
+    return node dict like redis-py CLUSTER NODES answer
+
+    :param host: ip of node
+    :param port: port of node
+    :param master_id: master id for slave, '-' for master
+    :param slots: slots ranges of master
+    :param fields: other fields like datacenter or info
+    :return: node dict
+    """
+    node = {'node_id': get_node_id(host, port), 'host': host, 'port': port, 'flags': 'master' if master_id == '-' else 'slave',
+            'master_id': master_id, 'last_ping_sent': '0', 'last_pong_rcvd': '0', 'epoch': '1', 'slots': slots or [],
+            'connected': True}
+    node.update(fields)
+    return node
+
+
+@pytest.fixture
+def make_nodes():
+    """
+    return factory of nodes lists: masters are placed on hosts round robin (or by layout of host indexes) with slots split
+    equally, replicas of master are placed on other hosts, bad masters have the first replica on own host
+    """
+
+    def factory(hosts: int = 3, masters: int = 3, replicas: int = 1, bad: tuple = (), datacenters: int = None,
+                layout: List[int] = None, **fields: Any) -> List[Dict[str, Any]]:
+        ips = [f'10.0.0.{index + 1}' for index in range(hosts)]
+        ports = {ip: 7000 for ip in ips}
+        nodes = []
+
+        def place(ip: str, master_id: str = '-', slots: List[List[str]] = None) -> Dict[str, Any]:
+            extra = dict(fields)
+            if datacenters:
+                extra.update({'datacenter': f'DC{ips.index(ip) % datacenters + 1}', 'hostname': f'host{ips.index(ip) + 1}'})
+            node = get_node(ip, ports[ip], master_id=master_id, slots=slots, **extra)
+            ports[ip] += 1
+            nodes.append(node)
+            return node
+
+        if layout is None:
+            layout = [index % hosts for index in range(masters)]
+        for index, host in enumerate(layout):
+            start, end = index * 16384 // len(layout), (index + 1) * 16384 // len(layout) - 1
+            masternode = place(ips[host], slots=[[str(start), str(end)]])
+            for replica in range(replicas):
+                ip = ips[host] if index in bad and replica == 0 else ips[(host + 1 + (replica + index) % max(1, hosts - 1)) % hosts]
+                place(ip, master_id=masternode['node_id'])
+        return nodes
+
+    return factory
+
+
+@pytest.fixture
+def make_tool():
+    """
+    return factory of tools without connection to cluster with current nodes as records
+    """
+
+    def factory(nodes: List[Dict[str, Any]], datacenter: bool = False, **kwargs: Any) -> rct.RedisClusterTool:
+        if datacenter:
+            tool = rct.RedisClusterToolDatacenter('127.0.0.1', 7000, None, inventory=None, skipconnection=True, **kwargs)
+        else:
+            tool = rct.RedisClusterTool('127.0.0.1', 7000, None, skipconnection=True, **kwargs)
+        tool.currentnodes = rct.RedisClusterTool.pack_nodes(nodes)
+        return tool
+
+    return factory
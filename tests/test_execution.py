@@ -0,0 +1,152 @@
+import json
+import random
+
+import pytest
+import redis
+
+import redisclustertool as rct
+
+
+def get_step(sync, nodes, hosts, datacenters=(), sync_time=0, catch_up=0):
+    return {'msg': f'step {sorted(nodes)}', 'sync': sync, 'sync_time': sync_time, 'catch_up': catch_up, 'nodes': set(nodes),
+            'hosts': set(hosts), 'datacenters': set(datacenters)}
+
+
+@pytest.fixture
+def steps():
+    return [get_step(True, ['n1', 'm1'], ['h1', 'h2'], sync_time=100),
+            get_step(True, ['n2', 'm2'], ['h1', 'h3'], sync_time=50),
+            get_step(False, ['n1'], ['h2'], catch_up=2)]
+
+
+def test_plan_simulator_serial(steps):
+    simulation = rct.PlanSimulator(timeout=90).run(steps, strategy='serial')
+    assert simulation['timeline'] == [(0.0, 100.0), (100.0, 150.0), (190.0, 202.0)]
+    assert simulation['duration'] == 202.0
+    assert simulation['critical_path'] == [0, 1, 2]
+    assert simulation['peak_syncs'] == 1
+
+
+def test_plan_simulator_parallel_host_limit(steps):
+    simulation = rct.PlanSimulator(host_syncs=1).run(steps, strategy='parallel')
+    # second sync waits for the first one on the same server, failover waits for sync of the same node
+    assert simulation['timeline'] == [(0.0, 100.0), (100.0, 150.0), (100.0, 112.0)]
+    assert simulation['duration'] == 150.0
+    assert simulation['critical_path'] == [0, 1]
+    assert simulation['peak_syncs'] == 1
+
+    simulation = rct.PlanSimulator(host_syncs=2).run(steps, strategy='parallel')
+    assert simulation['timeline'] == [(0.0, 100.0), (0.0, 50.0), (100.0, 112.0)]
+    assert simulation['critical_path'] == [0, 2]
+    assert simulation['peak_syncs'] == 2
+
+
+def test_plan_simulator_errors(steps):
+    with pytest.raises(Exception, match='Unknown simulation strategy'):
+        rct.PlanSimulator().run(steps, strategy='random')
+    with pytest.raises(Exception, match="can't be started with sync limits"):
+        rct.PlanSimulator(datacenter_syncs=0).run([get_step(True, ['n1', 'm1'], ['h1'], datacenters=['DC1'])])
+    assert rct.PlanSimulator().run([])['duration'] == 0.0
+
+
+def test_plan_simulator_dependencies(steps):
+    assert rct.PlanSimulator.get_dependencies(steps) == [[], [], [0]]
+
+
+def test_get_simulation_steps(make_nodes, make_tool):
+    tool = make_tool(make_nodes(hosts=3, masters=3, replicas=1, datacenters=2))
+    master = tool.get_masters()[0]
+    slave = tool.get_slaves(masternodeid=master['node_id'])[0]
+    othermaster = tool.get_masters()[1]
+    nodes = tool.plan_clusternode_failover(slavenodeid=slave['node_id'])
+    tool.plan_clusternode_replicate(masternodeid=othermaster['node_id'], slavenodeid=master['node_id'], nodes=nodes)
+    failover, replicate = tool.get_simulation_steps()
+    assert not failover['sync']
+    assert failover['nodes'] == {master['node_id'], slave['node_id']}
+    assert failover['hosts'] == {master['host'], slave['host']}
+    assert replicate['sync']
+    assert replicate['nodes'] == {master['node_id'], othermaster['node_id']}
+    assert replicate['datacenters'] == {master['datacenter'], othermaster['datacenter']}
+
+
+def test_health_gate_check():
+    gate = rct.HealthGate(max_latency=100.0, max_ops=1000)
+    assert gate.check({}, {'instantaneous_ops_per_sec': 10}, {'cluster_state': 'ok'}, latency=1.0) == []
+    assert gate.check({}, {'master_sync_in_progress': 1, 'rdb_bgsave_in_progress': 0, 'aof_rewrite_in_progress': 1,
+                           'instantaneous_ops_per_sec': 5000}, {'cluster_state': 'fail'}, latency=150.123) == \
+        ['cluster_state:fail', 'master_sync_in_progress', 'aof_rewrite_in_progress', 'latency 150.12ms > 100.0ms',
+         'instantaneous_ops_per_sec 5000 > 1000']
+    assert rct.HealthGate(max_latency=None).check({}, {}, {'cluster_state': 'ok'}, latency=1000.0) == []
+
+
+def test_health_gate_backoff():
+    gate = rct.HealthGate(min_backoff=5.0, max_backoff=30.0)
+    assert list(map(gate.backoff, range(5))) == [5.0, 10.0, 20.0, 30.0, 30.0]
+
+
+def test_retry_policy_is_retryable():
+    policy = rct.RetryPolicy()
+    assert policy.is_retryable(redis.exceptions.ConnectionError('Connection refused'))
+    assert policy.is_retryable(redis.exceptions.TimeoutError('Timeout reading from socket'))
+    assert policy.is_retryable(redis.exceptions.ResponseError('LOADING Redis is loading the dataset in memory'))
+    assert policy.is_retryable(redis.exceptions.ResponseError('BUSY Redis is busy running a script'))
+    # AuthenticationError is ConnectionError, but retry can't fix it
+    assert not policy.is_retryable(redis.exceptions.AuthenticationError('invalid password'))
+    assert not policy.is_retryable(redis.exceptions.ResponseError('ERR Unknown node'))
+    assert not policy.is_retryable(ValueError('LOADING'))
+
+
+def test_retry_policy_delay():
+    random.seed(1)
+    policy = rct.RetryPolicy(base_delay=1.0, max_delay=10.0)
+    for attempt in range(10):
+        assert 0 <= policy.delay(attempt) <= min(10.0, 2 ** attempt)
+
+
+def test_write_probe_slot_key():
+    for slot in (0, 100, 16383):
+        key = rct.WriteProbe.get_slot_key(slot)
+        assert key.startswith(rct.WriteProbe.KEY_PREFIX)
+        assert rct.key_slot(key.encode('utf-8')) == slot
+    assert rct.WriteProbe('127.0.0.1', 7000, slot=100).key == rct.WriteProbe.get_slot_key(100)
+
+
+def test_write_probe_stop_without_start():
+    assert rct.WriteProbe('127.0.0.1', 7000, slot=0).stop() == {
+        'started': None, 'unavailable': None, 'redirects': 0, 'errors': 0, 'probes': 0, 'p50': None, 'p99': None, 'max': None}
+
+
+def test_plan_export_import_round_trip(make_nodes, make_tool):
+    tool = make_tool(make_nodes(hosts=3, masters=3, replicas=1))
+    master = tool.get_masters()[0]
+    slave = tool.get_slaves(masternodeid=master['node_id'])[0]
+    nodes = tool.plan_clusternode_failover(slavenodeid=slave['node_id'])
+    planned = tool.plan_clusternode_replicate(masternodeid=tool.get_masters()[1]['node_id'], slavenodeid=master['node_id'],
+                                              nodes=nodes)
+    plan = json.loads(json.dumps(tool.export_plans()))
+    assert plan['version'] == tool.PLAN_VERSION
+    assert [step['command'].split()[:2] for step in plan['steps']] == [['CLUSTER', 'FAILOVER'], ['CLUSTER', 'REPLICATE']]
+
+    tool.plans = []
+    imported = tool.import_plans(plan)
+    assert len(tool.plans) == 2
+    assert tool.get_topology_fingerprint(nodes=imported) == tool.get_topology_fingerprint(nodes=planned)
+    assert [(step['kwargs']['ip'], step['kwargs']['port'], step['kwargs']['command']) for step in tool.plans] == \
+        [(step['host'], step['port'], step['command']) for step in plan['steps']]
+
+
+def test_plan_import_checks_fingerprint(make_nodes, make_tool):
+    tool = make_tool(make_nodes(hosts=3, masters=3, replicas=1, info={'used_memory': 100}))
+    slave = tool.get_slaves()[0]
+    tool.plan_clusternode_failover(slavenodeid=slave['node_id'])
+    plan = tool.export_plans()
+    # fingerprint doesn't depend on nodes order and INFO
+    tool.currentnodes.reverse()
+    tool.currentnodes[0]['info'] = {'used_memory': 200}
+    tool.import_plans(plan)
+    # planned failover was made by someone else
+    tool.currentnodes = tool.plan_clusternode_failover(slavenodeid=slave['node_id'], dryrun=True)
+    with pytest.raises(Exception, match='Cluster topology was changed since plan creation'):
+        tool.import_plans(plan)
+    with pytest.raises(Exception, match='Unknown plan version'):
+        tool.import_plans(dict(plan, version=plan['version'] + 1))
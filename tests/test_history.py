@@ -0,0 +1,91 @@
+import pytest
+
+import redisclustertool as rct
+
+
+@pytest.fixture
+def timeline(make_nodes, make_tool):
+    """
+    return nodes lists at times 10, 20, 30, 40: failover of the first shard, its failback and failover of the second shard
+    """
+    tool = make_tool(make_nodes(hosts=3, masters=3, replicas=1, datacenters=2))
+    first, second = tool.get_masters()[:2]
+    firstslave = tool.get_slaves(masternodeid=first['node_id'])[0]
+    secondslave = tool.get_slaves(masternodeid=second['node_id'])[0]
+    failover = tool.plan_clusternode_failover(slavenodeid=firstslave['node_id'], dryrun=True, deep_copy=True)
+    failback = tool.plan_clusternode_failover(slavenodeid=first['node_id'], nodes=failover, dryrun=True, deep_copy=True)
+    second_failover = tool.plan_clusternode_failover(slavenodeid=secondslave['node_id'], nodes=failback, dryrun=True, deep_copy=True)
+    return {10.0: tool.currentnodes, 20.0: failover, 30.0: failback, 40.0: second_failover}, first, firstslave, secondslave
+
+
+def record_timeline(history, timeline):
+    for timestamp, nodes in timeline.items():
+        assert history.record(nodes, timestamp=timestamp)
+        # the same topology isn't written again
+        assert not history.record(nodes, timestamp=timestamp + 1)
+
+
+def test_history_get_state(timeline, tmp_path):
+    nodes_by_time = timeline[0]
+    history = rct.TopologyHistory(str(tmp_path / 'history'), keyframe_interval=2)
+    record_timeline(history, nodes_by_time)
+    assert history.get_state(5.0) == {}
+    for timestamp, nodes in nodes_by_time.items():
+        state = {node['node_id']: history.get_node_state(node) for node in nodes}
+        assert history.get_state(timestamp) == state
+        assert history.get_state(timestamp + 5) == state
+    restored = rct.TopologyHistory.get_nodes(history.get_state(20.0))
+    assert [(node['node_id'], 'master' in node['flags'], node['master_id'], node['slots'], node['datacenter']) for node in restored] == \
+        [(node['node_id'], 'master' in node['flags'], node['master_id'], node['slots'], node['datacenter'])
+         for node in sorted(nodes_by_time[20.0], key=lambda node: (node['host'], node['port']))]
+
+
+def test_history_keyframe_replay(timeline, tmp_path):
+    nodes_by_time = timeline[0]
+    path = str(tmp_path / 'history')
+    history = rct.TopologyHistory(path, keyframe_interval=2)
+    record_timeline(history, dict(list(nodes_by_time.items())[:3]))
+    assert [keyframe[0] for keyframe in history.keyframes] == [10.0, 30.0]
+
+    # new history object replays records from the last keyframe of index
+    replayed = rct.TopologyHistory(path, keyframe_interval=2)
+    assert replayed.keyframes == history.keyframes
+    assert replayed.get_last_state() == history.get_last_state()
+    assert not replayed.record(nodes_by_time[30.0], timestamp=35.0)
+    assert replayed.record(nodes_by_time[40.0], timestamp=40.0)
+    assert [keyframe[0] for keyframe in replayed.keyframes] == [10.0, 30.0]
+    for timestamp, nodes in nodes_by_time.items():
+        assert replayed.get_state(timestamp) == {node['node_id']: replayed.get_node_state(node) for node in nodes}
+
+
+def test_history_failovers(timeline, tmp_path):
+    nodes_by_time, first, firstslave, secondslave = timeline
+    history = rct.TopologyHistory(str(tmp_path / 'history'), keyframe_interval=2)
+    record_timeline(history, nodes_by_time)
+    assert [(failover['time'], failover['node_id'], failover['old_master_id']) for failover in history.get_failovers()] == \
+        [(20.0, firstslave['node_id'], first['node_id']), (30.0, first['node_id'], firstslave['node_id']),
+         (40.0, secondslave['node_id'], secondslave['master_id'])]
+    assert [failover['time'] for failover in history.get_failovers(start=25.0, end=35.0)] == [30.0]
+    assert history.get_failovers(start=41.0) == []
+
+
+def test_history_host_masters(timeline, tmp_path):
+    nodes_by_time, first, firstslave, secondslave = timeline
+    history = rct.TopologyHistory(str(tmp_path / 'history'), keyframe_interval=2)
+    record_timeline(history, nodes_by_time)
+    counts = {timestamp: sum(map(lambda node: 'master' in node['flags'] and node['host'] == first['host'], nodes))
+              for timestamp, nodes in nodes_by_time.items()}
+    assert list(counts.values()) == [1, 0, 1, 2]
+    assert history.get_host_masters(first['host']) == list(counts.items())
+    # count at start of window is count of the last record before it
+    assert history.get_host_masters(first['host'], start=25.0) == [(25.0, 0), (30.0, 1), (40.0, 2)]
+    assert history.get_host_masters(first['host'], start=31.0, end=39.0) == [(31.0, 1)]
+    assert history.get_host_masters(first['hostname'], start=41.0) == [(41.0, 2)]
+    assert rct.TopologyHistory(str(tmp_path / 'missing')).get_host_masters(first['host']) == []
+
+
+def test_history_parse_time():
+    assert rct.TopologyHistory.parse_time(None) is None
+    assert rct.TopologyHistory.parse_time('10.5') == 10.5
+    timestamp = rct.TopologyHistory.parse_time('2021-01-12T03:12:00')
+    assert rct.TopologyHistory.format_time(timestamp) == '2021-01-12T03:12:00'
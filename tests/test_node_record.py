@@ -0,0 +1,77 @@
+import json
+from array import array
+from copy import deepcopy
+
+import pytest
+
+import redisclustertool as rct
+
+
+def test_node_record_fields(make_nodes):
+    node = make_nodes(hosts=2, masters=2)[0]
+    record = rct.NodeRecord(node)
+    assert record['node_id'] == node['node_id']
+    assert record['port'] == 7000
+    assert record['flags'] == 'master'
+    assert record['connected'] is True
+    assert record.slots == array('H', [0, 8191])
+    assert record['slots'] == [['0', '8191']]
+    assert record['epoch'] == '1'
+    assert record.get('datacenter') is None
+    with pytest.raises(KeyError):
+        _ = record['datacenter']
+
+
+def test_node_record_to_dict_round_trip(make_nodes):
+    for node in make_nodes(hosts=3, masters=3, replicas=1, datacenters=2, info={'used_memory': 100}):
+        record = rct.NodeRecord(node)
+        assert rct.NodeRecord(record.to_dict()).to_dict() == record.to_dict()
+        assert {key: value for key, value in record.to_dict().items() if key != 'migrations'} == node
+        # json form of --save-nodes
+        assert rct.NodeRecord(json.loads(json.dumps(record.to_dict()))).to_dict() == record.to_dict()
+
+
+def test_node_record_flags_mask():
+    mask = rct.NodeRecord.get_flags_mask('myself,master')
+    assert mask & rct.NodeRecord.MASTER
+    assert not mask & rct.NodeRecord.SLAVE
+    assert rct.NodeRecord.get_flags_string(mask | rct.NodeRecord.CONNECTED) == 'myself,master'
+    assert rct.NodeRecord.get_flags_mask(('slave', 'fail')) == rct.NodeRecord.get_flags_mask('slave,fail')
+    assert rct.NodeRecord.get_flags_mask('') == 0
+
+
+def test_node_record_set_items(make_nodes):
+    record = rct.NodeRecord(make_nodes(hosts=2, masters=1)[1])
+    record['flags'] = 'master'
+    record['master_id'] = '-'
+    record['slots'] = [['100', '200'], ['300']]
+    record['connected'] = False
+    record['hostname'] = 'host1'
+    assert 'master' in record['flags'] and 'slave' not in record['flags']
+    assert record['slots'] == [['100', '200'], ['300', '300']]
+    assert record['connected'] is False
+    assert 'hostname' in record and record['hostname'] == 'host1'
+    assert record.setdefault('datacenter', 'DC1') == 'DC1'
+    assert record.keys()[-2:] == ['hostname', 'datacenter']
+
+
+def test_node_record_deepcopy_shares_info(make_nodes):
+    record = rct.NodeRecord(make_nodes(hosts=2, masters=1, info={'used_memory': 100})[0])
+    copied = deepcopy(record)
+    copied['slots'] = []
+    copied['flags'] = 'slave'
+    assert record['slots'] == [['0', '16383']]
+    assert record['flags'] == 'master'
+    # INFO fields requested later must reach planned copies of nodes
+    record['info']['master_repl_offset'] = 10
+    assert copied['info']['master_repl_offset'] == 10
+
+
+def test_pack_and_unpack_nodes(make_nodes):
+    nodes = make_nodes(hosts=3, masters=3, replicas=1)
+    records = rct.RedisClusterTool.pack_nodes(nodes)
+    assert all(map(lambda record: type(record) is rct.NodeRecord, records))
+    # records are kept as is
+    assert rct.RedisClusterTool.pack_nodes(records)[0] is records[0]
+    assert [{key: value for key, value in node.items() if key != 'migrations'}
+            for node in rct.RedisClusterTool.unpack_nodes(records)] == nodes
@@ -0,0 +1,147 @@
+from collections import Counter, OrderedDict
+
+import pytest
+
+import redisclustertool as rct
+
+
+def get_problems_count(tool, nodes, replicas):
+    return +tool.count_problems(tool.get_problems(nodes=nodes, replicas=replicas))
+
+
+@pytest.mark.parametrize('datacenter', [False, True])
+def test_shard_problems_match_checks(make_nodes, make_tool, datacenter):
+    tool = make_tool(make_nodes(hosts=4, masters=8, replicas=2, bad=(1, 5), datacenters=2 if datacenter else None),
+                     datacenter=datacenter)
+    for replicas in (1, 2, 3):
+        shards = tool.get_shard_problems(replicas=replicas)
+        assert +shards.total == get_problems_count(tool, tool.currentnodes, replicas)
+
+
+@pytest.mark.parametrize('datacenter', [False, True])
+def test_shard_problems_delta_of_steps(make_nodes, make_tool, datacenter):
+    tool = make_tool(make_nodes(hosts=4, masters=8, replicas=2, bad=(1, 5), datacenters=2 if datacenter else None),
+                     datacenter=datacenter)
+    shards = tool.get_shard_problems(replicas=2)
+    masters = tool.get_masters()
+    for slavenode in tool.get_slaves():
+        problems, fingerprint = shards.failover(slavenode['node_id'])
+        nodes = tool.plan_clusternode_failover(slavenodeid=slavenode['node_id'], dryrun=True, deep_copy=True)
+        assert +problems == get_problems_count(tool, nodes, 2)
+        assert fingerprint == tool.get_shard_problems(nodes=nodes, replicas=2).fingerprint()
+        for masternode in masters[:3]:
+            if masternode['node_id'] == slavenode['master_id']:
+                continue
+            problems, fingerprint = shards.replicate(slavenode['node_id'], masternode['node_id'])
+            nodes = tool.plan_clusternode_replicate(masternodeid=masternode['node_id'], slavenodeid=slavenode['node_id'],
+                                                    dryrun=True, deep_copy=True)
+            assert +problems == get_problems_count(tool, nodes, 2)
+            assert fingerprint == tool.get_shard_problems(nodes=nodes, replicas=2).fingerprint()
+
+
+def test_master_counter_skew_after_move():
+    counter = rct.MasterCounter({'a': 3, 'b': 1, 'c': 2})
+    assert counter.skew() == 33.33
+    assert counter.skew(decrement='a', increment='b') == 0
+    counter.move(decrement='a', increment='b')
+    assert counter == Counter({'a': 2, 'b': 2, 'c': 2})
+    assert counter.skew() == 0
+
+
+def test_master_counter_capacity():
+    counter = rct.MasterCounter({'a': 4, 'b': 2}, capacities={'a': 2, 'b': 1})
+    assert counter.percent(counter['a']) == 66.67
+    assert counter.percent(counter['a'], group='a') == 50.0
+    assert counter.skew() == 0
+
+
+def test_master_counter_excess_has_no_plateau():
+    counter = rct.MasterCounter({'a': 3, 'b': 3, 'c': 1, 'd': 1, 'e': 2, 'f': 2})
+    assert counter.skew() == 16.67
+    # one failover doesn't change max-min skew, but decreases masters count to move
+    assert counter.skew(decrement='a', increment='c') == 16.67
+    assert counter.excess(15) == 4
+    assert counter.excess(15, decrement='a', increment='c') == 2
+    assert counter.excess(20) == 0
+
+
+def test_plan_cost_transient_deficit():
+    cost = rct.PlanCost()
+    initial = Counter({'masterslave_in_group': 2})
+    swapped = Counter({'masterslave_in_group': 1, 'desired_replica_count': 1})
+    assert cost.transient(swapped, initial) == 1
+    assert cost.residual(swapped, {'group': 0}, initial=initial) == cost.problem + cost.replicate
+    assert cost.residual(swapped, {'group': 0}) == 2 * cost.problem
+    # fix of skew is always cheaper than residual skew
+    assert cost.residual(Counter(), {'group': 1}) > cost.failover
+
+
+@pytest.mark.parametrize('datacenter', [False, True])
+def test_plan_search_fixes_problems(make_nodes, make_tool, datacenter):
+    tool = make_tool(make_nodes(hosts=4, masters=8, replicas=1, bad=(1, 2, 6), datacenters=2 if datacenter else None),
+                     datacenter=datacenter)
+    skew_params = {'skew': 15, 'groupskew': 30} if datacenter else {'skew': 15}
+    before = get_problems_count(tool, tool.currentnodes, 1)
+    nodes = tool.plan_search(replicas=1, time_budget=30, **skew_params)
+    after = get_problems_count(tool, nodes, 1)
+    assert sum(after.values()) < sum(before.values())
+    assert all(map(lambda check: after[check] <= before[check], after))
+    assert tool.plans
+
+
+def test_plan_search_fixes_skew_over_allowed(make_tool, make_nodes):
+    # 12 masters on 6 servers like 3,3,1,1,2,2: every single failover keeps max-min skew
+    tool = make_tool(make_nodes(hosts=6, replicas=1, layout=[0, 0, 0, 1, 1, 1, 2, 3, 4, 4, 5, 5]))
+    assert tool.get_skews(skew=15) == {'group': 1.67}
+    nodes = tool.plan_search(replicas=1, time_budget=30, skew=15)
+    assert tool.get_skews(nodes=nodes, skew=15) == {'group': 0}
+    assert not get_problems_count(tool, nodes, 1)
+
+
+def test_get_search_moves_replicate_misplaced_slave(make_tool, make_nodes):
+    tool = make_tool(make_nodes(hosts=4, masters=4, replicas=1, bad=(0,)))
+    shards = tool.get_shard_problems(replicas=1)
+    distribution = tool.get_master_distribution()
+    moves = tool.get_search_moves(shards=shards, distribution=distribution)
+    badslave = tool.get_slaves(masternodeid=tool.get_masters()[0]['node_id'])[0]
+    assert any(map(lambda move: move[0] == 'CLUSTER REPLICATE' and move[1] == badslave['node_id'], moves))
+    # replicate opens replica deficit of old master, so the next step is replicate to it
+    shards = tool.get_shard_problems(nodes=tool.plan_clusternode_replicate(
+        masternodeid=next(move[2] for move in moves if move[1] == badslave['node_id']), slavenodeid=badslave['node_id'],
+        dryrun=True, deep_copy=True), replicas=1)
+    assert shards.total['desired_replica_count'] == 1
+    moves = tool.get_search_moves(shards=shards, distribution=distribution)
+    assert ('CLUSTER REPLICATE', tool.get_masters()[0]['node_id']) in map(lambda move: (move[0], move[2]), moves)
+
+
+def test_get_max_replica_spread(make_nodes, make_tool):
+    tool = make_tool(make_nodes(hosts=3, masters=3, replicas=1))
+    assert tool.get_max_replica_spread() == 1
+    assert tool.check_distribution_possibility(replicas=1)
+    assert not tool.check_distribution_possibility(replicas=2)
+    tool = make_tool(make_nodes(hosts=3, masters=3, replicas=2))
+    assert tool.get_max_replica_spread() == 2
+    tool = make_tool(make_nodes(hosts=4, masters=3, replicas=2))
+    assert tool.get_max_replica_spread() == 2
+    assert tool.get_max_replica_spread(nodes=[]) is None
+
+
+def test_split_by_weights():
+    assert rct.RedisClusterTool.split_by_weights(10, OrderedDict([('a', 1), ('b', 1), ('c', 1)])) == \
+        OrderedDict([('a', 4), ('b', 3), ('c', 3)])
+    assert rct.RedisClusterTool.split_by_weights(16384, OrderedDict([('a', 3), ('b', 1)])) == \
+        OrderedDict([('a', 12288), ('b', 4096)])
+    assert sum(rct.RedisClusterTool.split_by_weights(16384, OrderedDict([('a', 1), ('b', 2), ('c', 4)])).values()) == 16384
+
+
+def test_plan_reshard(make_nodes, make_tool):
+    tool = make_tool(make_nodes(hosts=2, masters=2, replicas=0))
+    first, second = tool.get_masters()
+    first['slots'] = [['0', '12000']]
+    second['slots'] = [['12001', '16383']]
+    assert tool.plan_reshard() == [{'source': first['node_id'], 'target': second['node_id'], 'slots': list(range(8192, 12001))}]
+    moves = tool.plan_reshard(weights={first['node_id']: 1, second['node_id']: 3})
+    assert moves == [{'source': first['node_id'], 'target': second['node_id'], 'slots': list(range(4096, 12001))}]
+    first['slots'] = [['0', '8191']]
+    second['slots'] = [['8192', '16383']]
+    assert tool.plan_reshard() == []
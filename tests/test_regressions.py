@@ -0,0 +1,139 @@
+import io
+from collections import Counter
+from contextlib import redirect_stdout
+
+import pytest
+
+import redisclustertool as rct
+from conftest import get_node_id
+
+
+def get_cluster_nodes(nodes, offset):
+    """
+    return nodes of another cluster on the same hosts: ports are shifted by offset and node ids are renewed
+    """
+    ids = dict()
+    for node in nodes:
+        node['port'] += offset
+        ids[node['node_id']] = node['node_id'] = get_node_id(node['host'], node['port'])
+    for node in nodes:
+        node['master_id'] = ids.get(node['master_id'], node['master_id'])
+    return nodes
+
+
+def test_share_desc_prints_real_share_and_normalized(make_nodes, make_tool, tmp_path):
+    # regression of user-040: normalized percent was printed as masters share
+    tool = make_tool(make_nodes(hosts=2, layout=[0, 0, 1], replicas=1))
+    config = tmp_path / 'capacity.ini'
+    config.write_text('[hosts]\n10.0.0.1 = 2\n')
+    tool.load_capacities(str(config))
+    distribution = tool.get_master_distribution()
+    assert tool.get_share_desc(distribution.groups, '10.0.0.1') == '66.67% masters, 50.0% normalized by capacity'
+    assert tool.get_share_desc(distribution.groups, '10.0.0.2', scope=' of datacenter') == \
+        '33.33% masters of datacenter, 50.0% normalized by capacity'
+    assert distribution.groups.skew() == 0
+    tool = make_tool(make_nodes(hosts=2, layout=[0, 0, 1], replicas=1))
+    assert tool.get_share_desc(tool.get_master_distribution().groups, '10.0.0.1') == '66.67% masters'
+
+
+def test_shared_hosts_skip_slaves_in_master_group(make_nodes, make_tool):
+    # regression of user-041: slave in datacenter of master was failed over like by levelout of other clusters
+    clusters = [make_tool(get_cluster_nodes(make_nodes(hosts=4, layout=[0, 0, 1, 1], replicas=1, datacenters=2), offset),
+                          datacenter=True) for offset in (0, 100)]
+    balancer = rct.SharedHostsBalancer(clusters, skew=30)
+    load = balancer.get_hosts_load()
+    assert load == Counter({'10.0.0.1': 4, '10.0.0.2': 4, '10.0.0.3': 0})
+    # failover from 10.0.0.1 to its slave on 10.0.0.3 makes load even, but both are in DC1,
+    # failover from 10.0.0.2 to 10.0.0.3 moves master to DC1 and exceeds skew between datacenters
+    masters = map(lambda slave: clusters[0].get_node(nodeid=slave['master_id']),
+                  filter(lambda slave: slave['host'] == '10.0.0.3', clusters[0].get_slaves()))
+    assert sorted(map(lambda masternode: (masternode['host'], masternode['datacenter']), masters)) == \
+        [('10.0.0.1', 'DC1'), ('10.0.0.2', 'DC2')]
+    assert balancer.get_load_delta(load, decrement='10.0.0.1', increment='10.0.0.3') < 0
+    balancer.plan()
+    assert [cluster.plans for cluster in clusters] == [[], []]
+
+
+@pytest.mark.parametrize('link_status, plans', [('up', 1), ('down', 0)])
+def test_shared_hosts_skip_unhealthy_slaves(make_nodes, make_tool, link_status, plans):
+    # regression of user-041: slaves with down master link were failed over
+    clusters = [make_tool(get_cluster_nodes(make_nodes(hosts=3, layout=[0, 0, 1, 2], replicas=1, bad=(0,)), offset))
+                for offset in (0, 100)]
+    for cluster in clusters:
+        for slave in cluster.get_slaves():
+            slave['info'] = {'master_link_status': link_status}
+    balancer = rct.SharedHostsBalancer(clusters, skew=30)
+    nodes_list = balancer.plan()
+    assert sum(map(lambda cluster: len(cluster.plans), clusters)) == plans
+    if plans:
+        assert balancer.get_hosts_load(nodes_list=nodes_list).skew() < balancer.get_hosts_load().skew()
+
+
+def test_choose_failover_slave_prefers_link_up(make_nodes, make_tool):
+    tool = make_tool(make_nodes(hosts=3, masters=1, replicas=2))
+    slaves = tool.get_slaves()
+    slaves[0]['info'] = {'master_link_status': 'up'}
+    assert tool.choose_failover_slave(slaves=slaves) is slaves[0]
+    slaves[0]['info'] = {'master_link_status': 'down'}
+    assert tool.choose_failover_slave(slaves=slaves) is slaves[1]
+    assert not tool.is_failover_slave_healthy(slaves[0])
+    assert tool.is_failover_slave_healthy(slaves[1])
+
+
+@pytest.mark.parametrize('datacenter', [False, True])
+def test_desired_state_swaps_slaves_without_spare(make_nodes, make_tool, datacenter):
+    # regression of user-042: master wasn't moved to host without slave of shard when all slaves serve other shards
+    tool = make_tool(make_nodes(hosts=6, masters=6, replicas=2, datacenters=3 if datacenter else None), datacenter=datacenter)
+    master = next(filter(lambda node: node.slots[0] == 0, tool.get_masters()))
+    target = '10.0.0.4'
+    assert target not in map(lambda slave: slave['host'], tool.get_slaves(masternodeid=master['node_id']))
+    state = {'default': {'replicas': 2, 'distinct_groups': True}, 'shards': [{'slot': 0, 'master_host': [target]}]}
+    output = io.StringIO()
+    with redirect_stdout(output):
+        nodes = tool.plan_desired_state(state, replicas=2)
+    assert 'no slave for master of slot 0' not in output.getvalue()
+    masters = tool.get_masters(nodes=nodes)
+    assert next(filter(lambda node: node.slots[0] == 0, masters))['host'] == target
+    # every shard keeps replicas
+    replicas = Counter(map(lambda slave: slave['master_id'], tool.get_slaves(nodes=nodes)))
+    assert all(map(lambda masternode: replicas[masternode['node_id']] == 2, masters))
+
+
+def test_failure_domains_check_region_and_rack_only(make_nodes, make_tool):
+    # regression of user-043: datacenter spread was reported by tree in addition to groups checks
+    nodes = make_nodes(hosts=4, masters=4, replicas=1, datacenters=2)
+    for node in nodes:
+        node['rack'] = f"rack{node['host'][-1]}"
+    tool = make_tool(nodes, datacenter=True)
+    assert tool.FAILURE_DOMAIN_CHECK_LEVELS == ('region', 'rack')
+    assert tool.get_failure_domains().spread_problems('datacenter')
+    assert tool.check_failure_domains() == {}
+
+    # racks are shared by hosts 10.0.0.2 and 10.0.0.4 of the same datacenter
+    for node in nodes:
+        node['rack'] = 'rack2' if node['host'] in ('10.0.0.2', '10.0.0.4') else f"rack{node['host'][-1]}"
+    tool = make_tool(nodes, datacenter=True)
+    assert tool.check_failure_domains() == {'rack': tool.get_failure_domains().spread_problems('datacenter')}
+
+
+@pytest.mark.parametrize('hosts, layout, replicas, spread', [(3, [0, 0, 0, 0], 1, 1), (4, [0, 0, 0, 0], 1, 1), (3, [0, 1, 2, 0], 2, 2)])
+def test_distribution_possibility_uneven_groups(make_nodes, make_tool, hosts, layout, replicas, spread):
+    # regression of user-044: every group gives at most one node to every shard
+    tool = make_tool(make_nodes(hosts=hosts, layout=layout, replicas=replicas))
+    assert tool.get_max_replica_spread() == spread
+    assert tool.check_distribution_possibility(replicas=spread)
+    assert not tool.check_distribution_possibility(replicas=spread + 1)
+
+
+def test_failover_moves_packed_slots(make_nodes, make_tool):
+    # regression of user-045: slots are moved by packed array, node['slots'] keeps redis-py ranges
+    tool = make_tool(make_nodes(hosts=3, masters=3, replicas=1))
+    master = tool.get_masters()[0]
+    slave = tool.get_slaves(masternodeid=master['node_id'])[0]
+    nodes = tool.plan_clusternode_failover(slavenodeid=slave['node_id'], dryrun=True, deep_copy=True)
+    newmaster = tool.get_node(nodes=nodes, nodeid=slave['node_id'])
+    assert newmaster['slots'] == [['0', '5460']]
+    assert tool.get_slots_count(newmaster) == 5461
+    assert tool.get_node(nodes=nodes, nodeid=master['node_id'])['slots'] == []
+    assert master['slots'] == [['0', '5460']]
+    assert rct.SlotMap(nodes).problems() == []
@@ -0,0 +1,61 @@
+from copy import deepcopy
+
+import pytest
+
+import redisclustertool as rct
+
+
+def test_slot_map_full_coverage(make_nodes):
+    assert rct.SlotMap(rct.RedisClusterTool.pack_nodes(make_nodes(hosts=3, masters=3))).problems() == []
+
+
+def test_slot_map_problems(make_nodes):
+    nodes = rct.RedisClusterTool.pack_nodes(make_nodes(hosts=2, masters=2, replicas=0))
+    nodes[0]['slots'] = [['0', '8000']]
+    nodes[1]['slots'] = [['7990', '16383']]
+    nodes[1]['migrations'] = [{'slot': '9000', 'node_id': nodes[0]['node_id'], 'state': 'migrating'}]
+    assert rct.SlotMap(nodes).problems() == ['11 slots are served by several nodes: 7990-8000',
+                                             '1 slots are in migrating state: 9000']
+    nodes[0]['slots'] = [['0', '100'], ['102', '7989']]
+    assert rct.SlotMap(nodes).problems()[0] == "1 slots aren't served by any node: 101"
+
+
+def test_slot_map_ranges():
+    slots = (1 << 0) | (1 << 1) | (1 << 2) | (1 << 10) | (1 << 16383)
+    assert rct.SlotMap.get_ranges(slots) == [[0, 2], [10, 10], [16383, 16383]]
+    assert rct.SlotMap.format_ranges(slots) == '0-2 10 16383'
+    assert rct.SlotMap.get_ranges(0) == []
+
+
+def test_get_slots_ranges(make_nodes):
+    record = rct.NodeRecord(make_nodes(hosts=1, masters=1, replicas=0)[0])
+    record['slots'] = [['10', '20'], ['0', '5']]
+    assert rct.RedisClusterTool.get_slots_ranges(record) == [[0, 5], [10, 20]]
+
+
+class ClaimsConnection:
+    """
+    connection of master that answers CLUSTER NODES with own slots
+    """
+
+    def __init__(self, node, slots):
+        self.node = node
+        self.slots = slots
+
+    def cluster(self, command):
+        return {f"{self.node['host']}:{self.node['port']}": {'flags': 'myself,master', 'slots': self.slots, 'migrations': []}}
+
+
+def test_verify_slots_finds_overlap_from_masters_claims(make_nodes, make_tool, monkeypatch):
+    # regression: one CLUSTER NODES view has only one owner of slot, overlap is seen only from claims of every master
+    tool = make_tool(make_nodes(hosts=2, masters=2, replicas=1))
+    masters = tool.get_masters()
+    claims = {masters[0]['node_id']: [['0', '9000']], masters[1]['node_id']: [['8192', '16383']]}
+    monkeypatch.setattr(rct.RedisClusterTool, 'get_current_nodes', lambda self, onlyconnected=False: deepcopy(self.currentnodes))
+    monkeypatch.setattr(tool, 'get_node_connection', lambda ip, port: ClaimsConnection(
+        *next((node, claims[node['node_id']]) for node in masters if (node['host'], node['port']) == (ip, port))))
+    assert tool.check_slots() == []
+    with pytest.raises(Exception, match='809 slots are served by several nodes: 8192-9000'):
+        tool.verify_slots(stage='before plan')
+    claims[masters[0]['node_id']] = [['0', '8191']]
+    tool.verify_slots(stage='before plan')
@@ -0,0 +1,56 @@
+import gzip
+import json
+
+import pytest
+
+import redisclustertool as rct
+
+
+def test_snapshot_round_trip(make_nodes, make_tool, tmp_path):
+    nodes = make_nodes(hosts=3, masters=3, replicas=1, datacenters=2, info={'used_memory': 100})
+    tool = make_tool(nodes)
+    path = str(tmp_path / 'nodes.json.gz')
+    tool.save_snapshot(path, nodes=tool.currentnodes)
+    header, inventory_answers, records = rct.RedisClusterTool.read_snapshot(path)
+    assert header['format'] == rct.RedisClusterTool.SNAPSHOT_FORMAT
+    assert header['version'] == rct.RedisClusterTool.SNAPSHOT_VERSION
+    assert header['nodes'] == len(nodes)
+    assert header['fields'][:3] == ['node_id', 'host', 'port']
+    assert inventory_answers == {}
+    records = list(records)
+    assert all(map(lambda record: type(record) is rct.NodeRecord, records))
+    assert [record.to_dict() for record in records] == [record.to_dict() for record in tool.currentnodes]
+    assert [record.to_dict() for record in rct.RedisClusterTool.load_snapshot(path)] == \
+        [record.to_dict() for record in tool.currentnodes]
+
+
+def test_snapshot_reads_plain_json(make_nodes, tmp_path):
+    nodes = make_nodes(hosts=2, masters=2, replicas=1)
+    path = tmp_path / 'nodes.json'
+    path.write_text(json.dumps(nodes))
+    header, inventory_answers, records = rct.RedisClusterTool.read_snapshot(str(path))
+    assert header == {'format': rct.RedisClusterTool.SNAPSHOT_FORMAT, 'version': 0}
+    assert inventory_answers == {}
+    assert [{key: value for key, value in record.to_dict().items() if key != 'migrations'} for record in records] == nodes
+
+
+@pytest.mark.parametrize('header', [{'format': 'other', 'version': 1},
+                                    {'format': rct.RedisClusterTool.SNAPSHOT_FORMAT, 'version': rct.RedisClusterTool.SNAPSHOT_VERSION + 1}])
+def test_snapshot_unsupported(tmp_path, header):
+    path = str(tmp_path / 'nodes.json.gz')
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps(header) + '\n')
+    with pytest.raises(Exception, match='Unsupported snapshot'):
+        rct.RedisClusterTool.read_snapshot(path)
+
+
+def test_snapshot_metrics_worker(make_nodes, make_tool, tmp_path):
+    tool = make_tool(make_nodes(hosts=3, masters=3, replicas=1, bad=(0,)))
+    path = str(tmp_path / 'nodes.json.gz')
+    tool.save_snapshot(path, nodes=tool.currentnodes)
+    metrics = rct.snapshot_metrics_worker(path)
+    assert metrics['snapshot'] == path
+    assert not metrics.get('error')
+    assert metrics['masters'] == 3
+    assert metrics['misplaced'] == 1
+    assert metrics['slots_problems'] == 0